@@ -0,0 +1,143 @@
+import os
+import gzip
+import threading
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# File suffix of each codec, 'none' stores plain UTF-8 text
+CODEC_SUFFIXES = {
+    'zstd': '.zst',
+    'gzip': '.gz',
+    'none': ''
+}
+
+class ContentStore:
+    """Reads and writes document content files, optionally compressed
+
+    Callers always use the logical path (e.g. `.../content.txt`); the file on
+    disk carries the codec's suffix (`content.txt.zst`, `content.txt.gz`).
+    Reads find whichever variant exists, so documents written before the
+    codec changed, or before compression was enabled, stay readable.
+    """
+
+    def __init__(self, codec: str = 'gzip', level: int = None, markdown: bool = True):
+        """
+        Args:
+            codec: zstd, gzip or none; zstd falls back to gzip without the zstandard package
+            level: Compression level, the codec's default when not set
+            markdown: Whether markdown is compressed too, raw content always is
+        """
+        if codec not in CODEC_SUFFIXES:
+            logger.warning(f"Unknown content codec {codec}, using gzip")
+            codec = 'gzip'
+        if codec == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed, compressing content with gzip")
+            codec = 'gzip'
+        self.codec = codec
+        self.level = level
+        self.markdown = markdown
+
+    def codec_for(self, path: str) -> str:
+        """Codec new content at this logical path is written with"""
+        if not self.markdown and path.endswith('.md'):
+            return 'none'
+        return self.codec
+
+    def locate(self, path: str):
+        """Actual file of a logical path, preferring the configured codec, or None if there is none"""
+        preferred = CODEC_SUFFIXES[self.codec_for(path)]
+        for suffix in [preferred] + [s for s in CODEC_SUFFIXES.values() if s != preferred]:
+            if os.path.exists(path + suffix):
+                return path + suffix
+        return None
+
+    def exists(self, path: str) -> bool:
+        return self.locate(path) is not None
+
+    def stat(self, path: str) -> os.stat_result:
+        """Stat the actual file of a logical path
+
+        Raises:
+            FileNotFoundError: If no variant of the file exists
+        """
+        actual = self.locate(path)
+        if actual is None:
+            raise FileNotFoundError(path)
+        return os.stat(actual)
+
+    def _encode(self, data: bytes, codec: str) -> bytes:
+        if codec == 'zstd':
+            return zstandard.ZstdCompressor(level=self.level or 3).compress(data)
+        if codec == 'gzip':
+            return gzip.compress(data, compresslevel=self.level or 6)
+        return data
+
+    def _decode(self, data: bytes, actual_path: str) -> bytes:
+        if actual_path.endswith('.zst'):
+            if zstandard is None:
+                raise RuntimeError(f"zstandard is required to read {actual_path}")
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        if actual_path.endswith('.gz'):
+            return gzip.decompress(data)
+        return data
+
+    def read_bytes(self, path: str) -> bytes:
+        """Read and decompress the content stored at a logical path
+
+        Raises:
+            FileNotFoundError: If no variant of the file exists
+        """
+        actual = self.locate(path)
+        if actual is None:
+            raise FileNotFoundError(path)
+        with open(actual, 'rb') as f:
+            return self._decode(f.read(), actual)
+
+    def read(self, path: str) -> str:
+        return self.read_bytes(path).decode('utf-8')
+
+    def write(self, path: str, text: str) -> int:
+        """Write text to a logical path with its codec and return the bytes on disk
+
+        The new file replaces the old one atomically, then variants left by
+        another codec are removed.
+        """
+        codec = self.codec_for(path)
+        actual = path + CODEC_SUFFIXES[codec]
+        data = self._encode(text.encode('utf-8'), codec)
+        os.makedirs(os.path.dirname(actual), exist_ok=True)
+        tmp_path = f"{actual}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, actual)
+        self._remove_variants(path, keep=actual)
+        return len(data)
+
+    def _remove_variants(self, path: str, keep: str):
+        for suffix in CODEC_SUFFIXES.values():
+            if path + suffix != keep and os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+    def recompress(self, path: str):
+        """Rewrite a stored file with its configured codec, returns (bytes_before, bytes_after)
+
+        Files that already use the configured codec are left alone and
+        reported with equal sizes. Returns None if the file does not exist.
+        """
+        actual = self.locate(path)
+        if actual is None:
+            return None
+        before = os.path.getsize(actual)
+        if actual == path + CODEC_SUFFIXES[self.codec_for(path)]:
+            return before, before
+        with open(actual, 'rb') as f:
+            data = self._decode(f.read(), actual)
+        after = self.write(path, data.decode('utf-8'))
+        return before, after
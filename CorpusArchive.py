@@ -0,0 +1,411 @@
+import os
+import io
+import json
+import gzip
+import time
+import base64
+import tarfile
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from storage_utils import retry_on_busy
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+ARCHIVE_VERSION = 1
+FORMATS = ('tar', 'tar.gz', 'jsonl', 'jsonl.gz')
+MIMETYPES = {
+    'tar': 'application/x-tar',
+    'tar.gz': 'application/gzip',
+    'jsonl': 'application/x-ndjson',
+    'jsonl.gz': 'application/gzip'
+}
+# Document columns written to an archive, documents get new IDs on import
+EXPORT_FIELDS = ('id', 'url', 'title', 'category_name', 'created_at', 'updated_at', 'etag', 'last_modified',
+                 'content_hash', 'simhash', 'canonical_id')
+
+def format_for_path(path: str):
+    """Archive format from a file name, None if the extension is not one of FORMATS"""
+    name = path.lower()
+    if name.endswith(('.tar.gz', '.tgz')):
+        return 'tar.gz'
+    for fmt in ('tar', 'jsonl.gz', 'jsonl'):
+        if name.endswith('.' + fmt):
+            return fmt
+    return None
+
+class _StreamBuffer:
+    """Write-only file object that collects what tarfile or gzip writes until it is drained"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+class ImportedDocument:
+    """One document read from an archive"""
+
+    def __init__(self, meta: dict):
+        self.meta = meta
+        self.markdown = ''
+        self.raw = ''
+        self.image_mapping = {}
+        self.images = {}
+
+    @property
+    def size(self) -> int:
+        return len(self.markdown) + len(self.raw) + sum(len(data) for data in self.images.values())
+
+class CorpusArchive:
+    """Streams the corpus to an archive and restores archives in batches
+
+    An archive holds a manifest with the categories, then every document's
+    metadata, markdown, raw content, image mapping and images, with paths
+    relative to the document so it can be restored into any storage.
+
+    tar archives have one folder per document (`documents/<id>/meta.json`
+    first, then `content.md`, `content.txt`, `image_mapping.json` and
+    `images/*`). JSONL archives have the manifest on the first line and one
+    document per line, images base64-encoded.
+
+    Exports read documents in ID order one page at a time and yield the
+    archive as it is written, so memory use does not grow with the corpus.
+    Imports write files and image blobs from a thread pool and insert each
+    batch of documents in one transaction.
+    """
+
+    def __init__(self, doc_storage):
+        self.doc_storage = doc_storage
+
+    @property
+    def conn(self):
+        return self.doc_storage.conn
+
+    @property
+    def busy_retries(self):
+        return self.doc_storage.busy_retries
+
+    def _manifest(self, category_id) -> dict:
+        categories = self.doc_storage.get_categories()
+        if category_id:
+            categories = [c for c in categories if c['id'] == category_id]
+        return {
+            'type': 'manifest',
+            'version': ARCHIVE_VERSION,
+            'exported_at': datetime.now().isoformat(),
+            'categories': [{'name': c['name'], 'created_at': c['created_at']} for c in categories]
+        }
+
+    def iter_documents(self, category_id=None, batch_size=500):
+        """Yield the document rows to export in ID order, one page at a time"""
+        cursor = self.conn.cursor()
+        last_id = 0
+        while True:
+            sql = '''
+                SELECT d.*, c.name AS category_name
+                FROM documents d
+                LEFT JOIN categories c ON d.category_id = c.id
+                WHERE d.id > ?
+            '''
+            params = [last_id]
+            if category_id:
+                sql += ' AND d.category_id = ?'
+                params.append(category_id)
+            sql += ' ORDER BY d.id LIMIT ?'
+            params.append(batch_size)
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield {field: row[field] for field in EXPORT_FIELDS}, row['markdown_path']
+            last_id = rows[-1]['id']
+
+    def _read_document(self, markdown_path, include_raw: bool) -> ImportedDocument:
+        """Load the stored files of a document, missing files are left empty"""
+        content_store = self.doc_storage.content_store
+        document = ImportedDocument({})
+        if not markdown_path:
+            return document
+        doc_dir = os.path.dirname(markdown_path)
+        if content_store.exists(markdown_path):
+            document.markdown = content_store.read(markdown_path)
+        raw_path = os.path.join(doc_dir, 'content.txt')
+        if include_raw and content_store.exists(raw_path):
+            document.raw = content_store.read(raw_path)
+        mapping_path = os.path.join(doc_dir, 'image_mapping.json')
+        if os.path.exists(mapping_path):
+            with open(mapping_path) as f:
+                document.image_mapping = json.load(f)
+        images_dir = os.path.join(doc_dir, 'images')
+        if os.path.isdir(images_dir):
+            for name in sorted(os.listdir(images_dir)):
+                with open(os.path.join(images_dir, name), 'rb') as f:
+                    document.images[name] = f.read()
+        return document
+
+    def export(self, fmt: str = 'tar.gz', category_id=None, include_raw: bool = True):
+        """Yield the archive of the corpus, or of one category, as byte chunks
+
+        Args:
+            fmt: One of FORMATS
+            category_id: Optional category to export
+            include_raw: Whether the raw page content is included
+
+        Raises:
+            ValueError: If the format is unknown
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown archive format: {fmt}")
+        if fmt.startswith('tar'):
+            return self._export_tar(fmt == 'tar.gz', category_id, include_raw)
+        return self._export_jsonl(fmt == 'jsonl.gz', category_id, include_raw)
+
+    def _export_tar(self, compress: bool, category_id, include_raw: bool):
+        buffer = _StreamBuffer()
+        now = time.time()
+
+        def add(tar, name, data: bytes):
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            info.mtime = now
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(data))
+
+        with tarfile.open(fileobj=buffer, mode='w|gz' if compress else 'w|') as tar:
+            add(tar, 'manifest.json', json.dumps(self._manifest(category_id), ensure_ascii=False).encode('utf-8'))
+            for meta, markdown_path in self.iter_documents(category_id):
+                document = self._read_document(markdown_path, include_raw)
+                prefix = f"documents/{meta['id']}"
+                add(tar, f'{prefix}/meta.json', json.dumps(meta, ensure_ascii=False).encode('utf-8'))
+                add(tar, f'{prefix}/content.md', document.markdown.encode('utf-8'))
+                if document.raw:
+                    add(tar, f'{prefix}/content.txt', document.raw.encode('utf-8'))
+                if document.image_mapping:
+                    add(tar, f'{prefix}/image_mapping.json', json.dumps(document.image_mapping).encode('utf-8'))
+                for name, data in document.images.items():
+                    add(tar, f'{prefix}/images/{name}', data)
+                yield buffer.drain()
+        yield buffer.drain()
+
+    def _export_jsonl(self, compress: bool, category_id, include_raw: bool):
+        buffer = _StreamBuffer()
+        out = gzip.GzipFile(fileobj=buffer, mode='wb') if compress else buffer
+
+        def write(record):
+            out.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+
+        write(self._manifest(category_id))
+        for meta, markdown_path in self.iter_documents(category_id):
+            document = self._read_document(markdown_path, include_raw)
+            record = {'type': 'document', 'meta': meta, 'markdown': document.markdown}
+            if include_raw:
+                record['raw'] = document.raw
+            record['image_mapping'] = document.image_mapping
+            record['images'] = {name: base64.b64encode(data).decode('ascii') for name, data in document.images.items()}
+            write(record)
+            yield buffer.drain()
+        if compress:
+            out.close()
+        yield buffer.drain()
+
+    def _read_tar(self, fileobj):
+        """Yield the manifest dict, then an ImportedDocument per document folder"""
+        document = None
+        with tarfile.open(fileobj=fileobj, mode='r|*') as tar:
+            for member in tar:
+                if not member.isfile():
+                    continue
+                data = tar.extractfile(member).read()
+                parts = member.name.split('/')
+                if member.name == 'manifest.json':
+                    yield json.loads(data)
+                    continue
+                if len(parts) < 3 or parts[0] != 'documents':
+                    logger.warning(f"Skipping unexpected archive entry {member.name}")
+                    continue
+                name = '/'.join(parts[2:])
+                if name == 'meta.json':
+                    if document:
+                        yield document
+                    document = ImportedDocument(json.loads(data))
+                elif document is None:
+                    logger.warning(f"Skipping {member.name}, it comes before its meta.json")
+                elif name == 'content.md':
+                    document.markdown = data.decode('utf-8')
+                elif name == 'content.txt':
+                    document.raw = data.decode('utf-8')
+                elif name == 'image_mapping.json':
+                    document.image_mapping = json.loads(data)
+                elif len(parts) == 4 and parts[2] == 'images':
+                    document.images[parts[3]] = data
+        if document:
+            yield document
+
+    def _read_jsonl(self, fileobj):
+        for line in fileobj:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record.get('type') == 'manifest':
+                yield record
+                continue
+            document = ImportedDocument(record['meta'])
+            document.markdown = record.get('markdown', '')
+            document.raw = record.get('raw', '')
+            document.image_mapping = record.get('image_mapping', {})
+            document.images = {name: base64.b64decode(data) for name, data in record.get('images', {}).items()}
+            yield document
+
+    def _category_ids(self, manifest: dict) -> dict:
+        """Map category names to IDs, creating the categories that do not exist"""
+        for category in manifest.get('categories', []):
+            self.doc_storage.add_category(category['name'])
+        return {c['name']: c['id'] for c in self.doc_storage.get_categories()}
+
+    def import_archive(self, fileobj, fmt: str, batch_size: int = 1000, workers: int = 8,
+                       max_batch_bytes: int = 64 * 1024 * 1024) -> dict:
+        """Restore documents from an archive, returns counts of imported and skipped documents
+
+        Documents whose URL is already stored are skipped. Near-duplicate
+        links between imported documents are restored with the new IDs.
+
+        Args:
+            fileobj: Binary file object positioned at the start of the archive
+            fmt: One of FORMATS
+            batch_size: Documents inserted per transaction
+            workers: Threads writing content files and image blobs
+            max_batch_bytes: A batch is also flushed once its content reaches this size
+
+        Raises:
+            ValueError: If the format is unknown
+        """
+        if fmt not in FORMATS:
+            raise ValueError(f"Unknown archive format: {fmt}")
+        if fmt == 'jsonl.gz':
+            fileobj = gzip.GzipFile(fileobj=fileobj, mode='rb')
+        records = self._read_tar(fileobj) if fmt.startswith('tar') else self._read_jsonl(fileobj)
+
+        stats = {'imported': 0, 'skipped': 0}
+        # Old ID -> new ID, and (new ID, old canonical ID) of flagged documents until their original is known
+        id_map = {}
+        flagged = []
+        categories = {}
+        batch = []
+        batch_bytes = 0
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            for record in records:
+                if isinstance(record, dict):
+                    categories = self._category_ids(record)
+                    continue
+                batch.append(record)
+                batch_bytes += record.size
+                if len(batch) >= batch_size or batch_bytes >= max_batch_bytes:
+                    self._import_batch(executor, batch, categories, id_map, flagged, stats)
+                    batch = []
+                    batch_bytes = 0
+            if batch:
+                self._import_batch(executor, batch, categories, id_map, flagged, stats)
+
+        self._link_flagged(id_map, flagged)
+        self.doc_storage.cache.invalidate('documents')
+        self.doc_storage.cache.invalidate('categories')
+        return stats
+
+    def _import_batch(self, executor, batch, categories, id_map, flagged, stats):
+        cursor = self.conn.cursor()
+        urls = list({document.meta['url'] for document in batch})
+        cursor.execute(f"SELECT url FROM documents WHERE url IN ({','.join('?' * len(urls))})", urls)
+        stored = {row[0] for row in cursor.fetchall()}
+
+        # A URL repeated in the archive is imported once
+        pending = []
+        for document in batch:
+            url = document.meta['url']
+            if url in stored:
+                stats['skipped'] += 1
+                continue
+            stored.add(url)
+            category_name = document.meta.get('category_name')
+            if category_name and category_name not in categories:
+                self.doc_storage.add_category(category_name)
+                categories.update({c['name']: c['id'] for c in self.doc_storage.get_categories()})
+            pending.append((document, categories.get(category_name)))
+
+        written = list(executor.map(lambda item: self._write_files(*item), pending))
+        self._insert_batch(pending, written, id_map, flagged)
+        stats['imported'] += len(pending)
+        logger.info(f"Imported {stats['imported']} documents, skipped {stats['skipped']}")
+
+    def _write_files(self, document: ImportedDocument, category_id):
+        """Write a document's content files and image blobs, returns (markdown_path, blobs)"""
+        content_store = self.doc_storage.content_store
+        image_store = self.doc_storage.image_store
+        paths = self.doc_storage._get_file_path(document.meta['url'])
+        doc_dir = os.path.dirname(paths['markdown'])
+        content_store.write(paths['markdown'], document.markdown)
+        # Archives exported without raw content leave the document without stored HTML, as if it had none
+        if document.raw:
+            content_store.write(os.path.join(doc_dir, 'content.txt'), document.raw)
+        if document.image_mapping:
+            with open(os.path.join(doc_dir, 'image_mapping.json'), 'w') as f:
+                json.dump(document.image_mapping, f, indent=4)
+
+        blobs = {}
+        for name, data in document.images.items():
+            # Archive entries never name a path outside the images folder
+            name = os.path.basename(name)
+            if not name:
+                continue
+            digest, blob_path = image_store.write_blob(data, os.path.splitext(name)[1])
+            image_store.link(blob_path, os.path.join(paths['images'], name))
+            blobs[digest] = (blob_path, len(data))
+        return paths['markdown'], blobs
+
+    @retry_on_busy
+    def _insert_batch(self, pending, written, id_map, flagged):
+        """Insert a batch of documents with their search index, fingerprints and image references in one transaction"""
+        cursor = self.conn.cursor()
+        try:
+            for (document, category_id), (markdown_path, blobs) in zip(pending, written):
+                meta = document.meta
+                cursor.execute('''
+                    INSERT INTO documents
+                    (url, title, markdown_path, category_id, created_at, updated_at, etag, last_modified, content_hash)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (meta['url'], meta.get('title'), markdown_path, category_id,
+                      meta.get('created_at') or datetime.now().isoformat(), meta.get('updated_at'),
+                      meta.get('etag'), meta.get('last_modified'), meta.get('content_hash')))
+                document_id = cursor.lastrowid
+                id_map[meta.get('id')] = document_id
+                self.doc_storage._index_document(cursor, document_id, meta.get('title'), meta['url'], document.markdown)
+                if meta.get('simhash') is not None:
+                    self.doc_storage.duplicates.add(cursor, document_id, meta['simhash'] % (1 << 64))
+                if meta.get('canonical_id'):
+                    flagged.append((document_id, meta['canonical_id']))
+                self.doc_storage.image_store.add_document_blobs(cursor, document_id, blobs)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+
+    @retry_on_busy
+    def _link_flagged(self, id_map, flagged):
+        """Point imported near duplicates at the new IDs of their originals"""
+        cursor = self.conn.cursor()
+        cursor.executemany('UPDATE documents SET canonical_id = ? WHERE id = ?', [
+            (id_map[canonical_id], document_id)
+            for document_id, canonical_id in flagged if canonical_id in id_map
+        ])
+        self.conn.commit()
@@ -4,15 +4,41 @@ import sqlite3
 import hashlib
 import redis
 from datetime import datetime
-from urllib.parse import urlparse
 import uuid
+import json
+import base64
 import mimetypes
 import logging
 import shutil
+import threading
+from ImageStore import ImageStore
+from ContentStore import ContentStore
+from DuplicateIndex import DuplicateIndex
+from VectorIndex import VectorIndex
+from storage_utils import retry_on_busy, is_busy
+from schema import migrate
+from cache import DocumentCache
 
 # Initialize logger
 logger = logging.getLogger(__name__)
 
+# Columns that can be selected through get_documents_page
+DOCUMENT_FIELDS = {
+    'id': 'd.id',
+    'url': 'd.url',
+    'title': 'd.title',
+    'markdown_path': 'd.markdown_path',
+    'category_id': 'd.category_id',
+    'category_name': 'c.name',
+    'created_at': 'd.created_at',
+    'updated_at': 'd.updated_at',
+    'canonical_id': 'd.canonical_id'
+}
+DEFAULT_PAGE_FIELDS = ['id', 'url', 'title', 'category_id', 'category_name', 'created_at']
+MAX_PAGE_SIZE = 200
+# Folder under doc_path holding the sharded document folders
+LAYOUT_ROOT = 'objects'
+
 class DocumentStorage:
     def __init__(self, config_path='config.yaml'):
         # Get the directory of the main script
@@ -30,11 +56,19 @@ class DocumentStorage:
         os.makedirs(self.db_path, exist_ok=True)
         os.makedirs(self.doc_path, exist_ok=True)
         
-        # Initialize SQLite
+        # Initialize SQLite, every thread gets its own connection
         self.db_path = os.path.join(self.db_path, 'documents.db')
-        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row
+        self.sqlite_config = storage_config.get('sqlite', {})
+        self.busy_retries = self.sqlite_config.get('busy_retries', 5)
+        self._local = threading.local()
         self._init_db()
+        self.image_store = ImageStore(self)
+        # Content files are compressed on disk, reads find whichever variant exists
+        self.content_store = ContentStore(**storage_config.get('compression', {}))
+        # SimHash fingerprints of the markdown, used to find near-duplicate documents
+        self.duplicates = DuplicateIndex(self, **self.config.get('dedup', {}))
+        # Chunk embeddings for semantic search
+        self.vectors = VectorIndex(self, **self.config.get('vectors', {}))
         
         # Initialize Redis if enabled
         redis_config = self.config.get('redis', {})
@@ -46,47 +80,114 @@ class DocumentStorage:
             )
         else:
             self.redis_client = None
+        
+        # Read cache in front of SQLite, falls back to an in-process LRU without Redis
+        cache_config = self.config.get('cache', {})
+        self.cache = DocumentCache(
+            self.redis_client,
+            ttl=cache_config.get('ttl', 300),
+            max_entries=cache_config.get('max_entries', 10000)
+        )
     
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The SQLite connection of the calling thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a connection in WAL mode so readers never block behind a writer"""
+        config = self.sqlite_config
+        conn = sqlite3.connect(self.db_path, timeout=config.get('busy_timeout', 10))
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute(f"PRAGMA synchronous={config.get('synchronous', 'NORMAL')}")
+        conn.execute(f"PRAGMA cache_size={int(config.get('cache_size', -65536))}")
+        conn.execute(f"PRAGMA mmap_size={int(config.get('mmap_size', 268435456))}")
+        conn.execute('PRAGMA temp_store=MEMORY')
+        return conn
+
     def _init_db(self):
-        """Initialize the SQLite database with tables"""
+        """Bring the SQLite schema up to date and create the search index"""
+        migrate(self.conn)
         cursor = self.conn.cursor()
+        self._init_search_index(cursor)
+        self.conn.commit()
+
+    def _init_search_index(self, cursor):
+        """Create the FTS5 index over title, URL and markdown body, keyed by document ID"""
+        tokenizer = self.config.get('search', {}).get('tokenizer', 'trigram')
+        self.fts_tokenizer = None
+        for candidate in dict.fromkeys([tokenizer, 'unicode61']):
+            try:
+                cursor.execute(f'''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS documents_fts
+                    USING fts5(title, url, body, tokenize='{candidate}')
+                ''')
+                self.fts_tokenizer = candidate
+                break
+            except sqlite3.OperationalError as e:
+                logger.warning(f"Could not create full-text index with tokenizer {candidate}: {e}")
+        if self.fts_tokenizer is None:
+            logger.warning("SQLite FTS5 is not available, searching titles and URLs only")
+
+    def _index_document(self, cursor, document_id, title, url, markdown):
+        if self.fts_tokenizer is None:
+            return
+        cursor.execute('DELETE FROM documents_fts WHERE rowid = ?', (document_id,))
+        cursor.execute('INSERT INTO documents_fts (rowid, title, url, body) VALUES (?, ?, ?, ?)',
+                       (document_id, title or '', url, markdown or ''))
+
+    def _unindex_document(self, cursor, document_id):
+        if self.fts_tokenizer is None:
+            return
+        cursor.execute('DELETE FROM documents_fts WHERE rowid = ?', (document_id,))
+
+    @retry_on_busy
+    def rebuild_search_index(self, batch_size=500) -> int:
+        """Rebuild the full-text index from the stored markdown files, returns the number of documents indexed"""
+        if self.fts_tokenizer is None:
+            return 0
+        cursor = self.conn.cursor()
+        cursor.execute('DELETE FROM documents_fts')
+        cursor.execute('SELECT id, url, title, markdown_path FROM documents ORDER BY id')
+        rows = cursor.fetchall()
         
-        # Create categories table
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT UNIQUE NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        
-        # Create documents table with category support
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                url TEXT UNIQUE NOT NULL,
-                title TEXT,
-                markdown_path TEXT,
-                category_id INTEGER,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (category_id) REFERENCES categories(id)
-            )
-        ''')
-        
+        count = 0
+        for i in range(0, len(rows), batch_size):
+            batch = []
+            for row in rows[i:i + batch_size]:
+                markdown = ''
+                if row['markdown_path'] and self.content_store.exists(row['markdown_path']):
+                    markdown = self.content_store.read(row['markdown_path'])
+                batch.append((row['id'], row['title'] or '', row['url'], markdown))
+            cursor.executemany('INSERT INTO documents_fts (rowid, title, url, body) VALUES (?, ?, ?, ?)', batch)
+            self.conn.commit()
+            count += len(batch)
+        cursor.execute("INSERT INTO documents_fts (documents_fts) VALUES ('optimize')")
         self.conn.commit()
+        return count
 
+    @retry_on_busy
     def add_category(self, name):
         """Add a new category"""
         cursor = self.conn.cursor()
         try:
             cursor.execute('INSERT INTO categories (name) VALUES (?)', (name,))
             self.conn.commit()
+            self.cache.invalidate('categories')
             return cursor.lastrowid
         except sqlite3.IntegrityError:
             return None
 
     def get_categories(self):
         """Get all categories"""
+        return self.cache.get_or_load('categories', 'categories', self._load_categories)
+
+    def _load_categories(self):
         cursor = self.conn.cursor()
         cursor.execute('SELECT id, name, created_at FROM categories ORDER BY name')
         categories = []
@@ -98,6 +199,7 @@ class DocumentStorage:
             })
         return categories
 
+    @retry_on_busy
     def update_document_category(self, url, category_id):
         """Update a document's category"""
         cursor = self.conn.cursor()
@@ -107,6 +209,16 @@ class DocumentStorage:
             WHERE url = ?
         ''', (category_id, url))
         self.conn.commit()
+        
+        cursor.execute('SELECT id FROM documents WHERE url = ?', (url,))
+        row = cursor.fetchone()
+        if row:
+            self.invalidate_document(row[0])
+
+    def invalidate_document(self, document_id):
+        """Drop cached data of a document and all cached listings"""
+        self.cache.invalidate(f'document:{document_id}')
+        self.cache.invalidate('documents')
 
     def get_document_id_by_category_and_url(self, category_id, url):
         cursor = self.conn.cursor()
@@ -114,53 +226,142 @@ class DocumentStorage:
         row = cursor.fetchone()
         return row[0] if row else None
 
-    def add_document(self, url, title, raw_content, markdown, category_id=None) -> int:
-        """Add a new document to storage"""
+    @retry_on_busy
+    def add_document(self, url, title, raw_content, markdown, category_id=None,
+                     etag=None, last_modified=None, content_hash=None, fingerprint=None, canonical_id=None) -> int:
+        """Add a new document to storage
+        
+        fingerprint is the markdown's SimHash from duplicates.fingerprint, and
+        canonical_id the original the document is flagged as a near duplicate of.
+        """
         try:
-            if self.get_document_id_by_category_and_url(category_id, url):
+            # The folder is keyed by URL alone, a URL stored under another category shares it
+            if self.get_document_by_url(url):
                 return 0
 
             # Get paths for the document
-            paths = self._get_file_path(url, category_id)
+            paths = self._get_file_path(url)
             
             # Create directories
             os.makedirs(os.path.dirname(paths['markdown']), exist_ok=True)
             
             # Save markdown content
-            with open(paths['markdown'], 'w', encoding='utf-8') as f:
-                f.write(markdown)
+            self.content_store.write(paths['markdown'], markdown)
             
             # Save raw content
             raw_path = os.path.join(os.path.dirname(paths['markdown']), 'content.txt')
-            with open(raw_path, 'w', encoding='utf-8') as f:
-                f.write(raw_content)
+            self.content_store.write(raw_path, raw_content)
             
             # Add to database
             cursor = self.conn.cursor()
             cursor.execute('''
                 INSERT INTO documents 
-                (url, title, markdown_path, category_id, created_at) 
-                VALUES (?, ?, ?, ?, ?)
-            ''', (url, title, paths['markdown'], category_id, datetime.now().isoformat()))
+                (url, title, markdown_path, category_id, created_at, etag, last_modified, content_hash, canonical_id) 
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', (url, title, paths['markdown'], category_id, datetime.now().isoformat(),
+                  etag, last_modified, content_hash, canonical_id))
+            document_id = cursor.lastrowid
+            self._index_document(cursor, document_id, title, url, markdown)
+            self.duplicates.add(cursor, document_id, fingerprint)
             self.conn.commit()
-            return cursor.lastrowid
+            self.cache.invalidate('documents')
+            return document_id
                 
         except Exception as e:
+            if is_busy(e):
+                raise
             logger.error(f"Error adding document: {e}", exc_info=True)
             return -1
 
+    def get_document_validators(self, url):
+        """Get the stored HTTP validators of a document, or None if the URL is not stored"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, markdown_path, etag, last_modified, content_hash
+            FROM documents
+            WHERE url = ?
+        ''', (url,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    @retry_on_busy
+    def update_document(self, document_id, title, raw_content, markdown,
+                        etag=None, last_modified=None, content_hash=None, fingerprint=None) -> bool:
+        """Rewrite a stored document's files in place and refresh its validators"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT url, markdown_path FROM documents WHERE id = ?', (document_id,))
+            doc = cursor.fetchone()
+            if not doc:
+                return False
+
+            markdown_path = doc['markdown_path']
+            self.content_store.write(markdown_path, markdown)
+
+            raw_path = os.path.join(os.path.dirname(markdown_path), 'content.txt')
+            self.content_store.write(raw_path, raw_content)
+
+            cursor.execute('''
+                UPDATE documents
+                SET title = ?, etag = ?, last_modified = ?, content_hash = ?, updated_at = ?
+                WHERE id = ?
+            ''', (title, etag, last_modified, content_hash, datetime.now().isoformat(), document_id))
+            self._index_document(cursor, document_id, title, doc['url'], markdown)
+            self.duplicates.add(cursor, document_id, fingerprint)
+            self.conn.commit()
+            self.invalidate_document(document_id)
+            return True
+        except Exception as e:
+            if is_busy(e):
+                raise
+            logger.error(f"Error updating document: {e}", exc_info=True)
+            return False
+
+    @retry_on_busy
+    def touch_document(self, document_id, etag=None, last_modified=None):
+        """Record that a document was revalidated without changes"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            UPDATE documents
+            SET etag = COALESCE(?, etag), last_modified = COALESCE(?, last_modified), updated_at = ?
+            WHERE id = ?
+        ''', (etag or None, last_modified or None, datetime.now().isoformat(), document_id))
+        self.conn.commit()
+        self.invalidate_document(document_id)
+
+    def get_markdown_paths(self) -> list[str]:
+        """Logical markdown paths of all stored documents, their raw content sits in the same folder"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT markdown_path FROM documents WHERE markdown_path IS NOT NULL ORDER BY id')
+        return [row[0] for row in cursor.fetchall()]
+
+    def get_embeddable_documents(self) -> list[tuple[int, str]]:
+        """(id, markdown_path) of the documents semantic search covers, near duplicates are left out"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id, markdown_path FROM documents
+            WHERE markdown_path IS NOT NULL AND canonical_id IS NULL
+            ORDER BY id
+        ''')
+        return [(row[0], row[1]) for row in cursor.fetchall()]
+
     def get_document_by_url(self, url):
         """Get a document by URL"""
         cursor = self.conn.cursor()
         cursor.execute('''
             SELECT d.id, d.url, d.title, d.markdown_path, d.category_id, d.created_at, c.name as category_name
             FROM documents d 
+            LEFT JOIN categories c ON d.category_id = c.id
             WHERE d.url = ? 
-        ''', (url))
+        ''', (url,))
         return cursor.fetchone()
 
     def get_document_by_id(self, document_id):
         """Get a document by ID"""
+        return self.cache.get_or_load(f'document:{document_id}', f'document:{document_id}',
+                                      lambda: self._load_document_by_id(document_id))
+
+    def _load_document_by_id(self, document_id):
         cursor = self.conn.cursor()
         cursor.execute('''
             SELECT d.*, c.name as category_name
@@ -173,6 +374,10 @@ class DocumentStorage:
 
     def get_documents(self, category_id=None):
         """Get all documents, optionally filtered by category"""
+        return self.cache.get_or_load('documents', f'documents:all:{category_id}',
+                                      lambda: self._load_documents(category_id))
+
+    def _load_documents(self, category_id):
         cursor = self.conn.cursor()
         
         if category_id:
@@ -216,13 +421,118 @@ class DocumentStorage:
             'category_name': row[6] if row[6] else None
         } for row in rows]
 
-    def search_documents(self, query, category_id=None):
-        """Search documents with optional category filter"""
+    def _fts_query(self, query):
+        """Turn user input into an FTS5 query matching all terms, or None if the index cannot answer it"""
+        terms = query.split()
+        if not terms or self.fts_tokenizer is None:
+            return None
+        # The trigram tokenizer cannot match terms shorter than three characters
+        if self.fts_tokenizer == 'trigram' and any(len(term) < 3 for term in terms):
+            return None
+        return ' '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+    def _encode_cursor(self, created_at, document_id):
+        raw = json.dumps([created_at, document_id]).encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def _decode_cursor(self, cursor):
+        """Decode a page cursor into (created_at, id), raises ValueError if it is malformed"""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            created_at, document_id = json.loads(raw)
+            return str(created_at), int(document_id)
+        except Exception:
+            raise ValueError(f"Invalid cursor: {cursor}")
+
+    def get_documents_page(self, category_id=None, cursor=None, limit=50, fields=None, include_total=True):
+        """Get one page of documents, newest first
+        
+        Pages are addressed by a keyset cursor on (created_at, id), so fetching
+        a deep page costs the same as the first one.
+        
+        Args:
+            category_id: Optional category filter
+            cursor: next_cursor from the previous page, None for the first page
+            limit: Page size, capped at MAX_PAGE_SIZE
+            fields: Columns to return, see DOCUMENT_FIELDS
+            include_total: Whether to count all matching documents
+            
+        Returns:
+            dict: items, next_cursor (None on the last page) and total (None when not counted)
+        """
+        fields = fields or DEFAULT_PAGE_FIELDS
+        unknown = [f for f in fields if f not in DOCUMENT_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+        limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+        
+        key = f"documents:page:{category_id}:{cursor}:{limit}:{','.join(fields)}:{int(bool(include_total))}"
+        return self.cache.get_or_load('documents', key,
+                                      lambda: self._load_documents_page(category_id, cursor, limit, fields, include_total))
+
+    def _load_documents_page(self, category_id, cursor, limit, fields, include_total):
+        # id and created_at are always selected to build the next cursor
+        columns = list(dict.fromkeys(['id', 'created_at'] + list(fields)))
+        select = ', '.join(f'{DOCUMENT_FIELDS[name]} AS {name}' for name in columns)
+        sql = f'''
+            SELECT {select}
+            FROM documents d
+            LEFT JOIN categories c ON d.category_id = c.id
+        '''
+        where = []
+        params = []
+        if category_id:
+            where.append('d.category_id = ?')
+            params.append(category_id)
+        if cursor:
+            where.append('(d.created_at, d.id) < (?, ?)')
+            params.extend(self._decode_cursor(cursor))
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        # One extra row tells whether another page follows
+        sql += ' ORDER BY d.created_at DESC, d.id DESC LIMIT ?'
+        params.append(limit + 1)
+        
+        db_cursor = self.conn.cursor()
+        db_cursor.execute(sql, params)
+        rows = db_cursor.fetchall()
+        
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = self._encode_cursor(rows[-1]['created_at'], rows[-1]['id'])
+        
+        total = None
+        if include_total:
+            if category_id:
+                db_cursor.execute('SELECT COUNT(*) FROM documents WHERE category_id = ?', (category_id,))
+            else:
+                db_cursor.execute('SELECT COUNT(*) FROM documents')
+            total = db_cursor.fetchone()[0]
+        
+        return {
+            'items': [{name: row[name] for name in fields} for row in rows],
+            'next_cursor': next_cursor,
+            'total': total
+        }
+
+    def search_documents(self, query, category_id=None, limit=100, include_duplicates=False):
+        """Search documents with optional category filter
+        
+        Full-text matches over title, URL and markdown body are ranked by BM25
+        and carry a snippet of the matching text. Queries the index cannot
+        answer fall back to a substring match on title and URL. Documents
+        flagged as near duplicates are left out unless include_duplicates is set.
+        """
+        fts_query = self._fts_query(query)
+        if fts_query:
+            return self._search_index(fts_query, category_id, limit, include_duplicates)
+        
         cursor = self.conn.cursor()
         
         # Build search query
         sql = '''
-            SELECT d.*, c.name as category_name 
+            SELECT d.id, d.url, d.title, d.markdown_path, d.category_id, d.created_at, c.name as category_name 
             FROM documents d 
             LEFT JOIN categories c ON d.category_id = c.id 
             WHERE (d.title LIKE ? OR d.url LIKE ?)
@@ -232,8 +542,11 @@ class DocumentStorage:
         if category_id:
             sql += ' AND d.category_id = ?'
             params.append(category_id)
+        if not include_duplicates:
+            sql += ' AND d.canonical_id IS NULL'
             
-        sql += ' ORDER BY d.created_at DESC'
+        sql += ' ORDER BY d.created_at DESC LIMIT ?'
+        params.append(limit)
         
         cursor.execute(sql, params)
         rows = cursor.fetchall()
@@ -248,6 +561,42 @@ class DocumentStorage:
             'category_name': row[6] if row[6] else None
         } for row in rows]
 
+    def _search_index(self, fts_query, category_id, limit, include_duplicates):
+        cursor = self.conn.cursor()
+        sql = '''
+            SELECT d.id, d.url, d.title, d.markdown_path, d.category_id, d.created_at, c.name as category_name,
+                   snippet(documents_fts, 2, '<mark>', '</mark>', '…', 16) AS snippet,
+                   bm25(documents_fts, 10.0, 5.0, 1.0) AS rank
+            FROM documents_fts f
+            JOIN documents d ON d.id = f.rowid
+            LEFT JOIN categories c ON d.category_id = c.id
+            WHERE documents_fts MATCH ?
+        '''
+        params = [fts_query]
+        
+        if category_id:
+            sql += ' AND d.category_id = ?'
+            params.append(category_id)
+        if not include_duplicates:
+            sql += ' AND d.canonical_id IS NULL'
+            
+        sql += ' ORDER BY rank LIMIT ?'
+        params.append(limit)
+        
+        cursor.execute(sql, params)
+        return [{
+            'id': row[0],
+            'url': row[1],
+            'title': row[2],
+            'markdown_path': row[3],
+            'category_id': row[4],
+            'created_at': row[5],
+            'category_name': row[6] if row[6] else None,
+            'snippet': row[7],
+            'rank': row[8]
+        } for row in cursor.fetchall()]
+
+    @retry_on_busy
     def delete_document(self, document_id):
         """Delete a document and its associated files"""
         try:
@@ -270,41 +619,127 @@ class DocumentStorage:
             
             # Delete from database
             cursor.execute('DELETE FROM documents WHERE id = ?', (document_id,))
+            self._unindex_document(cursor, document_id)
+            unflagged = self.duplicates.remove(cursor, document_id)
             self.conn.commit()
+            self.invalidate_document(document_id)
+            for unflagged_id in unflagged:
+                self.invalidate_document(unflagged_id)
+            
+            # Drop image references, blobs no other document uses are removed
+            self.image_store.release_document(document_id)
+            self.vectors.remove_document(document_id)
             return True
         except Exception as e:
+            if is_busy(e):
+                raise
             logger.error(f"Error deleting document: {e}", exc_info=True)
             return False
 
-    def get_document_path(self, url, category_id=None) -> str:
-        if category_id is None:
-            raise Exception('category_id is required')
+    def get_document_path(self, url) -> str:
+        """Folder of a document, derived from its URL alone
 
+        Documents live under `<doc_path>/objects/ab/cd/<sha1 of the URL>`. The
+        two shard levels keep every folder small however many documents a
+        domain has, and since the category is not part of the path, moving a
+        document to another category only updates its row.
+        """
         base_path = self.config.get('storage', {}).get('doc_path', 'docs')
-        
-        # Get category name if category_id is provided
-        category_name = 'uncategorized'
-        if category_id:
+        digest = hashlib.sha1(url.encode()).hexdigest()
+        return os.path.join(base_path, LAYOUT_ROOT, digest[:2], digest[2:4], digest)
+
+    def _move_document_dir(self, src_dir, dst_dir, shared=False) -> bool:
+        """Move a document folder, returns False if neither folder exists
+
+        Safe to repeat after an interruption: a folder already moved is left
+        alone, and a partial copy left by a cross-device move is redone. A
+        shared folder is copied, the other documents still need it.
+        """
+        if not os.path.exists(src_dir):
+            return os.path.exists(dst_dir)
+        if os.path.exists(dst_dir):
+            shutil.rmtree(dst_dir)
+        os.makedirs(os.path.dirname(dst_dir), exist_ok=True)
+        if shared:
+            shutil.copytree(src_dir, dst_dir)
+            return True
+        shutil.move(src_dir, dst_dir)
+
+        # Drop the domain and category folders the move left empty
+        base_path = os.path.abspath(self.config.get('storage', {}).get('doc_path', 'docs'))
+        parent = os.path.dirname(os.path.abspath(src_dir))
+        while parent.startswith(base_path + os.sep):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                break
+            parent = os.path.dirname(parent)
+        return True
+
+    def migrate_layout(self, batch_size=200, progress=None) -> int:
+        """Move documents stored in the old category/domain folders to the sharded layout
+
+        Folders are moved first and the paths of a batch are then updated in
+        one short transaction, so crawls keep running meanwhile. An
+        interrupted migration continues where it stopped when run again.
+
+        Args:
+            batch_size: Documents whose paths are updated per transaction
+            progress: Optional callable receiving the number of documents moved so far
+
+        Returns:
+            Number of documents moved
+        """
+        # The old folder names were 8 hex digits of the URL's MD5, large trees have folders used by two documents
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT markdown_path, COUNT(*) FROM documents GROUP BY markdown_path HAVING COUNT(*) > 1')
+        shared = {row[0]: row[1] for row in cursor.fetchall()}
+
+        moved = 0
+        last_id = 0
+        while True:
             cursor = self.conn.cursor()
-            cursor.execute('SELECT name FROM categories WHERE id = ?', (category_id,))
-            row = cursor.fetchone()
-            if row:
-                category_name = row[0].lower().replace(' ', '_')
-        
-        # Parse URL for path components
-        parsed = urlparse(url)
-        domain = parsed.netloc
-        
-        # Generate a unique ID for this document
-        doc_id = hashlib.md5(url.encode()).hexdigest()[:8]
-        
-        # Create paths
-        doc_dir = os.path.join(base_path, category_name, domain, doc_id)
-        return doc_dir
+            cursor.execute('''
+                SELECT id, url, markdown_path FROM documents
+                WHERE id > ? AND markdown_path IS NOT NULL
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return moved
+            last_id = rows[-1]['id']
+
+            updates = []
+            for row in rows:
+                paths = self._get_file_path(row['url'])
+                if row['markdown_path'] == paths['markdown']:
+                    continue
+                # The last document using a shared folder moves it
+                users = shared.get(row['markdown_path'], 1)
+                shared[row['markdown_path']] = users - 1
+                if not self._move_document_dir(os.path.dirname(row['markdown_path']), paths['base'],
+                                               shared=users > 1):
+                    logger.warning(f"Files of document {row['id']} are missing, only its path is updated")
+                updates.append((paths['markdown'], row['id']))
+            if not updates:
+                continue
+
+            self._update_markdown_paths(updates)
+            for _, document_id in updates:
+                self.invalidate_document(document_id)
+            moved += len(updates)
+            if progress:
+                progress(moved)
+
+    @retry_on_busy
+    def _update_markdown_paths(self, updates):
+        cursor = self.conn.cursor()
+        cursor.executemany('UPDATE documents SET markdown_path = ? WHERE id = ?', updates)
+        self.conn.commit()
 
-    def _get_file_path(self, url, category_id=None):
-        """Generate storage path based on URL and category"""
-        doc_dir = self.get_document_path(url, category_id)
+    def _get_file_path(self, url):
+        """Generate storage paths based on URL"""
+        doc_dir = self.get_document_path(url)
         markdown_file = os.path.join(doc_dir, 'content.md')
         images_dir = os.path.join(doc_dir, 'images')
         
@@ -0,0 +1,238 @@
+import re
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime
+from storage_utils import retry_on_busy
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+# What happens to a new document that is a near duplicate of a stored one
+ACTIONS = ('skip', 'link', 'flag')
+# Words, or single characters of scripts written without spaces between words
+TOKEN_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]|[^\W_]+')
+# Link and image targets differ between mirrors of a page, only the text is fingerprinted
+LINK_TARGETS = re.compile(r'\]\([^)]*\)|https?://\S+')
+SHINGLE_SIZE = 3
+MAX_THRESHOLD = 10
+
+def simhash(text: str, min_tokens: int = 0):
+    """64-bit SimHash over the token shingles of a text, None if it has fewer than min_tokens tokens"""
+    tokens = TOKEN_PATTERN.findall(LINK_TARGETS.sub(' ', text).lower())
+    if not tokens or len(tokens) < min_tokens:
+        return None
+    shingles = Counter(' '.join(tokens[i:i + SHINGLE_SIZE])
+                       for i in range(max(1, len(tokens) - SHINGLE_SIZE + 1)))
+
+    # Weights are summed per byte value first, so a shingle costs 8 steps instead of 64
+    byte_weights = [[0] * 256 for _ in range(8)]
+    for shingle, weight in shingles.items():
+        digest = hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest()
+        for position, value in enumerate(digest):
+            byte_weights[position][value] += weight
+
+    fingerprint = 0
+    for position, weights in enumerate(byte_weights):
+        used = [(value, weight) for value, weight in enumerate(weights) if weight]
+        for bit in range(8):
+            mask = 1 << bit
+            if sum(weight if value & mask else -weight for value, weight in used) > 0:
+                fingerprint |= 1 << (position * 8 + bit)
+    return fingerprint
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def _to_signed(fingerprint: int) -> int:
+    """SQLite integers are signed 64-bit"""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def _to_unsigned(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+def _band_layout(bands: int):
+    """(shift, mask) of each band, the 64 bits split as evenly as possible"""
+    size, extra = divmod(64, bands)
+    layout = []
+    shift = 0
+    for band in range(bands):
+        width = size + (band < extra)
+        layout.append((shift, (1 << width) - 1))
+        shift += width
+    return layout
+
+def _band_values(fingerprint: int, layout):
+    """(band, value) of a fingerprint, a threshold of 0 keeps all 64 bits in one band"""
+    return [(band, _to_signed((fingerprint >> shift) & mask)) for band, (shift, mask) in enumerate(layout)]
+
+class DuplicateIndex:
+    """Near-duplicate detection over the markdown of stored documents
+
+    Each document gets a 64-bit SimHash of its text. Two documents are near
+    duplicates when their fingerprints differ in at most `threshold` bits.
+    The fingerprint is split into threshold + 1 bands and every band value is
+    indexed in SQLite; by the pigeonhole principle a near duplicate shares at
+    least one band exactly, so a lookup only compares the few documents found
+    through the band index instead of scanning all of them.
+
+    Flagged documents point at their original through documents.canonical_id,
+    linked URLs are recorded in duplicate_urls without storing a copy.
+    """
+
+    def __init__(self, doc_storage, enabled: bool = True, threshold: int = 3, action: str = 'flag',
+                 min_tokens: int = 50):
+        """
+        Args:
+            doc_storage: DocumentStorage whose documents are indexed
+            enabled: Whether new documents are fingerprinted and checked
+            threshold: Largest Hamming distance between fingerprints that counts as a near duplicate
+            action: skip, link or flag, see ACTIONS
+            min_tokens: Documents with fewer tokens are too short for a reliable fingerprint
+        """
+        if action not in ACTIONS:
+            logger.warning(f"Unknown duplicate action {action}, using flag")
+            action = 'flag'
+        if not 0 <= threshold <= MAX_THRESHOLD:
+            logger.warning(f"Duplicate threshold {threshold} is out of range, using 3")
+            threshold = 3
+        self.doc_storage = doc_storage
+        self.enabled = enabled
+        self.threshold = threshold
+        self.action = action
+        self.min_tokens = min_tokens
+        self.bands = _band_layout(threshold + 1)
+        self._init_db()
+
+    @property
+    def conn(self):
+        return self.doc_storage.conn
+
+    @property
+    def busy_retries(self):
+        return self.doc_storage.busy_retries
+
+    def _init_db(self):
+        """Rebuild the band index when the threshold changed since it was built"""
+        cursor = self.conn.cursor()
+        # A changed threshold changes the band layout, the bands are rebuilt from the stored fingerprints
+        cursor.execute('SELECT MAX(band) FROM simhash_bands')
+        last_band = cursor.fetchone()[0]
+        if last_band is not None and last_band != len(self.bands) - 1:
+            logger.info(f"Rebuilding the near-duplicate index for threshold {self.threshold}")
+            cursor.execute('DELETE FROM simhash_bands')
+            cursor.execute('SELECT id, simhash FROM documents WHERE simhash IS NOT NULL')
+            for document_id, value in cursor.fetchall():
+                self._insert_bands(cursor, document_id, _to_unsigned(value))
+        self.conn.commit()
+
+    def fingerprint(self, markdown: str):
+        """Fingerprint of a document's markdown, None when detection is off or the text is too short"""
+        if not self.enabled or not markdown:
+            return None
+        return simhash(markdown, self.min_tokens)
+
+    def find(self, fingerprint, exclude_id=None):
+        """Find the stored original of a near duplicate
+
+        Returns:
+            (canonical_id, distance) of the closest stored document within the
+            threshold, or None if there is none
+        """
+        if fingerprint is None:
+            return None
+        cursor = self.conn.cursor()
+        candidates = set()
+        for band, value in _band_values(fingerprint, self.bands):
+            cursor.execute('SELECT document_id FROM simhash_bands WHERE band = ? AND value = ?', (band, value))
+            candidates.update(row[0] for row in cursor.fetchall())
+        candidates.discard(exclude_id)
+
+        best = None
+        candidates = sorted(candidates)
+        for i in range(0, len(candidates), 500):
+            chunk = candidates[i:i + 500]
+            cursor.execute(f'''
+                SELECT id, simhash, canonical_id FROM documents
+                WHERE id IN ({','.join('?' * len(chunk))}) AND simhash IS NOT NULL
+            ''', chunk)
+            for document_id, value, canonical_id in cursor.fetchall():
+                distance = hamming_distance(fingerprint, _to_unsigned(value))
+                if distance <= self.threshold and (best is None or (distance, document_id) < best[:2]):
+                    best = (distance, document_id, canonical_id)
+        if best is None:
+            return None
+        distance, document_id, canonical_id = best
+        # Flagged copies point at their original, so chains of duplicates never form
+        return canonical_id or document_id, distance
+
+    def _insert_bands(self, cursor, document_id, fingerprint):
+        cursor.executemany('INSERT OR IGNORE INTO simhash_bands (band, value, document_id) VALUES (?, ?, ?)', [
+            (band, value, document_id) for band, value in _band_values(fingerprint, self.bands)
+        ])
+
+    def add(self, cursor, document_id, fingerprint):
+        """Store and index a document's fingerprint in the caller's transaction"""
+        cursor.execute('DELETE FROM simhash_bands WHERE document_id = ?', (document_id,))
+        cursor.execute('UPDATE documents SET simhash = ? WHERE id = ?',
+                       (_to_signed(fingerprint) if fingerprint is not None else None, document_id))
+        if fingerprint is not None:
+            self._insert_bands(cursor, document_id, fingerprint)
+
+    def remove(self, cursor, document_id) -> list[int]:
+        """Drop a deleted document's fingerprint, the URLs linked to it and the flags pointing at it
+
+        Returns the IDs of the documents that are no longer flagged.
+        """
+        cursor.execute('DELETE FROM simhash_bands WHERE document_id = ?', (document_id,))
+        cursor.execute('DELETE FROM duplicate_urls WHERE canonical_id = ?', (document_id,))
+        cursor.execute('SELECT id FROM documents WHERE canonical_id = ?', (document_id,))
+        unflagged = [row[0] for row in cursor.fetchall()]
+        cursor.execute('UPDATE documents SET canonical_id = NULL WHERE canonical_id = ?', (document_id,))
+        return unflagged
+
+    @retry_on_busy
+    def link(self, url, canonical_id, distance):
+        """Record a URL as a near duplicate of a stored document instead of storing it"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            INSERT OR REPLACE INTO duplicate_urls (url, canonical_id, distance, created_at)
+            VALUES (?, ?, ?, ?)
+        ''', (url, canonical_id, distance, datetime.now().isoformat()))
+        self.conn.commit()
+
+    def get_duplicates(self, document_id):
+        """Flagged documents and linked URLs that are near duplicates of a document"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id, url, title FROM documents WHERE canonical_id = ? ORDER BY id', (document_id,))
+        flagged = [dict(row) for row in cursor.fetchall()]
+        cursor.execute('''
+            SELECT url, distance, created_at FROM duplicate_urls
+            WHERE canonical_id = ? ORDER BY created_at
+        ''', (document_id,))
+        linked = [dict(row) for row in cursor.fetchall()]
+        return {'flagged': flagged, 'linked': linked}
+
+    @retry_on_busy
+    def backfill(self, batch_size=200) -> int:
+        """Fingerprint stored documents that have none yet, returns the number of documents indexed
+
+        Documents stored before detection was enabled are only indexed; none
+        of them is skipped, linked or flagged.
+        """
+        content_store = self.doc_storage.content_store
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT id, markdown_path FROM documents WHERE simhash IS NULL ORDER BY id')
+        rows = cursor.fetchall()
+
+        count = 0
+        for i in range(0, len(rows), batch_size):
+            for document_id, markdown_path in rows[i:i + batch_size]:
+                if not markdown_path or not content_store.exists(markdown_path):
+                    continue
+                fingerprint = simhash(content_store.read(markdown_path), self.min_tokens)
+                if fingerprint is not None:
+                    self.add(cursor, document_id, fingerprint)
+                    count += 1
+            self.conn.commit()
+        return count
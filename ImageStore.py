@@ -0,0 +1,208 @@
+import os
+import time
+import shutil
+import hashlib
+import threading
+import logging
+from datetime import datetime
+from storage_utils import retry_on_busy
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+class ImageStore:
+    """Content-addressed image store shared by all documents
+
+    Every distinct image is stored once under `<doc_path>/.blobs`, named by the
+    SHA-256 of its bytes. Documents get hardlinks (or copies where links are not
+    supported) in their own images/ folder, and SQLite tracks which documents
+    reference which blobs so unreferenced blobs can be garbage-collected.
+    """
+
+    def __init__(self, doc_storage, root=None):
+        self.doc_storage = doc_storage
+        self.root = root or os.path.join(doc_storage.doc_path, '.blobs')
+        self.lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    @property
+    def conn(self):
+        return self.doc_storage.conn
+
+    @property
+    def busy_retries(self):
+        return self.doc_storage.busy_retries
+
+    def _blob_path(self, digest, ext):
+        return os.path.join(self.root, digest[:2], digest[2:4], f"{digest}{ext}")
+
+    def lookup_url(self, url):
+        """Return (hash, blob_path) for an image URL that was already stored, or None"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT b.hash, b.path FROM image_urls u
+                JOIN image_blobs b ON b.hash = u.hash
+                WHERE u.url = ?
+            ''', (url,))
+            row = cursor.fetchone()
+        if row and os.path.exists(row[1]):
+            return row[0], row[1]
+        return None
+
+    @retry_on_busy
+    def put(self, url, data: bytes, ext: str):
+        """Store image bytes once and return (hash, blob_path)"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT path FROM image_blobs WHERE hash = ?', (digest,))
+            row = cursor.fetchone()
+            blob_path = row[0] if row else self._blob_path(digest, ext)
+
+            if not os.path.exists(blob_path):
+                self._write_file(blob_path, data)
+
+            cursor.execute('''
+                INSERT OR IGNORE INTO image_blobs (hash, path, size, created_at)
+                VALUES (?, ?, ?, ?)
+            ''', (digest, blob_path, len(data), datetime.now().isoformat()))
+            cursor.execute('INSERT OR REPLACE INTO image_urls (url, hash) VALUES (?, ?)', (url, digest))
+            self.conn.commit()
+        return digest, blob_path
+
+    def _write_file(self, blob_path, data: bytes):
+        os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+        tmp_path = f"{blob_path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, blob_path)
+
+    def write_blob(self, data: bytes, ext: str):
+        """Write image bytes to their blob file unless it exists, returns (hash, blob_path)
+
+        Does not touch the database, so bulk imports write blobs from many
+        threads and register them afterwards with add_document_blobs.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        blob_path = self._blob_path(digest, ext)
+        if not os.path.exists(blob_path):
+            self._write_file(blob_path, data)
+        return digest, blob_path
+
+    def add_document_blobs(self, cursor, document_id, blobs: dict):
+        """Register blobs from write_blob and reference them from a new document, in the caller's transaction
+
+        Args:
+            cursor: Cursor of the open transaction
+            document_id: Document that references the blobs
+            blobs: Mapping of blob hash to (blob_path, size)
+        """
+        now = datetime.now().isoformat()
+        cursor.executemany('''
+            INSERT OR IGNORE INTO image_blobs (hash, path, size, created_at) VALUES (?, ?, ?, ?)
+        ''', [(digest, path, size, now) for digest, (path, size) in blobs.items()])
+        cursor.executemany('INSERT OR IGNORE INTO document_images (document_id, hash) VALUES (?, ?)',
+                           [(document_id, digest) for digest in blobs])
+        cursor.executemany('UPDATE image_blobs SET refcount = refcount + 1 WHERE hash = ?',
+                           [(digest,) for digest in blobs])
+
+    def link(self, blob_path, dest_path):
+        """Place a blob at dest_path as a hardlink, copying if links are not supported"""
+        os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+        if os.path.exists(dest_path):
+            os.remove(dest_path)
+        try:
+            os.link(blob_path, dest_path)
+        except OSError:
+            shutil.copyfile(blob_path, dest_path)
+
+    @retry_on_busy
+    def set_document_images(self, document_id, images: dict):
+        """Make the document reference exactly the given blobs
+
+        Args:
+            document_id: Stored document ID
+            images: Mapping of blob hash to the document's local copy of it
+        """
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT hash FROM document_images WHERE document_id = ?', (document_id,))
+            current = {row[0] for row in cursor.fetchall()}
+            added = set(images) - current
+            removed = current - set(images)
+
+            for digest in added:
+                # A concurrent delete may have collected the blob after it was downloaded; restore it from our copy
+                cursor.execute('SELECT path FROM image_blobs WHERE hash = ?', (digest,))
+                row = cursor.fetchone()
+                local_path = images[digest]
+                if not row or not os.path.exists(row[0]):
+                    if not os.path.exists(local_path):
+                        logger.warning(f"Image blob {digest} of document {document_id} is gone, not linking it")
+                        continue
+                    blob_path = row[0] if row else self._blob_path(digest, os.path.splitext(local_path)[1])
+                    self.link(local_path, blob_path)
+                    if not row:
+                        cursor.execute('''
+                            INSERT INTO image_blobs (hash, path, size, created_at) VALUES (?, ?, ?, ?)
+                        ''', (digest, blob_path, os.path.getsize(local_path), datetime.now().isoformat()))
+                cursor.execute('INSERT INTO document_images (document_id, hash) VALUES (?, ?)', (document_id, digest))
+                cursor.execute('UPDATE image_blobs SET refcount = refcount + 1 WHERE hash = ?', (digest,))
+
+            for digest in removed:
+                cursor.execute('DELETE FROM document_images WHERE document_id = ? AND hash = ?', (document_id, digest))
+                cursor.execute('UPDATE image_blobs SET refcount = refcount - 1 WHERE hash = ?', (digest,))
+            self.conn.commit()
+
+        if removed:
+            self._collect(removed)
+
+    @retry_on_busy
+    def release_document(self, document_id):
+        """Drop all references of a deleted document and collect blobs nothing uses anymore"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT hash FROM document_images WHERE document_id = ?', (document_id,))
+            hashes = {row[0] for row in cursor.fetchall()}
+            cursor.execute('DELETE FROM document_images WHERE document_id = ?', (document_id,))
+            cursor.executemany('UPDATE image_blobs SET refcount = refcount - 1 WHERE hash = ?',
+                               [(digest,) for digest in hashes])
+            self.conn.commit()
+        self._collect(hashes)
+
+    @retry_on_busy
+    def _collect(self, hashes):
+        """Delete the given blobs if their reference count dropped to zero"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            for digest in hashes:
+                cursor.execute('SELECT path FROM image_blobs WHERE hash = ? AND refcount <= 0', (digest,))
+                row = cursor.fetchone()
+                if not row:
+                    continue
+                self._remove_blob(cursor, digest, row[0])
+            self.conn.commit()
+
+    @retry_on_busy
+    def collect_garbage(self, grace_seconds: float = 3600) -> int:
+        """Delete unreferenced blobs older than the grace period, e.g. from failed crawls"""
+        cutoff = datetime.fromtimestamp(time.time() - grace_seconds).isoformat()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT hash, path FROM image_blobs WHERE refcount <= 0 AND created_at < ?', (cutoff,))
+            rows = cursor.fetchall()
+            for digest, path in rows:
+                self._remove_blob(cursor, digest, path)
+            self.conn.commit()
+        return len(rows)
+
+    def _remove_blob(self, cursor, digest, path):
+        try:
+            if os.path.exists(path):
+                os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not delete image blob {path}: {e}")
+            return
+        cursor.execute('DELETE FROM image_blobs WHERE hash = ?', (digest,))
+        cursor.execute('DELETE FROM image_urls WHERE hash = ?', (digest,))
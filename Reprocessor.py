@@ -0,0 +1,283 @@
+import os
+import json
+import uuid
+import logging
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from ContentStore import ContentStore
+from crawlers import ImageExtractor
+from crawlers.default import DefaultCrawler
+from crawlers.manager import CrawlerManager
+from storage_utils import retry_on_busy
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+COUNTERS = ('changed', 'unchanged', 'skipped', 'failed')
+
+# State of a worker process, set up once by _init_worker
+_worker = {}
+
+def _init_worker(compression: dict):
+    _worker['content_store'] = ContentStore(**compression)
+    _worker['image_extractor'] = ImageExtractor()
+    _worker['crawlers'] = {}
+
+def _regenerate(task):
+    """Convert one document's stored HTML again in a worker process
+
+    Writes content.md only when the new markdown differs from the stored one,
+    and never replaces stored markdown with an empty conversion.
+
+    Returns:
+        (document_id, outcome, title, markdown, message), markdown is only set when it changed
+    """
+    document_id, url, markdown_path, parser = task
+    try:
+        content_store = _worker['content_store']
+        doc_dir = os.path.dirname(markdown_path)
+        raw_path = os.path.join(doc_dir, 'content.txt')
+        if not content_store.exists(raw_path):
+            return document_id, 'skipped', None, None, "No stored HTML"
+
+        raw_html = content_store.read(raw_path)
+        # Archives imported without raw HTML leave nothing to convert
+        if not raw_html.strip():
+            return document_id, 'skipped', None, None, "Stored HTML is empty"
+
+        crawler = _worker['crawlers'].get(parser)
+        if crawler is None:
+            crawler = _worker['crawlers'][parser] = DefaultCrawler(parser=parser)
+        result = crawler.convert(raw_html, url)
+
+        # Images keep the local copies downloaded when the page was crawled
+        local_images = {}
+        mapping_path = os.path.join(doc_dir, 'image_mapping.json')
+        if os.path.exists(mapping_path):
+            with open(mapping_path) as f:
+                local_images = json.load(f)
+        markdown = _worker['image_extractor'].replace_markdown_images(result.markdown, local_images, url)
+
+        title = str(result.title) if result.title else None
+        stored = content_store.read(markdown_path) if content_store.exists(markdown_path) else None
+        if stored == markdown:
+            return document_id, 'unchanged', title, None, ''
+        if not markdown.strip() and stored and stored.strip():
+            return document_id, 'skipped', None, None, "Stored HTML has no content, markdown kept"
+        content_store.write(markdown_path, markdown)
+        return document_id, 'changed', title, markdown, ''
+    except Exception as e:
+        return document_id, 'failed', None, None, str(e)
+
+class Reprocessor:
+    """Regenerates the markdown of stored documents from the HTML saved with them
+
+    Reruns the default crawler's conversion and the image rewrite on each
+    document's content.txt, so an improved conversion reaches old documents
+    without crawling them again. Documents are converted in worker processes
+    and taken in ID order, one batch at a time. After every batch the search
+    index, fingerprints and title of the changed documents are updated
+    together with the run's checkpoint, so an interrupted run continues after
+    the last finished batch. Changed documents are re-embedded afterwards.
+
+    Documents of domains configured with another crawler type are skipped,
+    their markdown does not come from the default conversion.
+    """
+
+    def __init__(self, doc_storage, manager: CrawlerManager = None, workers: int = None, batch_size: int = 200):
+        """
+        Args:
+            doc_storage: DocumentStorage whose documents are reprocessed
+            manager: Resolves each document's crawler and parser from the domain rules
+            workers: Worker processes, one per CPU by default
+            batch_size: Documents per checkpoint
+        """
+        self.doc_storage = doc_storage
+        self.manager = manager or CrawlerManager()
+        self.workers = max(1, workers or os.cpu_count() or 1)
+        self.batch_size = max(1, batch_size)
+
+    @property
+    def conn(self):
+        return self.doc_storage.conn
+
+    @property
+    def busy_retries(self):
+        return self.doc_storage.busy_retries
+
+    @retry_on_busy
+    def create_run(self, category_id=None, exclusive: bool = False) -> str:
+        """Record a new run over a category, or all documents, and return its ID
+
+        With exclusive, returns None instead when another run has not finished;
+        the check and the insert hold the write lock, so concurrent callers
+        never both start a run.
+        """
+        cursor = self.conn.cursor()
+        if exclusive:
+            cursor.execute('BEGIN IMMEDIATE')
+            if self.latest_unfinished_run():
+                self.conn.rollback()
+                return None
+        if category_id:
+            cursor.execute('SELECT COUNT(*) FROM documents WHERE category_id = ?', (category_id,))
+        else:
+            cursor.execute('SELECT COUNT(*) FROM documents')
+        total = cursor.fetchone()[0]
+        run_id = uuid.uuid4().hex
+        now = datetime.now().isoformat()
+        cursor.execute('''
+            INSERT INTO reprocess_runs (id, category_id, total, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (run_id, category_id, total, now, now))
+        self.conn.commit()
+        return run_id
+
+    def get_run(self, run_id: str):
+        """Get a run's scope, status and counts"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM reprocess_runs WHERE id = ?', (run_id,))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def latest_unfinished_run(self):
+        """ID of the most recent run that has not finished, or None"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT id FROM reprocess_runs WHERE status IN ('pending', 'running')
+            ORDER BY created_at DESC LIMIT 1
+        ''')
+        row = cursor.fetchone()
+        return row[0] if row else None
+
+    @retry_on_busy
+    def abandon_run(self, run_id: str, message: str):
+        """Mark a run failed if it has not finished, e.g. when its process died without recording it"""
+        self.conn.execute('''
+            UPDATE reprocess_runs SET status = 'failed', message = ?, updated_at = ?
+            WHERE id = ? AND status IN ('pending', 'running')
+        ''', (message, datetime.now().isoformat(), run_id))
+        self.conn.commit()
+
+    @retry_on_busy
+    def _set_status(self, run_id, status, message=None):
+        self.conn.execute('UPDATE reprocess_runs SET status = ?, message = ?, updated_at = ? WHERE id = ?',
+                          (status, message, datetime.now().isoformat(), run_id))
+        self.conn.commit()
+
+    def _next_batch(self, run):
+        cursor = self.conn.cursor()
+        sql = 'SELECT id, url, title, markdown_path, canonical_id FROM documents WHERE id > ? AND markdown_path IS NOT NULL'
+        params = [run['last_id']]
+        if run['category_id']:
+            sql += ' AND category_id = ?'
+            params.append(run['category_id'])
+        sql += ' ORDER BY id LIMIT ?'
+        params.append(self.batch_size)
+        cursor.execute(sql, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def _task(self, document):
+        """Worker task of a document, None if its domain uses another crawler"""
+        rule = self.manager.router.resolve(document['url'])
+        if rule and rule['type'] != 'default':
+            return None
+        parser = rule['options'].get('parser', 'html.parser') if rule else 'html.parser'
+        return document['id'], document['url'], document['markdown_path'], parser
+
+    def run(self, run_id: str, progress=None) -> dict:
+        """Process a run from its checkpoint to the end and return its final state
+
+        Args:
+            run_id: ID from create_run, a run that stopped midway continues
+            progress: Optional callable receiving the run after every batch
+
+        Raises:
+            ValueError: If the run does not exist
+        """
+        run = self.get_run(run_id)
+        if not run:
+            raise ValueError(f"Reprocess run {run_id} not found")
+        if run['status'] == 'finished':
+            return run
+        # Content written by an interrupted batch is already current, its documents are indexed again regardless
+        resumed = run['status'] == 'running'
+        self._set_status(run_id, 'running')
+
+        compression = self.doc_storage.config.get('storage', {}).get('compression', {})
+        try:
+            with ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                     initargs=(compression,)) as executor:
+                while True:
+                    documents = self._next_batch(run)
+                    if not documents:
+                        break
+                    tasks = {document['id']: self._task(document) for document in documents}
+                    work = [task for task in tasks.values() if task]
+                    chunksize = max(1, len(work) // (self.workers * 4))
+                    results = list(executor.map(_regenerate, work, chunksize=chunksize))
+                    results += [(document_id, 'skipped', None, None, "Crawled with another crawler type")
+                                for document_id, task in tasks.items() if task is None]
+                    self._apply(run, documents, results, reindex_all=resumed)
+                    resumed = False
+                    if progress:
+                        progress(run)
+        except Exception as e:
+            logger.error(f"Reprocess run {run_id} failed: {e}", exc_info=True)
+            self._set_status(run_id, 'failed', str(e))
+            return self.get_run(run_id)
+
+        self._set_status(run_id, 'finished')
+        return self.get_run(run_id)
+
+    def _apply(self, run, documents, results, reindex_all=False):
+        """Index the changed documents of a batch and advance the checkpoint, then re-embed them"""
+        by_id = {document['id']: document for document in documents}
+        counts = dict.fromkeys(COUNTERS, 0)
+        changed = []
+        for document_id, outcome, title, markdown, message in results:
+            counts[outcome] += 1
+            if outcome == 'failed':
+                logger.warning(f"Could not reprocess document {document_id}: {message}")
+            elif markdown is not None:
+                changed.append((by_id[document_id], title, markdown))
+            elif outcome == 'unchanged' and reindex_all:
+                document = by_id[document_id]
+                changed.append((document, title, self.doc_storage.content_store.read(document['markdown_path'])))
+
+        run['last_id'] = documents[-1]['id']
+        run['processed'] += len(documents)
+        for name in COUNTERS:
+            run[name] += counts[name]
+        self._commit_batch(run, changed)
+
+        for document, _, markdown in changed:
+            self.doc_storage.invalidate_document(document['id'])
+            if document['canonical_id'] is None and self.doc_storage.vectors.enabled:
+                try:
+                    self.doc_storage.vectors.index_document(document['id'], markdown)
+                except Exception as e:
+                    logger.error(f"Error embedding document {document['id']}: {e}", exc_info=True)
+
+    @retry_on_busy
+    def _commit_batch(self, run, changed):
+        duplicates = self.doc_storage.duplicates
+        cursor = self.conn.cursor()
+        try:
+            for document, title, markdown in changed:
+                if title:
+                    cursor.execute('UPDATE documents SET title = ? WHERE id = ?', (title, document['id']))
+                self.doc_storage._index_document(cursor, document['id'], title or document['title'],
+                                                 document['url'], markdown)
+                if duplicates.enabled:
+                    duplicates.add(cursor, document['id'], duplicates.fingerprint(markdown))
+            cursor.execute(f'''
+                UPDATE reprocess_runs
+                SET last_id = ?, processed = ?, {', '.join(f'{name} = ?' for name in COUNTERS)}, updated_at = ?
+                WHERE id = ?
+            ''', (run['last_id'], run['processed'], *(run[name] for name in COUNTERS),
+                  datetime.now().isoformat(), run['id']))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
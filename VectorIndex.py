@@ -0,0 +1,486 @@
+import os
+import re
+import math
+import hashlib
+import importlib
+import threading
+import logging
+from abc import ABC, abstractmethod
+from collections import Counter
+from storage_utils import retry_on_busy
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Initialize logger
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r'[^\W_]+')
+# Scripts written without spaces are split into character bigrams
+CJK_RUN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]+')
+HEADING = re.compile(r'#{1,6}\s')
+PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+# Rows scored per matrix product, bounds the temporary score array
+SEARCH_BATCH = 65536
+# Rows the vector file grows by at least
+MIN_CAPACITY = 1024
+
+def tokenize(text: str) -> list[str]:
+    """Lowercased words, plus character bigrams of CJK text"""
+    text = text.lower()
+    tokens = []
+    for run in CJK_RUN.findall(text):
+        tokens.extend(run[i:i + 2] for i in range(max(1, len(run) - 1)))
+    tokens.extend(WORD_PATTERN.findall(CJK_RUN.sub(' ', text)))
+    return tokens
+
+def chunk_markdown(markdown: str, max_chars: int = 1200) -> list[tuple[int, int]]:
+    """Split markdown into chunks of whole paragraphs, returns their (start, end) offsets
+
+    A heading starts a new chunk once the current one holds a quarter of
+    max_chars, paragraphs longer than max_chars are cut at whitespace.
+    """
+    paragraphs = []
+    start = 0
+    for match in PARAGRAPH_BREAK.finditer(markdown):
+        paragraphs.append((start, match.start()))
+        start = match.end()
+    paragraphs.append((start, len(markdown)))
+
+    chunks = []
+    chunk_start = chunk_end = None
+    for start, end in paragraphs:
+        if not markdown[start:end].strip():
+            continue
+        while end - start > max_chars:
+            cut = markdown.rfind(' ', start + max_chars // 2, start + max_chars)
+            cut = cut if cut > start else start + max_chars
+            if chunk_start is not None:
+                chunks.append((chunk_start, chunk_end))
+                chunk_start = None
+            chunks.append((start, cut))
+            start = cut
+        if chunk_start is not None and (
+                end - chunk_start > max_chars
+                or (HEADING.match(markdown, start) and chunk_end - chunk_start >= max_chars // 4)):
+            chunks.append((chunk_start, chunk_end))
+            chunk_start = None
+        if chunk_start is None:
+            chunk_start = start
+        chunk_end = end
+    if chunk_start is not None:
+        chunks.append((chunk_start, chunk_end))
+    return chunks
+
+class Embedder(ABC):
+    """Turns texts into L2-normalised float32 vectors of a fixed dimension"""
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    @property
+    @abstractmethod
+    def name(self) -> str:
+        """Name stored with the index, vectors of different embedders are never mixed"""
+        pass
+
+    @abstractmethod
+    def embed(self, texts: list[str]):
+        """Embed the texts into a (len(texts), dim) float32 array of unit rows"""
+        pass
+
+class HashingEmbedder(Embedder):
+    """Signed feature hashing of sublinear term frequencies, needs no model or network"""
+
+    @property
+    def name(self) -> str:
+        return "hashing"
+
+    def embed(self, texts: list[str]):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            columns = []
+            values = []
+            for token, count in Counter(tokenize(text)).items():
+                h = int.from_bytes(hashlib.blake2b(token.encode('utf-8'), digest_size=8).digest(), 'little')
+                columns.append(h % self.dim)
+                values.append((1 + math.log(count)) * (1 if h >> 63 else -1))
+            np.add.at(vectors[row], columns, values)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+# Built-in embedders, config may also name a custom one as module:Class
+EMBEDDERS = {
+    'hashing': HashingEmbedder
+}
+
+def load_embedder(spec: str, dim: int) -> Embedder:
+    if spec in EMBEDDERS:
+        return EMBEDDERS[spec](dim=dim)
+    module_name, _, class_name = spec.partition(':')
+    return getattr(importlib.import_module(module_name), class_name)(dim=dim)
+
+class VectorIndex:
+    """Local vector index of document chunks for semantic search
+
+    Chunk vectors live in a memory-mapped float32 matrix next to the SQLite
+    database, one row per chunk; SQLite maps rows to documents and chunk
+    offsets. Every chunk carries a hash of its text, so re-indexing a changed
+    document only embeds the chunks that changed. Rows of removed chunks are
+    reused.
+
+    Search scores all live rows in batches with one matrix product each. With
+    a trained IVF index (`train`), a query only scores the rows of the nprobe
+    coarse lists closest to it.
+
+    Writes bump a generation counter in SQLite, so other processes serving the
+    same storage reload the row mapping before their next search.
+    """
+
+    def __init__(self, doc_storage, enabled: bool = True, embedder: str = 'hashing', dim: int = 512,
+                 chunk_chars: int = 1200, ivf_lists: int = 0, nprobe: int = 8):
+        """
+        Args:
+            doc_storage: DocumentStorage whose documents are indexed
+            enabled: Whether documents are embedded and semantic search is served
+            embedder: hashing, or module:Class of a custom Embedder
+            dim: Vector dimension
+            chunk_chars: Largest chunk in characters
+            ivf_lists: Coarse lists `train` builds by default, every chunk is scored until it is trained
+            nprobe: Lists scored per query when the IVF index is used
+        """
+        if enabled and np is None:
+            logger.warning("numpy is not installed, semantic search is disabled")
+            enabled = False
+        self.doc_storage = doc_storage
+        self.enabled = enabled
+        self.chunk_chars = chunk_chars
+        self.ivf_lists = ivf_lists
+        self.nprobe = max(1, int(nprobe))
+        self.path = os.path.join(os.path.dirname(doc_storage.db_path), 'vectors.f32')
+        self.centroids_path = os.path.join(os.path.dirname(doc_storage.db_path), 'vectors.ivf.npy')
+        self.lock = threading.RLock()
+        self.generation = None
+        self.matrix = None
+        if not enabled:
+            return
+        self.embedder = load_embedder(embedder, dim)
+        self.dim = self.embedder.dim
+        self._init_db()
+
+    @property
+    def conn(self):
+        return self.doc_storage.conn
+
+    @property
+    def busy_retries(self):
+        return self.doc_storage.busy_retries
+
+    def _init_db(self):
+        """Reset the index if the embedder changed since it was built"""
+        cursor = self.conn.cursor()
+        signature = f"{self.embedder.name}:{self.dim}"
+        stored = self._get_meta(cursor, 'embedder')
+        if stored != signature:
+            if stored is not None:
+                logger.warning(f"Embedder changed from {stored} to {signature}, the vector index is reset; "
+                               "rebuild it with: python manage.py embed")
+            cursor.execute('DELETE FROM vector_chunks')
+            cursor.execute('DELETE FROM vector_free_rows')
+            self._set_meta(cursor, 'rows', 0)
+            self._set_meta(cursor, 'embedder', signature)
+            self._bump_generation(cursor)
+            for path in (self.path, self.centroids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+        self.conn.commit()
+
+    def _get_meta(self, cursor, key, default=None):
+        cursor.execute('SELECT value FROM vector_meta WHERE key = ?', (key,))
+        row = cursor.fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, cursor, key, value):
+        cursor.execute('INSERT OR REPLACE INTO vector_meta (key, value) VALUES (?, ?)', (key, str(value)))
+
+    def _bump_generation(self, cursor):
+        self._set_meta(cursor, 'generation', int(self._get_meta(cursor, 'generation', 0)) + 1)
+
+    def _open_matrix(self, rows: int):
+        """Map the vector file, growing it to hold at least `rows` rows"""
+        row_bytes = self.dim * 4
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        capacity = size // row_bytes
+        if capacity < rows:
+            capacity = max(MIN_CAPACITY, rows, capacity * 2)
+            with open(self.path, 'ab') as f:
+                f.truncate(capacity * row_bytes)
+        if self.matrix is None or self.matrix.shape[0] != capacity:
+            self.matrix = np.memmap(self.path, dtype=np.float32, mode='r+', shape=(capacity, self.dim))
+        return self.matrix
+
+    def _allocate(self, cursor, count: int, freed: list[int]) -> list[int]:
+        """Rows for new chunks: rows freed by this document first, then the free list, then new rows"""
+        rows = freed[:count]
+        cursor.executemany('INSERT OR IGNORE INTO vector_free_rows (row) VALUES (?)', [(row,) for row in freed[count:]])
+        if len(rows) < count:
+            cursor.execute('SELECT row FROM vector_free_rows ORDER BY row LIMIT ?', (count - len(rows),))
+            reused = [row[0] for row in cursor.fetchall()]
+            cursor.executemany('DELETE FROM vector_free_rows WHERE row = ?', [(row,) for row in reused])
+            rows += reused
+        if len(rows) < count:
+            high = int(self._get_meta(cursor, 'rows', 0))
+            added = count - len(rows)
+            rows += list(range(high, high + added))
+            self._set_meta(cursor, 'rows', high + added)
+        return rows
+
+    def _load_centroids(self):
+        if os.path.exists(self.centroids_path):
+            return np.load(self.centroids_path)
+        return None
+
+    def _assign_lists(self, centroids, vectors):
+        return np.argmax(vectors @ centroids.T, axis=1)
+
+    @retry_on_busy
+    def index_document(self, document_id, markdown: str) -> int:
+        """Chunk and embed a document's markdown, returns the number of chunks embedded
+
+        Chunks whose text is unchanged since the document was last indexed
+        keep their vectors.
+        """
+        if not self.enabled:
+            return 0
+        spans = chunk_markdown(markdown or '', self.chunk_chars)
+        texts = [markdown[start:end] for start, end in spans]
+        hashes = [hashlib.sha1(text.encode('utf-8')).hexdigest() for text in texts]
+
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                cursor.execute('SELECT row, content_hash, list_id FROM vector_chunks WHERE document_id = ?',
+                               (document_id,))
+                stored = {}
+                for row, content_hash, list_id in cursor.fetchall():
+                    stored.setdefault(content_hash, []).append((row, list_id))
+
+                chunks = []
+                changed = []
+                for index, (span, content_hash) in enumerate(zip(spans, hashes)):
+                    if stored.get(content_hash):
+                        row, list_id = stored[content_hash].pop()
+                        chunks.append([row, index, span, content_hash, list_id])
+                    else:
+                        chunks.append([None, index, span, content_hash, None])
+                        changed.append(index)
+                freed = sorted(row for rows in stored.values() for row, _ in rows)
+
+                if changed:
+                    vectors = self.embedder.embed([texts[index] for index in changed])
+                    rows = self._allocate(cursor, len(changed), freed)
+                    matrix = self._open_matrix(max(rows) + 1)
+                    matrix[rows] = vectors
+                    matrix.flush()
+                    centroids = self._load_centroids()
+                    lists = self._assign_lists(centroids, vectors) if centroids is not None else [None] * len(rows)
+                    for index, row, list_id in zip(changed, rows, lists):
+                        chunks[index][0] = row
+                        chunks[index][4] = int(list_id) if list_id is not None else None
+                else:
+                    cursor.executemany('INSERT OR IGNORE INTO vector_free_rows (row) VALUES (?)',
+                                       [(row,) for row in freed])
+
+                cursor.execute('DELETE FROM vector_chunks WHERE document_id = ?', (document_id,))
+                cursor.executemany('''
+                    INSERT INTO vector_chunks (row, document_id, chunk_index, start_offset, end_offset, content_hash, list_id)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', [(row, document_id, index, start, end, content_hash, list_id)
+                      for row, index, (start, end), content_hash, list_id in chunks])
+                self._bump_generation(cursor)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        return len(changed)
+
+    @retry_on_busy
+    def remove_document(self, document_id):
+        """Drop a document's chunks, their rows are reused by later chunks"""
+        if not self.enabled:
+            return
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT row FROM vector_chunks WHERE document_id = ?', (document_id,))
+            rows = [row[0] for row in cursor.fetchall()]
+            if not rows:
+                return
+            cursor.executemany('INSERT OR IGNORE INTO vector_free_rows (row) VALUES (?)', [(row,) for row in rows])
+            cursor.execute('DELETE FROM vector_chunks WHERE document_id = ?', (document_id,))
+            self._bump_generation(cursor)
+            self.conn.commit()
+
+    def indexed_documents(self) -> set[int]:
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT DISTINCT document_id FROM vector_chunks')
+        return {row[0] for row in cursor.fetchall()}
+
+    def _refresh(self):
+        """Reload the row mapping when this or another process changed the index"""
+        cursor = self.conn.cursor()
+        generation = self._get_meta(cursor, 'generation')
+        if generation == self.generation:
+            return
+        high = int(self._get_meta(cursor, 'rows', 0))
+        cursor.execute('SELECT row, document_id, list_id FROM vector_chunks')
+        chunks = np.array([(row, document_id, -1 if list_id is None else list_id)
+                           for row, document_id, list_id in cursor.fetchall()], dtype=np.int64).reshape(-1, 3)
+        self.live = np.zeros(high, dtype=bool)
+        self.live[chunks[:, 0]] = True
+        self.row_documents = np.full(high, -1, dtype=np.int64)
+        self.row_documents[chunks[:, 0]] = chunks[:, 1]
+        self.row_lists = np.full(high, -1, dtype=np.int64)
+        self.row_lists[chunks[:, 0]] = chunks[:, 2]
+        self.centroids = self._load_centroids()
+        # A new or reset index has no vector file until the first document is embedded
+        if high and os.path.exists(self.path):
+            self._open_matrix(high)
+        else:
+            self.matrix = None
+        self.generation = generation
+
+    def _top_k(self, query, rows, k):
+        """(scores, rows) of the k best of the given rows, best first"""
+        scores = np.asarray(self.matrix[rows] @ query)
+        if len(rows) > k:
+            best = np.argpartition(-scores, k)[:k]
+            scores, rows = scores[best], rows[best]
+        order = np.argsort(-scores)
+        return scores[order], rows[order]
+
+    def search_rows(self, query: str, k: int = 10, document_ids=None):
+        """Best matching chunk rows of a query as (scores, rows), best first
+
+        Args:
+            query: Text to search for
+            k: Number of chunks to return
+            document_ids: Optional collection of documents the search is limited to
+        """
+        vector = self.embedder.embed([query])[0]
+        with self.lock:
+            self._refresh()
+            if self.matrix is None:
+                return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+            mask = self.live
+            if document_ids is not None:
+                mask = mask & np.isin(self.row_documents, np.fromiter(document_ids, dtype=np.int64))
+            if self.centroids is not None:
+                probe = np.argsort(-(self.centroids @ vector))[:self.nprobe]
+                # Rows added before training have no list and are always scored
+                mask = mask & (np.isin(self.row_lists, probe) | (self.row_lists < 0))
+
+            best_scores = np.empty(0, dtype=np.float32)
+            best_rows = np.empty(0, dtype=np.int64)
+            for start in range(0, len(mask), SEARCH_BATCH):
+                rows = np.flatnonzero(mask[start:start + SEARCH_BATCH]) + start
+                if not len(rows):
+                    continue
+                scores, rows = self._top_k(vector, rows, k)
+                best_scores = np.concatenate([best_scores, scores])
+                best_rows = np.concatenate([best_rows, rows])
+                if len(best_rows) > k:
+                    order = np.argsort(-best_scores)[:k]
+                    best_scores, best_rows = best_scores[order], best_rows[order]
+        return best_scores, best_rows
+
+    def search(self, query: str, k: int = 10, category_id=None) -> list[dict]:
+        """Semantic search over document chunks, returns the best chunks with their documents"""
+        if not self.enabled or not query.strip():
+            return []
+        cursor = self.conn.cursor()
+        document_ids = None
+        if category_id:
+            cursor.execute('SELECT id FROM documents WHERE category_id = ?', (category_id,))
+            document_ids = [row[0] for row in cursor.fetchall()]
+        scores, rows = self.search_rows(query, k, document_ids)
+        if not len(rows):
+            return []
+
+        row_list = [int(row) for row in rows]
+        cursor.execute(f'''
+            SELECT v.row, v.chunk_index, v.start_offset, v.end_offset, d.id, d.url, d.title, d.markdown_path,
+                   d.category_id, c.name AS category_name
+            FROM vector_chunks v
+            JOIN documents d ON d.id = v.document_id
+            LEFT JOIN categories c ON d.category_id = c.id
+            WHERE v.row IN ({','.join('?' * len(row_list))})
+        ''', row_list)
+        chunks = {row['row']: row for row in cursor.fetchall()}
+
+        results = []
+        markdowns = {}
+        for score, row in zip(scores, row_list):
+            chunk = chunks.get(row)
+            # Chunks sharing no terms with the query score zero and are not matches
+            if chunk is None or score <= 0:
+                continue
+            path = chunk['markdown_path']
+            if path not in markdowns:
+                markdowns[path] = self.doc_storage.content_store.read(path) \
+                    if path and self.doc_storage.content_store.exists(path) else ''
+            results.append({
+                'id': chunk['id'],
+                'url': chunk['url'],
+                'title': chunk['title'],
+                'category_id': chunk['category_id'],
+                'category_name': chunk['category_name'],
+                'chunk_index': chunk['chunk_index'],
+                'score': float(score),
+                'snippet': markdowns[path][chunk['start_offset']:chunk['end_offset']][:500]
+            })
+        return results
+
+    @retry_on_busy
+    def train(self, lists: int = None, iterations: int = 10, sample: int = 65536, seed: int = 0) -> int:
+        """Train the IVF coarse index with spherical k-means and assign every chunk to a list
+
+        Returns the number of lists. Chunks embedded later are assigned to the
+        nearest list as they are added; retrain after the corpus changed a lot.
+        """
+        lists = lists or self.ivf_lists
+        if not self.enabled or not lists:
+            return 0
+        with self.lock:
+            self.generation = None
+            self._refresh()
+            rows = np.flatnonzero(self.live) if self.matrix is not None else np.empty(0, dtype=np.int64)
+            if len(rows) < lists:
+                logger.warning(f"Only {len(rows)} chunks are indexed, too few for {lists} lists")
+                return 0
+            rng = np.random.default_rng(seed)
+            training = np.asarray(self.matrix[np.sort(rng.choice(rows, min(sample, len(rows)), replace=False))])
+            centroids = training[rng.choice(len(training), lists, replace=False)]
+            for _ in range(iterations):
+                assignment = np.argmax(training @ centroids.T, axis=1)
+                for list_id in range(lists):
+                    members = training[assignment == list_id]
+                    if len(members):
+                        centroid = members.sum(axis=0)
+                        centroids[list_id] = centroid / max(np.linalg.norm(centroid), 1e-12)
+
+            tmp_path = f"{self.centroids_path}.{threading.get_ident()}.tmp.npy"
+            np.save(tmp_path, centroids.astype(np.float32))
+            os.replace(tmp_path, self.centroids_path)
+
+            cursor = self.conn.cursor()
+            for start in range(0, len(rows), SEARCH_BATCH):
+                batch = rows[start:start + SEARCH_BATCH]
+                assignment = self._assign_lists(centroids, np.asarray(self.matrix[batch]))
+                cursor.executemany('UPDATE vector_chunks SET list_id = ? WHERE row = ?',
+                                   [(int(list_id), int(row)) for list_id, row in zip(assignment, batch)])
+            self._bump_generation(cursor)
+            self.conn.commit()
+        return lists
@@ -0,0 +1,74 @@
+"""ASGI entry point, serves the Flask app plus async crawl routes under uvicorn
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+POST /crawl is handled on the event loop with Crawler.acrawl, so one process
+keeps many page and image fetches in flight without a thread each. Every
+other route is served by the Flask app through a WSGI adapter.
+"""
+import json
+import logging
+from asgiref.wsgi import WsgiToAsgi
+from pydantic import ValidationError
+
+from main import app as flask_app, crawler
+from crawler import CrawlRequest
+from crawlers.result import CrawlResult
+
+logger = logging.getLogger(__name__)
+
+wsgi_app = WsgiToAsgi(flask_app)
+
+async def read_body(receive) -> bytes:
+    body = b''
+    while True:
+        message = await receive()
+        body += message.get('body', b'')
+        if not message.get('more_body'):
+            return body
+
+async def send_json(send, status: int, body: str):
+    data = body.encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(data)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': data})
+
+async def crawl(scope, receive, send):
+    """Crawl a URL and store its content"""
+    try:
+        req = CrawlRequest.parse_obj(json.loads(await read_body(receive)))
+    except (ValueError, ValidationError) as e:
+        return await send_json(send, 400, CrawlResult(success=False, message=str(e)).json())
+
+    try:
+        result = await crawler.acrawl(req)
+        await send_json(send, 200, result.json())
+    except Exception as e:
+        logger.error(f"Error crawling URL: {e}", exc_info=True)
+        await send_json(send, 500, CrawlResult(success=False, message=str(e)).json())
+
+async def lifespan(scope, receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+# Routes served natively on the event loop, keyed by (method, path)
+ASYNC_ROUTES = {
+    ('POST', '/crawl'): crawl
+}
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(scope, receive, send)
+    if scope['type'] == 'http':
+        handler = ASYNC_ROUTES.get((scope['method'], scope['path']))
+        if handler:
+            return await handler(scope, receive, send)
+    await wsgi_app(scope, receive, send)
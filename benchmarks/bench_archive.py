@@ -0,0 +1,117 @@
+"""Bulk export and import benchmark for CorpusArchive
+
+Writes a JSONL archive of generated documents with images, imports it into
+an empty temporary storage, exports that storage again in each format and
+imports the export into a second storage to check the round trip. Reports
+documents per second and the peak memory of every step.
+
+    python benchmarks/bench_archive.py --documents 10000
+    python benchmarks/bench_archive.py --documents 50000 --batch-size 2000 --workers 16
+"""
+import argparse
+import base64
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DocumentStorage import DocumentStorage
+from CorpusArchive import CorpusArchive, FORMATS
+
+def make_storage(workdir: str) -> DocumentStorage:
+    os.makedirs(workdir, exist_ok=True)
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({
+            'storage': {
+                'db_path': os.path.join(workdir, 'db'),
+                'doc_path': os.path.join(workdir, 'docs')
+            },
+            # Embedding is a separate step after an import
+            'vectors': {'enabled': False}
+        }, f)
+    return DocumentStorage(config_path=config_path)
+
+def write_archive(path: str, documents: int, images: int, seed: int = 1):
+    """Generated JSONL archive, images are drawn from a small pool so blobs are shared"""
+    rng = random.Random(seed)
+    words = [''.join(rng.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rng.randint(3, 9))) for _ in range(2000)]
+    pool = [os.urandom(rng.randint(2000, 20000)) for _ in range(max(1, documents // 10))]
+    with open(path, 'w') as f:
+        f.write(json.dumps({'type': 'manifest', 'version': 1, 'categories': [{'name': 'bench', 'created_at': None}]}) + '\n')
+        for i in range(documents):
+            markdown = '\n\n'.join(' '.join(rng.choices(words, k=80)) for _ in range(6))
+            record = {
+                'type': 'document',
+                'meta': {'id': i + 1, 'url': f'https://bench.example/{i}', 'title': f'Document {i}',
+                         'category_name': 'bench', 'created_at': '2024-01-01T00:00:00'},
+                'markdown': markdown,
+                'raw': f'<html><body>{markdown}</body></html>',
+                'image_mapping': {},
+                'images': {f'{n}.png': base64.b64encode(rng.choice(pool)).decode('ascii') for n in range(images)}
+            }
+            f.write(json.dumps(record) + '\n')
+
+def measure(step):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = step()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=5000)
+    parser.add_argument('--images', type=int, default=2, help="Images per document")
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        source = os.path.join(workdir, 'source.jsonl')
+        write_archive(source, args.documents, args.images)
+        print(f"Archive of {args.documents} documents, {os.path.getsize(source) / 1048576:.1f} MB")
+
+        storage = make_storage(os.path.join(workdir, 'a'))
+        with open(source, 'rb') as f:
+            stats, elapsed, peak = measure(lambda: CorpusArchive(storage).import_archive(
+                f, 'jsonl', batch_size=args.batch_size, workers=args.workers))
+        print(f"import jsonl   {stats['imported'] / elapsed:8.0f} docs/s  {elapsed:6.2f}s  peak {peak / 1048576:6.1f} MB")
+
+        exports = {}
+        for fmt in FORMATS:
+            path = os.path.join(workdir, f'export.{fmt}')
+
+            def export():
+                with open(path, 'wb') as f:
+                    for chunk in CorpusArchive(storage).export(fmt):
+                        f.write(chunk)
+
+            _, elapsed, peak = measure(export)
+            exports[fmt] = path
+            print(f"export {fmt:8} {args.documents / elapsed:8.0f} docs/s  {elapsed:6.2f}s  peak {peak / 1048576:6.1f} MB"
+                  f"  {os.path.getsize(path) / 1048576:.1f} MB")
+
+        restored = make_storage(os.path.join(workdir, 'b'))
+        with open(exports['tar.gz'], 'rb') as f:
+            stats, elapsed, peak = measure(lambda: CorpusArchive(restored).import_archive(
+                f, 'tar.gz', batch_size=args.batch_size, workers=args.workers))
+        print(f"import tar.gz  {stats['imported'] / elapsed:8.0f} docs/s  {elapsed:6.2f}s  peak {peak / 1048576:6.1f} MB")
+
+        expected = {d['url']: d for d in storage.get_documents()}
+        actual = {d['url']: d for d in restored.get_documents()}
+        mismatched = [url for url in expected if url not in actual or
+                      storage.content_store.read(expected[url]['markdown_path']) !=
+                      restored.content_store.read(actual[url]['markdown_path'])]
+        print(f"round trip: {len(actual)} of {len(expected)} documents restored, {len(mismatched)} differ")
+
+if __name__ == '__main__':
+    main()
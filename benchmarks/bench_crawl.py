@@ -0,0 +1,302 @@
+"""End-to-end crawl benchmark against a generated local site
+
+Starts a local HTTP server that serves generated pages of different sizes,
+image counts and link densities, then crawls all of them through Crawler
+(CrawlerManager, DefaultCrawler, ImageDownloader, DocumentStorage) into a
+temporary storage. Reports pages/sec, bytes/sec, p50/p95/p99 latency of each
+stage and peak RSS, and saves the results as JSON. A previous result file can
+be passed as a baseline; the run fails when throughput drops or latency grows
+by more than the tolerance.
+
+    python benchmarks/bench_crawl.py --pages 200 --concurrency 8 --output results.json
+    python benchmarks/bench_crawl.py --baseline results.json
+"""
+import argparse
+import contextlib
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DocumentStorage import DocumentStorage
+from crawler import Crawler, CrawlRequest
+
+# Page shapes cycled through by the generated site: (name, body bytes, images, links)
+PROFILES = [
+    ('small', 20_000, 2, 10),
+    ('medium', 150_000, 10, 50),
+    ('large', 800_000, 30, 200),
+    ('image_heavy', 60_000, 60, 20),
+    ('link_dense', 100_000, 5, 500),
+]
+
+# Stages reported in CrawlResult.timings
+STAGES = ('fetch', 'parse', 'fix_urls', 'html2text', 'images', 'replace_images', 'store', 'total')
+
+WORDS = ('crawl', 'storage', 'markdown', 'parser', 'image', 'index', 'cache', 'query', 'session', 'render',
+         'document', 'category', 'search', 'thread', 'worker', 'budget', 'schema', 'cursor', 'blob', 'frontier')
+
+class Site:
+    """Generated pages and images served from memory"""
+
+    def __init__(self, pages: int, seed: int = 1):
+        self.rng = random.Random(seed)
+        self.pages = {}
+        self.images = {}
+        self.profiles = {}
+        for i in range(pages):
+            profile = PROFILES[i % len(PROFILES)]
+            path = f'/docs/{profile[0]}/{i}.html'
+            self.pages[path] = self._page(i, pages, *profile)
+            self.profiles[path] = profile[0]
+        self.bytes_served = 0
+        self.lock = threading.Lock()
+
+    def _text(self, length: int) -> str:
+        words = []
+        size = 0
+        while size < length:
+            word = self.rng.choice(WORDS)
+            words.append(word)
+            size += len(word) + 1
+        return ' '.join(words)
+
+    def _page(self, index, total, name, size, images, links) -> bytes:
+        parts = [f'<html><head><meta charset="utf-8"><title>Bench {name} {index}</title></head><body>']
+        sections = max(1, images, links // 10)
+        section_size = size // sections
+        for s in range(sections):
+            parts.append(f'<h2>Section {s}</h2><p>{self._text(section_size)}</p>')
+            if s < images:
+                image_path = f'/img/{index}/{s}.png'
+                self.images[image_path] = self.rng.randbytes(4000 + self.rng.randrange(4000))
+                parts.append(f'<img src="{image_path}" alt="figure {s}">')
+            link_count = links // sections
+            if link_count:
+                items = ''.join(f'<li><a href="/docs/{PROFILES[(index + k) % len(PROFILES)][0]}/'
+                                f'{(index + k) % total}.html">link {k}</a></li>'
+                                for k in range(s * link_count, (s + 1) * link_count))
+                parts.append(f'<ul>{items}</ul>')
+        parts.append('</body></html>')
+        return ''.join(parts).encode('utf-8')
+
+    def handler(self):
+        site = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path in site.pages:
+                    body, content_type = site.pages[self.path], 'text/html; charset=utf-8'
+                elif self.path in site.images:
+                    body, content_type = site.images[self.path], 'image/png'
+                else:
+                    self.send_response(404)
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+                with site.lock:
+                    site.bytes_served += len(body)
+
+        return Handler
+
+def make_crawler(workdir: str, image_workers: int) -> Crawler:
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({
+            'storage': {
+                'db_path': os.path.join(workdir, 'db'),
+                'doc_path': os.path.join(workdir, 'docs')
+            },
+            # The local server is ours, so no politeness delays
+            'politeness': {'per_host': 64, 'min_delay': 0, 'robots': False},
+            'images': {'workers': image_workers}
+        }, f)
+    return Crawler(DocumentStorage(config_path=config_path))
+
+class StageTimer:
+    """Collects the per-stage latencies Crawler reports in CrawlResult.timings"""
+
+    def __init__(self):
+        self.samples = {stage: [] for stage in STAGES}
+        self.lock = threading.Lock()
+
+    def record(self, timings: dict):
+        with self.lock:
+            for stage, value in timings.items():
+                self.samples.setdefault(stage, []).append(value)
+
+def crawl_page(crawler: Crawler, timer: StageTimer, req: CrawlRequest) -> bool:
+    result = crawler.crawl(req)
+    if result.success:
+        timer.record(result.timings)
+    return result.success
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def peak_rss_mb() -> float:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return ''
+
+def run(args) -> dict:
+    site = Site(args.pages, seed=args.seed)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), site.handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+
+    with tempfile.TemporaryDirectory() as workdir:
+        crawler = make_crawler(workdir, args.image_workers)
+        category_id = crawler.doc_storage.add_category('bench')
+        timer = StageTimer()
+
+        paths = list(site.pages)
+        failures = 0
+        failures_lock = threading.Lock()
+        queue = iter(paths)
+        queue_lock = threading.Lock()
+
+        def worker():
+            nonlocal failures
+            while True:
+                with queue_lock:
+                    path = next(queue, None)
+                if path is None:
+                    return
+                ok = crawl_page(crawler, timer, CrawlRequest(url=base_url + path, category_id=category_id))
+                if not ok:
+                    with failures_lock:
+                        failures += 1
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(args.concurrency)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        server.shutdown()
+
+    pages = len(paths) - failures
+    return {
+        'timestamp': datetime.now().isoformat(),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'settings': {
+            'pages': args.pages,
+            'concurrency': args.concurrency,
+            'image_workers': args.image_workers,
+            'seed': args.seed,
+            'profiles': [dict(zip(('name', 'bytes', 'images', 'links'), p)) for p in PROFILES]
+        },
+        'elapsed_s': elapsed,
+        'pages_ok': pages,
+        'pages_failed': failures,
+        'pages_per_s': pages / elapsed if elapsed else 0.0,
+        'bytes_served': site.bytes_served,
+        'bytes_per_s': site.bytes_served / elapsed if elapsed else 0.0,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages_ms': {
+            stage: {
+                'p50': percentile(values, 50) * 1000,
+                'p95': percentile(values, 95) * 1000,
+                'p99': percentile(values, 99) * 1000,
+                'mean': sum(values) / len(values) * 1000 if values else 0.0
+            }
+            for stage, values in timer.samples.items()
+        }
+    }
+
+def print_results(results: dict):
+    print(f"pages: {results['pages_ok']} ok, {results['pages_failed']} failed in {results['elapsed_s']:.2f}s")
+    print(f"throughput: {results['pages_per_s']:.1f} pages/s, {results['bytes_per_s'] / 1048576:.1f} MB/s")
+    print(f"peak RSS: {results['peak_rss_mb']:.0f} MB")
+    print(f"{'stage':<16}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for stage, stats in results['stages_ms'].items():
+        print(f"{stage:<16}{stats['p50']:>10.1f}{stats['p95']:>10.1f}{stats['p99']:>10.1f}{stats['mean']:>10.1f}")
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Return the regressions of results against a baseline run"""
+    regressions = []
+    for key in ('pages_per_s', 'bytes_per_s'):
+        if baseline.get(key) and results[key] < baseline[key] * (1 - tolerance):
+            regressions.append(f"{key}: {results[key]:.1f} vs {baseline[key]:.1f}")
+    if baseline.get('peak_rss_mb') and results['peak_rss_mb'] > baseline['peak_rss_mb'] * (1 + tolerance):
+        regressions.append(f"peak_rss_mb: {results['peak_rss_mb']:.0f} vs {baseline['peak_rss_mb']:.0f}")
+    for stage, stats in results['stages_ms'].items():
+        before = baseline.get('stages_ms', {}).get(stage, {})
+        for pct in ('p50', 'p95'):
+            if before.get(pct) and stats[pct] > before[pct] * (1 + tolerance):
+                regressions.append(f"{stage} {pct}: {stats[pct]:.1f} ms vs {before[pct]:.1f} ms")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8, help='Pages crawled in parallel')
+    parser.add_argument('--image-workers', type=int, default=8, help='Parallel image downloads per page')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='Write the results as JSON to this file')
+    parser.add_argument('--baseline', help='Compare against a previous JSON result')
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help='Allowed relative slowdown before a metric counts as a regression')
+    parser.add_argument('--verbose', action='store_true', help="Show the crawler's progress output")
+    args = parser.parse_args()
+
+    # The crawler prints every page and image it fetches
+    with contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO()):
+        results = run(args)
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        if regressions:
+            sys.exit(1)
+        print(f"no regressions against {args.baseline} (commit {baseline.get('commit') or 'unknown'})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+"""Benchmark markdown image rewriting against the previous implementation
+
+Generates a large markdown document full of images (relative, protocol-relative
+and absolute sources, titles, repeated and linked images), then times
+ImageExtractor.replace_markdown_images and restore_markdown_images. The old
+quadratic versions are kept here for comparison; they are run on a smaller
+slice of the document because they take far too long at full size, and both
+outputs are checked for identity.
+
+    python benchmarks/bench_image_rewrite.py --images 10000 --size 5000000
+"""
+import argparse
+import os
+import sys
+import re
+import random
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from crawlers.image_extractor import ImageExtractor
+
+BASE_URL = 'https://docs.example.com/guide/page.html'
+
+def old_replace_markdown_images(extractor, markdown_content, local_images, base_url=None):
+    def _get_local_image_path(url) -> str:
+        if url:
+            for src in local_images:
+                if url == src or extractor._get_full_url(url, base_url) == extractor._get_full_url(src, base_url):
+                    return local_images[src]
+        return None
+
+    for pattern in extractor.md_image_patterns:
+        matches = re.finditer(pattern, markdown_content, re.MULTILINE|re.DOTALL)
+        for match in matches:
+            url = match.group(1).strip()
+            local_image_path = _get_local_image_path(url)
+            if local_image_path:
+                markdown_content = markdown_content.replace(f'{url}', f'{local_image_path}')
+    return markdown_content
+
+def old_restore_markdown_images(extractor, markdown, base_path):
+    if not base_path:
+        return markdown
+    for pattern in extractor.md_image_patterns:
+        matches = re.finditer(pattern, markdown, re.MULTILINE|re.DOTALL)
+        for match in matches:
+            image_path = match.group(1).strip()
+            view_path = f'/view_image/{base_path}/{image_path}'
+            if view_path:
+                markdown = markdown.replace(f'({image_path})', f'({view_path})')
+    return markdown
+
+def image_source(i):
+    kind = i % 4
+    if kind == 0:
+        return f'https://cdn.example.com/assets/{i:05d}/figure.png'
+    if kind == 1:
+        return f'//static.example.org/img/{i}.jpg'
+    if kind == 2:
+        return f'/images/diagrams/diagram-{i}.svg'
+    return f'../media/{i}/shot.webp'
+
+def generate(images: int, size: int, seed: int = 1):
+    """Return (markdown, image mapping keyed by absolute URL) for a synthetic page"""
+    rng = random.Random(seed)
+    sources = [image_source(i) for i in range(images)]
+    filler_len = max(0, size // max(images, 1) - 80)
+    words = ['lorem', 'ipsum', 'dolor', 'sit', 'amet', 'crawl', 'markdown', 'image', 'parser', 'cache']
+    parts = ['# Generated page\n\n']
+    for i, src in enumerate(sources):
+        text = []
+        length = 0
+        while length < filler_len:
+            word = rng.choice(words)
+            text.append(word)
+            length += len(word) + 1
+        parts.append(' '.join(text) + '\n\n')
+        if i % 7 == 0:
+            parts.append(f'![figure {i}]({src} "Figure {i}")\n\n')
+        elif i % 11 == 0:
+            parts.append(f'[![thumb {i}]({src})]({src})\n\n')
+        else:
+            parts.append(f'![figure {i}]({src})\n\n')
+        if i % 13 == 0:
+            # Repeated image further down the page
+            parts.append(f'Again: ![repeat]({src})\n\n')
+
+    extractor = ImageExtractor()
+    mapping = {}
+    for i, src in enumerate(sources):
+        mapping[extractor._get_full_url(src, BASE_URL)] = f'images/{i:05d}.png'
+    return ''.join(parts), mapping
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--images', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=5_000_000, help='Approximate document size in characters')
+    parser.add_argument('--compare-images', type=int, default=500,
+                        help='Images in the slice the old implementation is compared on')
+    args = parser.parse_args()
+
+    extractor = ImageExtractor()
+    base_path = 'category/docs.example.com/0123abcd'
+
+    markdown, mapping = generate(args.images, args.size)
+    print(f"document: {len(markdown):,} chars, {args.images:,} images")
+
+    replaced, replace_time = timed(extractor.replace_markdown_images, markdown, mapping, BASE_URL)
+    restored, restore_time = timed(extractor.restore_markdown_images, replaced, base_path)
+    print(f"new replace_markdown_images: {replace_time * 1000:10.1f} ms")
+    print(f"new restore_markdown_images: {restore_time * 1000:10.1f} ms")
+    missed = len(re.findall(r'\]\((?:https?:)?//', replaced))
+    print(f"remote image references left after replace: {missed}")
+
+    # Same shape, fewer images, so the old implementation finishes in reasonable time
+    size = args.size * args.compare_images // max(args.images, 1)
+    small, small_mapping = generate(args.compare_images, size)
+    new_replaced, new_replace_time = timed(extractor.replace_markdown_images, small, small_mapping, BASE_URL)
+    old_replaced, old_replace_time = timed(old_replace_markdown_images, extractor, small, small_mapping, BASE_URL)
+    new_restored, new_restore_time = timed(extractor.restore_markdown_images, new_replaced, base_path)
+    old_restored, old_restore_time = timed(old_restore_markdown_images, extractor, old_replaced, base_path)
+
+    print(f"\ncomparison slice: {len(small):,} chars, {args.compare_images:,} images")
+    print(f"replace: old {old_replace_time * 1000:10.1f} ms  new {new_replace_time * 1000:8.1f} ms")
+    print(f"restore: old {old_restore_time * 1000:10.1f} ms  new {new_restore_time * 1000:8.1f} ms")
+
+    identical = new_replaced == old_replaced and new_restored == old_restored
+    print("outputs identical" if identical else "OUTPUTS DIFFER")
+    if not identical:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Document folder layout benchmark
+
+Creates the folders of N documents in the old category/domain layout and in
+the sharded layout of DocumentStorage.get_document_path, then reports the
+cost of computing a document's path, of looking up folders by path, of
+listing the largest directory and of walking the whole tree, and how many
+documents would share a folder with another one.
+
+Every document belongs to a few domains, the case where the old layout puts
+hundreds of thousands of folders in one directory.
+
+    python benchmarks/bench_layout.py --documents 1000000
+    python benchmarks/bench_layout.py --documents 200000 --domains 4 --lookups 50000
+"""
+import argparse
+import hashlib
+import os
+import random
+import sys
+import tempfile
+import time
+from urllib.parse import urlparse
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DocumentStorage import DocumentStorage
+
+def make_storage(workdir: str) -> DocumentStorage:
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({
+            'storage': {
+                'db_path': os.path.join(workdir, 'db'),
+                'doc_path': os.path.join(workdir, 'sharded')
+            },
+            'vectors': {'enabled': False}
+        }, f)
+    return DocumentStorage(config_path=config_path)
+
+def legacy_path(doc_storage: DocumentStorage, base_path: str, url: str, category_id: int) -> str:
+    """Path of the old layout, including the category lookup it made on every call"""
+    cursor = doc_storage.conn.cursor()
+    cursor.execute('SELECT name FROM categories WHERE id = ?', (category_id,))
+    category_name = cursor.fetchone()[0].lower().replace(' ', '_')
+    doc_id = hashlib.md5(url.encode()).hexdigest()[:8]
+    return os.path.join(base_path, category_name, urlparse(url).netloc, doc_id)
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def time_calls(call, items):
+    timings = []
+    for item in items:
+        start = time.perf_counter()
+        call(item)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def largest_directory(root: str):
+    """(entries, path) of the directory with the most entries"""
+    largest = (0, root)
+    for dirpath, dirnames, filenames in os.walk(root):
+        largest = max(largest, (len(dirnames) + len(filenames), dirpath))
+    return largest
+
+def report(name, path_timings, lookup_timings, root, created, collisions):
+    start = time.perf_counter()
+    entries, directory = largest_directory(root)
+    walk = time.perf_counter() - start
+    start = time.perf_counter()
+    with os.scandir(directory) as it:
+        listed = sum(1 for _ in it)
+    listing = time.perf_counter() - start
+    print(f"{name:8} create {created:7.1f}s"
+          f"  path p50 {percentile(path_timings, 0.5) * 1e6:6.1f}us p99 {percentile(path_timings, 0.99) * 1e6:6.1f}us"
+          f"  lookup p50 {percentile(lookup_timings, 0.5) * 1e6:6.1f}us p99 {percentile(lookup_timings, 0.99) * 1e6:7.1f}us"
+          f"  largest dir {entries:8d} entries, listed in {listing * 1000:8.1f}ms"
+          f"  walk {walk:6.1f}s  shared folders {collisions}")
+    assert listed == entries
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--domains', type=int, default=2)
+    parser.add_argument('--lookups', type=int, default=20000)
+    parser.add_argument('--dir', help="Where to create the folders, a temporary directory by default")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as workdir:
+        doc_storage = make_storage(workdir)
+        category_id = doc_storage.add_category('Benchmark Docs')
+        legacy_root = os.path.join(workdir, 'legacy')
+        sharded_root = doc_storage.doc_path
+        urls = [f'https://site{i % args.domains}.example/docs/page-{i}' for i in range(args.documents)]
+        rng = random.Random(1)
+        sample = rng.sample(urls, min(args.lookups, len(urls)))
+
+        layouts = [
+            ('legacy', legacy_root, lambda url: legacy_path(doc_storage, legacy_root, url, category_id)),
+            ('sharded', sharded_root, doc_storage.get_document_path),
+        ]
+        for name, root, path_of in layouts:
+            start = time.perf_counter()
+            collisions = 0
+            for url in urls:
+                path = path_of(url)
+                # The old layout's 8 hex digits of MD5 give two URLs the same folder from about 100k documents on
+                collisions += os.path.isdir(path)
+                os.makedirs(path, exist_ok=True)
+            created = time.perf_counter() - start
+
+            path_timings = time_calls(path_of, sample)
+            paths = [path_of(url) for url in sample]
+            lookup_timings = time_calls(os.path.isdir, paths)
+            report(name, path_timings, lookup_timings, root, created, collisions)
+
+if __name__ == '__main__':
+    main()
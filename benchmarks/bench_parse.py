@@ -0,0 +1,88 @@
+"""Per-page CPU time of the DefaultCrawler HTML pipeline
+
+Compares the previous pipeline (parse, serialize, re-parse in _fix_relative_urls,
+html2text) against the single-parse pipeline for every installed parser backend.
+
+    python benchmarks/bench_parse.py --sections 2000 --rounds 5
+"""
+import argparse
+import os
+import sys
+import time
+from urllib.parse import urljoin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import html2text
+from bs4 import BeautifulSoup, FeatureNotFound
+from crawlers.default import DefaultCrawler, PARSERS
+
+BASE_URL = 'https://docs.example.com/guide/page.html'
+
+def generate_page(sections: int) -> str:
+    parts = ['<html><head><title>Benchmark page</title></head><body>']
+    for i in range(sections):
+        parts.append(f'''
+        <h2>Section {i}</h2>
+        <p>Paragraph {i} with <a href="../ref/{i}.html">a relative link</a>, <code>inline_code()</code>
+        and <b>bold</b> text. Lorem ipsum dolor sit amet, consectetur adipiscing elit.</p>
+        <ul><li>first item</li><li>second <a href="https://example.org/{i}">item</a></li></ul>
+        <img src="images/figure-{i}.png" alt="figure {i}">
+        <pre><code>for x in range({i}):
+    print(x)</code></pre>''')
+    parts.append('</body></html>')
+    return ''.join(parts)
+
+def previous_pipeline(raw_content: str, url: str) -> str:
+    """The pipeline as it was before the single-parse change"""
+    soup = BeautifulSoup(raw_content, 'html.parser')
+    [img.get('src') for img in soup.find_all('img')]
+    html_content = str(soup)
+    soup = BeautifulSoup(html_content, 'html.parser')
+    for a in soup.find_all('a', href=True):
+        a['href'] = urljoin(url, a['href'])
+    for img in soup.find_all('img', src=True):
+        img['src'] = urljoin(url, img['src'])
+    html_content = str(soup)
+    return html2text.html2text(html_content)
+
+def single_parse_pipeline(crawler: DefaultCrawler, raw_content: str, url: str) -> str:
+    soup = BeautifulSoup(raw_content, crawler.parser)
+    crawler._extract_image_urls(soup)
+    crawler._fix_relative_urls(soup, url)
+    return html2text.html2text(str(soup))
+
+def measure(fn, rounds: int) -> float:
+    """Return the best CPU time of `rounds` runs in milliseconds"""
+    best = None
+    for _ in range(rounds):
+        start = time.process_time()
+        fn()
+        elapsed = time.process_time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sections', type=int, default=2000, help='Number of content sections in the generated page')
+    parser.add_argument('--rounds', type=int, default=5, help='Runs per pipeline, the best one is reported')
+    args = parser.parse_args()
+
+    raw_content = generate_page(args.sections)
+    print(f"Page size: {len(raw_content) / 1024:.0f} KB, {args.sections} sections")
+
+    baseline = measure(lambda: previous_pipeline(raw_content, BASE_URL), args.rounds)
+    print(f"{'previous (html.parser x2)':<28} {baseline:10.1f} ms")
+
+    for name in PARSERS:
+        try:
+            BeautifulSoup('', name)
+        except FeatureNotFound:
+            print(f"{'single-parse ' + name:<28} {'not installed':>13}")
+            continue
+        crawler = DefaultCrawler(parser=name)
+        elapsed = measure(lambda: single_parse_pipeline(crawler, raw_content, BASE_URL), args.rounds)
+        print(f"{'single-parse ' + name:<28} {elapsed:10.1f} ms  ({baseline / elapsed:.2f}x)")
+
+if __name__ == '__main__':
+    main()
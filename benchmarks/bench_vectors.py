@@ -0,0 +1,111 @@
+"""Semantic search benchmark for VectorIndex
+
+Indexes generated documents drawn from a set of topic vocabularies into a
+temporary storage, then reports indexing throughput, the cost of re-indexing
+an unchanged document, and query latency of the exact search and of the IVF
+index together with its recall against the exact results.
+
+    python benchmarks/bench_vectors.py --documents 5000 --queries 200
+    python benchmarks/bench_vectors.py --documents 20000 --lists 128 --nprobe 8
+"""
+import argparse
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DocumentStorage import DocumentStorage
+
+def make_storage(workdir: str, dim: int, lists: int, nprobe: int) -> DocumentStorage:
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({
+            'storage': {
+                'db_path': os.path.join(workdir, 'db'),
+                'doc_path': os.path.join(workdir, 'docs')
+            },
+            'vectors': {'dim': dim, 'ivf_lists': lists, 'nprobe': nprobe}
+        }, f)
+    return DocumentStorage(config_path=config_path)
+
+def make_topics(rng: random.Random, count: int, words: int = 40) -> list[list[str]]:
+    syllables = ['ka', 'lo', 'mi', 'ne', 'ru', 'sa', 'to', 'vi', 'ze', 'po', 'qu', 'an']
+    return [[''.join(rng.choice(syllables) for _ in range(3)) for _ in range(words)] for _ in range(count)]
+
+def make_document(rng: random.Random, topics, paragraphs: int = 5) -> str:
+    topic = rng.choice(topics)
+    return '\n\n'.join(' '.join(rng.choice(topic) for _ in range(80)) for _ in range(paragraphs))
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+def time_queries(vectors, queries, k):
+    latencies = []
+    results = []
+    for query in queries:
+        start = time.perf_counter()
+        _, rows = vectors.search_rows(query, k)
+        latencies.append(time.perf_counter() - start)
+        results.append(set(int(row) for row in rows))
+    return latencies, results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=2000)
+    parser.add_argument('--topics', type=int, default=50)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--dim', type=int, default=512)
+    parser.add_argument('--lists', type=int, help="IVF lists, about the square root of the chunk count by default")
+    parser.add_argument('--nprobe', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    topics = make_topics(rng, args.topics)
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = make_storage(workdir, args.dim, args.lists or 0, args.nprobe)
+        vectors = storage.vectors
+        category_id = storage.add_category('bench')
+
+        documents = []
+        start = time.perf_counter()
+        chunks = 0
+        for i in range(args.documents):
+            markdown = make_document(rng, topics)
+            doc_id = storage.add_document(f'https://bench.local/{i}', f'doc {i}', '', markdown, category_id)
+            chunks += vectors.index_document(doc_id, markdown)
+            documents.append((doc_id, markdown))
+        elapsed = time.perf_counter() - start
+        print(f"indexed {args.documents} documents, {chunks} chunks in {elapsed:.1f}s "
+              f"({args.documents / elapsed:.0f} documents/s, {chunks / elapsed:.0f} chunks/s, storage included)")
+
+        sample = documents[:min(200, len(documents))]
+        start = time.perf_counter()
+        for doc_id, markdown in sample:
+            vectors.index_document(doc_id, markdown)
+        print(f"re-index unchanged: {(time.perf_counter() - start) / len(sample) * 1000:.2f} ms/document")
+
+        queries = [' '.join(rng.sample(rng.choice(topics), 4)) for _ in range(args.queries)]
+        exact_latencies, exact_results = time_queries(vectors, queries, args.k)
+        print(f"exact search: p50 {percentile(exact_latencies, 50) * 1000:.2f} ms, "
+              f"p95 {percentile(exact_latencies, 95) * 1000:.2f} ms")
+
+        lists = args.lists or max(1, int(math.sqrt(chunks)))
+        start = time.perf_counter()
+        vectors.train(lists=lists)
+        print(f"trained {lists} IVF lists in {time.perf_counter() - start:.1f}s")
+
+        ivf_latencies, ivf_results = time_queries(vectors, queries, args.k)
+        recall = sum(len(a & b) / max(1, len(a)) for a, b in zip(exact_results, ivf_results)) / len(queries)
+        print(f"IVF search (nprobe {args.nprobe}): p50 {percentile(ivf_latencies, 50) * 1000:.2f} ms, "
+              f"p95 {percentile(ivf_latencies, 95) * 1000:.2f} ms, recall@{args.k} {recall:.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Consistency check of the document cache with Redis and with the in-process LRU
+
+Runs the same scenario against a DocumentStorage whose cache uses a local
+fake Redis (fakeredis) and one using the LRU fallback: cached reads must
+reflect every write, delete and category change, entries must expire with
+their TTL, and a failing Redis must fall back to SQLite. The LRU is also
+filled with many more per-document generations than it holds, to check it
+stays within max_entries and never serves an entry cached under an evicted
+generation. Exits with status 1 if any check fails.
+
+    python benchmarks/check_cache.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DocumentStorage import DocumentStorage
+from cache import DocumentCache, LRUCache
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+def make_storage(workdir: str, name: str) -> DocumentStorage:
+    config_path = os.path.join(workdir, f'{name}.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({
+            'storage': {
+                'db_path': os.path.join(workdir, name, 'db'),
+                'doc_path': os.path.join(workdir, name, 'docs')
+            },
+            'vectors': {'enabled': False}
+        }, f)
+    return DocumentStorage(config_path=config_path)
+
+class BrokenRedis:
+    """Redis client whose every call fails, as during an outage"""
+
+    def __getattr__(self, name):
+        def fail(*args, **kwargs):
+            raise ConnectionError("Redis is unavailable")
+        return fail
+
+class Checker:
+    def __init__(self):
+        self.failures = []
+
+    def expect(self, name, condition, detail=''):
+        print(f"  {name:60} {'ok' if condition else 'FAIL'}")
+        if not condition:
+            self.failures.append(f"{name}: {detail}")
+
+def check_consistency(checker: Checker, storage: DocumentStorage, ttl: float):
+    """Cached reads after writes return what SQLite holds"""
+    first = storage.add_category('First')
+    second = storage.add_category('Second')
+    checker.expect('categories listed after adding', {c['name'] for c in storage.get_categories()} >= {'First', 'Second'})
+
+    doc_id = storage.add_document('https://example.com/a', 'Title A', '<p>a</p>', '# A', first)
+    checker.expect('document cached on read', storage.get_document_by_id(doc_id)['title'] == 'Title A')
+    checker.expect('listing includes a new document', [d['id'] for d in storage.get_documents(first)] == [doc_id])
+
+    other_id = storage.add_document('https://example.com/b', 'Title B', '<p>b</p>', '# B', first)
+    checker.expect('cached listing invalidated by an insert',
+                   sorted(d['id'] for d in storage.get_documents(first)) == sorted([doc_id, other_id]))
+
+    storage.update_document_category('https://example.com/a', second)
+    checker.expect('document invalidated by a category change',
+                   storage.get_document_by_id(doc_id)['category_id'] == second)
+    checker.expect('listings invalidated by a category change',
+                   [d['id'] for d in storage.get_documents(second)] == [doc_id])
+
+    # A write the cache does not see is only picked up once the entry expires
+    storage.get_document_by_id(other_id)
+    storage.conn.execute('UPDATE documents SET title = ? WHERE id = ?', ('Changed behind the cache', other_id))
+    storage.conn.commit()
+    checker.expect('entries served until they expire', storage.get_document_by_id(other_id)['title'] == 'Title B')
+    time.sleep(ttl + 1.1)
+    checker.expect('entries expire with their TTL',
+                   storage.get_document_by_id(other_id)['title'] == 'Changed behind the cache')
+
+    storage.delete_document(doc_id)
+    checker.expect('deleted document no longer cached', storage.get_document_by_id(doc_id) is None)
+    checker.expect('listing invalidated by a delete', storage.get_documents(second) == [])
+
+def check_outage(checker: Checker, storage: DocumentStorage):
+    """A failing Redis never breaks reads"""
+    category_id = storage.add_category('Outage')
+    doc_id = storage.add_document('https://example.com/outage', 'Outage', '<p>o</p>', '# O', category_id)
+    storage.cache = DocumentCache(BrokenRedis())
+    checker.expect('reads fall back to SQLite during an outage',
+                   storage.get_document_by_id(doc_id)['title'] == 'Outage')
+    checker.expect('writes succeed during an outage', storage.delete_document(doc_id) is True)
+
+def check_lru_bounds(checker: Checker, max_entries: int):
+    """Per-document generations are evicted with the entries and never resurrect stale values"""
+    cache = DocumentCache(None, ttl=300, max_entries=max_entries)
+    cache.get_or_load('document:1', 'document:1', lambda: {'title': 'old'})
+    cache.invalidate('document:1')
+    for document_id in range(2, max_entries * 10):
+        cache.invalidate(f'document:{document_id}')
+    held = len(cache.backend.entries) + len(getattr(cache.backend, 'counters', {}))
+    checker.expect('LRU stays within max_entries', held <= max_entries, f"{held} keys held")
+    checker.expect('evicted generation starts a new one',
+                   cache.get_or_load('document:1', 'document:1', lambda: {'title': 'new'})['title'] == 'new')
+
+    # The generation counter is evicted while entries cached under it are still held
+    cache = DocumentCache(None, ttl=300, max_entries=max_entries)
+    cache.get_or_load('document:1', 'document:1', lambda: {'title': 'first'})
+    cache.invalidate('document:1')
+    cache.get_or_load('document:1', 'document:1', lambda: {'title': 'second'})
+    cache.invalidate('document:1')
+    cache.backend.delete('gen:document:1')
+    checker.expect('LRU backend is an LRUCache', isinstance(cache.backend, LRUCache))
+    checker.expect('entries of an evicted generation are not read again',
+                   cache.get_or_load('document:1', 'document:1', lambda: {'title': 'reloaded'})['title'] == 'reloaded')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ttl', type=float, default=1)
+    parser.add_argument('--max-entries', type=int, default=1000)
+    args = parser.parse_args()
+
+    checker = Checker()
+    with tempfile.TemporaryDirectory() as workdir:
+        backends = [('lru', lambda: DocumentCache(None, ttl=args.ttl))]
+        if fakeredis:
+            backends.append(('redis', lambda: DocumentCache(fakeredis.FakeRedis(), ttl=args.ttl)))
+        else:
+            print("fakeredis is not installed, only the LRU is checked")
+
+        for name, make_cache in backends:
+            print(f"{name}:")
+            storage = make_storage(workdir, name)
+            storage.cache = make_cache()
+            check_consistency(checker, storage, args.ttl)
+            if name == 'redis':
+                check_outage(checker, storage)
+
+        print("lru bounds:")
+        check_lru_bounds(checker, args.max_entries)
+
+    if checker.failures:
+        for failure in checker.failures:
+            print(failure)
+        print(f"{len(checker.failures)} cache checks failed")
+        sys.exit(1)
+    print("All cache checks passed")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Query plan check for DocumentStorage on a large synthetic database
+
+Fills a temporary storage with N document rows, calls every DocumentStorage
+method that looks up or lists a subset of the documents while tracing the
+SQL it runs, and checks the EXPLAIN QUERY PLAN of each statement. A plan
+fails when it scans the documents table without an index or sorts rows with
+a temporary B-tree for ORDER BY; ranking full-text matches is the one sort
+allowed. Methods that return every document are not checked.
+
+The check runs twice: first on the database as a schema version before the
+listing indexes left it, then after DocumentStorage migrated it, so the
+migration itself is timed on the full table. Exits with status 1 if any plan
+fails after the migration.
+
+    python benchmarks/check_query_plans.py --documents 1000000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DocumentStorage import DocumentStorage, DEFAULT_PAGE_FIELDS
+from DuplicateIndex import _to_signed
+from schema import MIGRATIONS, SCHEMA_VERSION, _add_listing_indexes
+
+# Schema version of a database before the listing indexes
+BEFORE_INDEXES = MIGRATIONS.index(_add_listing_indexes)
+TABLE_SCAN = re.compile(r'\bSCAN (d|documents)\b(?! USING)')
+STATEMENT = re.compile(r'^\s*(SELECT|UPDATE|DELETE|INSERT)', re.IGNORECASE)
+
+def make_storage(workdir: str) -> DocumentStorage:
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({
+            'storage': {
+                'db_path': os.path.join(workdir, 'db'),
+                'doc_path': os.path.join(workdir, 'docs')
+            },
+            'vectors': {'enabled': False}
+        }, f)
+    return DocumentStorage(config_path=config_path)
+
+def fill(storage: DocumentStorage, documents: int, categories: int, seed: int = 1):
+    """Insert document rows without files, 1% of them flagged as near duplicates"""
+    rng = random.Random(seed)
+    category_ids = [storage.add_category(f'Category {i}') for i in range(categories)]
+    conn = storage.conn
+    batch = []
+    for i in range(1, documents + 1):
+        batch.append((i, f'https://site{i % 50}.example/page/{i}', f'Page title {i}', f'/docs/{i}/content.md',
+                      rng.choice(category_ids), f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}T'
+                      f'{rng.randint(0, 23):02d}:{rng.randint(0, 59):02d}:{rng.randint(0, 59):02d}',
+                      _to_signed(rng.getrandbits(64)), rng.randint(1, i) if rng.random() < 0.01 else None))
+        if len(batch) == 50000 or i == documents:
+            conn.executemany('''
+                INSERT INTO documents (id, url, title, markdown_path, category_id, created_at, simhash, canonical_id)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', batch)
+            if storage.fts_tokenizer:
+                conn.executemany('INSERT INTO documents_fts (rowid, title, url, body) VALUES (?, ?, ?, ?)',
+                                 [(row[0], row[2], row[1], '') for row in batch])
+            conn.commit()
+            batch = []
+    return category_ids
+
+def drop_listing_indexes(storage: DocumentStorage):
+    """Put the database back at the schema version before the listing indexes"""
+    conn = storage.conn
+    for name in ('idx_documents_created', 'idx_documents_category_created', 'idx_documents_canonical'):
+        conn.execute(f'DROP INDEX IF EXISTS {name}')
+    conn.execute(f'PRAGMA user_version = {BEFORE_INDEXES}')
+    conn.commit()
+
+def calls(storage: DocumentStorage, category_id, documents: int):
+    """(name, call) of the methods checked, reads bypass the cache"""
+    document_id = documents // 2
+    url = f'https://site{document_id % 50}.example/page/{document_id}'
+    row = storage.conn.execute('SELECT canonical_id FROM documents WHERE canonical_id IS NOT NULL LIMIT 1').fetchone()
+    canonical_id = row[0] if row else 1
+    first_page = storage._load_documents_page(None, None, 50, DEFAULT_PAGE_FIELDS, False)
+    category_page = storage._load_documents_page(category_id, None, 50, DEFAULT_PAGE_FIELDS, False)
+    fingerprint = storage.conn.execute('SELECT simhash FROM documents WHERE id = ?', (document_id,)).fetchone()[0]
+    return [
+        ('get_document_by_url', lambda: storage.get_document_by_url(url)),
+        ('get_document_by_id', lambda: storage._load_document_by_id(document_id)),
+        ('get_document_validators', lambda: storage.get_document_validators(url)),
+        ('get_document_id_by_category_and_url', lambda: storage.get_document_id_by_category_and_url(category_id, url)),
+        ('get_documents(category)', lambda: storage._load_documents(category_id)),
+        ('get_documents_page', lambda: storage._load_documents_page(None, None, 50, DEFAULT_PAGE_FIELDS, True)),
+        ('get_documents_page(cursor)', lambda: storage._load_documents_page(
+            None, first_page['next_cursor'], 50, DEFAULT_PAGE_FIELDS, False)),
+        ('get_documents_page(category)', lambda: storage._load_documents_page(
+            category_id, None, 50, DEFAULT_PAGE_FIELDS, True)),
+        ('get_documents_page(category, cursor)', lambda: storage._load_documents_page(
+            category_id, category_page['next_cursor'], 50, DEFAULT_PAGE_FIELDS, False)),
+        ('search_documents(fts)', lambda: storage.search_documents('title 4242')),
+        ('search_documents(fts, category)', lambda: storage.search_documents('title 4242', category_id=category_id)),
+        ('search_documents(like)', lambda: storage.search_documents('42')),
+        ('search_documents(like, category)', lambda: storage.search_documents('42', category_id=category_id)),
+        ('duplicates.find', lambda: storage.duplicates.find(fingerprint + (1 << 64) if fingerprint < 0 else fingerprint)),
+        ('duplicates.get_duplicates', lambda: storage.duplicates.get_duplicates(canonical_id)),
+        ('update_document_category', lambda: storage.update_document_category(url, category_id)),
+        ('touch_document', lambda: storage.touch_document(document_id, etag='"e"')),
+        ('delete_document', lambda: storage.delete_document(canonical_id)),
+    ]
+
+def check(storage: DocumentStorage, category_id, documents: int) -> list[str]:
+    """Run the checked methods and print each statement's plan, returns the failures"""
+    conn = storage.conn
+    failures = []
+    for name, call in calls(storage, category_id, documents):
+        statements = []
+        conn.set_trace_callback(statements.append)
+        start = time.perf_counter()
+        call()
+        elapsed = time.perf_counter() - start
+        conn.set_trace_callback(None)
+
+        problems = []
+        for sql in dict.fromkeys(statements):
+            if not STATEMENT.match(sql):
+                continue
+            plan = [row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}').fetchall()]
+            for step in plan:
+                if TABLE_SCAN.search(step):
+                    problems.append(f"{step}: {' '.join(sql.split())[:120]}")
+                elif 'TEMP B-TREE FOR ORDER BY' in step and 'documents_fts' not in sql:
+                    problems.append(f"{step}: {' '.join(sql.split())[:120]}")
+        status = 'ok' if not problems else 'FAIL'
+        print(f"  {name:40} {elapsed * 1000:9.2f}ms  {status}")
+        for problem in problems:
+            print(f"      {problem}")
+        failures.extend(f"{name}: {problem}" for problem in problems)
+    conn.commit()
+    return failures
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--categories', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = make_storage(workdir)
+        start = time.perf_counter()
+        category_ids = fill(storage, args.documents, args.categories)
+        print(f"Inserted {args.documents} documents in {time.perf_counter() - start:.1f}s")
+
+        drop_listing_indexes(storage)
+        print(f"Schema version {BEFORE_INDEXES}:")
+        check(storage, category_ids[0], args.documents)
+
+        start = time.perf_counter()
+        storage = make_storage(workdir)
+        print(f"Schema version {SCHEMA_VERSION}, migrated in {time.perf_counter() - start:.1f}s:")
+        failures = check(storage, category_ids[1], args.documents)
+
+        if failures:
+            print(f"{len(failures)} query plans do not use an index")
+            sys.exit(1)
+        print("All query plans use an index")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""Concurrency stress test for DocumentStorage against a single database
+
+Runs writer threads that add, refresh and delete documents in parallel with
+reader threads that page through listings and search, then checks that no
+operation failed and the final row count is consistent.
+
+    python benchmarks/stress_storage.py --writers 8 --readers 8 --seconds 20
+"""
+import argparse
+import os
+import sys
+import random
+import tempfile
+import threading
+import time
+import yaml
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DocumentStorage import DocumentStorage
+
+def make_storage(workdir: str) -> DocumentStorage:
+    config_path = os.path.join(workdir, 'config.yaml')
+    with open(config_path, 'w') as f:
+        yaml.safe_dump({
+            'storage': {
+                'db_path': os.path.join(workdir, 'db'),
+                'doc_path': os.path.join(workdir, 'docs')
+            }
+        }, f)
+    return DocumentStorage(config_path=config_path)
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ops = {}
+        self.errors = []
+
+    def record(self, name):
+        with self.lock:
+            self.ops[name] = self.ops.get(name, 0) + 1
+
+    def error(self, name, detail):
+        with self.lock:
+            self.errors.append(f"{name}: {detail}")
+
+def writer(storage, category_id, stats, stop, worker_id):
+    own = []
+    n = 0
+    while not stop.is_set():
+        action = random.random()
+        if action < 0.6 or not own:
+            url = f"https://stress.example.com/{worker_id}/{n}"
+            n += 1
+            doc_id = storage.add_document(url, f"Stress page {worker_id}-{n}", "<html>raw</html>",
+                                          f"# Page {n}\n\nstress body text {worker_id} {n}", category_id)
+            if doc_id > 0:
+                own.append(doc_id)
+                stats.record('add')
+            else:
+                stats.error('add', f"returned {doc_id} for {url}")
+        elif action < 0.8:
+            doc_id = random.choice(own)
+            if storage.update_document(doc_id, "Updated", "<html>new</html>", "# Updated\n\nrefreshed body"):
+                stats.record('update')
+            else:
+                stats.error('update', f"failed for {doc_id}")
+        else:
+            doc_id = own.pop(random.randrange(len(own)))
+            if storage.delete_document(doc_id):
+                stats.record('delete')
+            else:
+                stats.error('delete', f"failed for {doc_id}")
+
+def reader(storage, category_id, stats, stop):
+    while not stop.is_set():
+        try:
+            page = storage.get_documents_page(category_id, limit=50)
+            if page['next_cursor']:
+                storage.get_documents_page(category_id, cursor=page['next_cursor'], limit=50, include_total=False)
+            stats.record('list')
+            storage.search_documents('stress body')
+            stats.record('search')
+            for item in page['items'][:5]:
+                storage.get_document_by_id(item['id'])
+            stats.record('get')
+        except Exception as e:
+            stats.error('read', repr(e))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        storage = make_storage(workdir)
+        category_id = storage.add_category('stress')
+        stats = Stats()
+        stop = threading.Event()
+
+        threads = [threading.Thread(target=writer, args=(storage, category_id, stats, stop, i))
+                   for i in range(args.writers)]
+        threads += [threading.Thread(target=reader, args=(storage, category_id, stats, stop))
+                    for _ in range(args.readers)]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        for name, count in sorted(stats.ops.items()):
+            print(f"{name:<8} {count:8d} ops  {count / args.seconds:10.1f} ops/s")
+
+        expected = stats.ops.get('add', 0) - stats.ops.get('delete', 0)
+        stored = storage.get_documents_page(category_id, limit=1)['total']
+        print(f"documents stored: {stored}, expected: {expected}")
+
+        for error in stats.errors[:20]:
+            print("ERROR", error)
+        if stats.errors or stored != expected:
+            print(f"FAILED with {len(stats.errors)} errors")
+            sys.exit(1)
+        print("OK")
+
+if __name__ == '__main__':
+    main()
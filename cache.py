@@ -0,0 +1,162 @@
+import json
+import time
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class LRUCache:
+    """In-process cache with per-entry TTL and least-recently-used eviction"""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        # Counters share one sequence, so a counter evicted and created again never repeats an old value
+        self.sequence = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        expires_at = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self._store(key, value, expires_at)
+
+    def _store(self, key, value, expires_at):
+        self.entries[key] = (value, expires_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def delete(self, *keys):
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+    def incr(self, key):
+        """Move a counter past every value handed out before, counters are evicted like entries"""
+        with self.lock:
+            self.sequence += 1
+            self._store(key, self.sequence, None)
+            return self.sequence
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+class RedisCache:
+    """Cache backed by a redis client, keys share a common prefix"""
+
+    def __init__(self, redis_client, prefix: str = 'doc_crawl:'):
+        self.redis_client = redis_client
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.redis_client.get(self.prefix + key)
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None):
+        self.redis_client.set(self.prefix + key, value, ex=int(ttl) if ttl else None)
+
+    def delete(self, *keys):
+        if keys:
+            self.redis_client.delete(*[self.prefix + key for key in keys])
+
+    def incr(self, key):
+        return self.redis_client.incr(self.prefix + key)
+
+class DocumentCache:
+    """Read cache for document metadata, listings and rendered views
+
+    Uses Redis when a client is given and an in-process LRU otherwise. Values
+    are stored as JSON. Listings are keyed by a generation number that every
+    write bumps, so one increment invalidates all cached pages at once. Cache
+    errors are logged and treated as misses so a Redis outage never breaks reads.
+    """
+
+    def __init__(self, redis_client=None, ttl: float = 300, max_entries: int = 10000, prefix: str = 'doc_crawl:'):
+        self.ttl = ttl
+        if redis_client is not None:
+            self.backend = RedisCache(redis_client, prefix)
+        else:
+            self.backend = LRUCache(max_entries)
+
+    def get(self, key):
+        """Get a cached value, or None on a miss"""
+        try:
+            value = self.backend.get(key)
+            return json.loads(value) if value is not None else None
+        except Exception as e:
+            logger.warning(f"Cache get failed for {key}: {e}")
+            return None
+
+    def set(self, key, value, ttl=None):
+        try:
+            self.backend.set(key, json.dumps(value), ttl or self.ttl)
+        except Exception as e:
+            logger.warning(f"Cache set failed for {key}: {e}")
+
+    def delete(self, *keys):
+        try:
+            self.backend.delete(*keys)
+        except Exception as e:
+            logger.warning(f"Cache delete failed for {keys}: {e}")
+
+    def get_or_load(self, group, key, loader, ttl=None):
+        """Get a value cached under the group's current generation, loading and storing it on a miss
+        
+        None results are not cached.
+        """
+        gen = self.generation(group)
+        if gen is None:
+            return loader()
+        versioned_key = f'{key}:{gen}'
+        value = self.get(versioned_key)
+        if value is None:
+            value = loader()
+            if value is not None:
+                self.set(versioned_key, value, ttl)
+        return value
+
+    def generation(self, name):
+        """Current generation of a group of keys, part of every key in the group
+
+        A group without a generation, never invalidated or its counter
+        evicted, starts a new one, so entries cached under an evicted
+        generation are never read again.
+        """
+        try:
+            value = self.backend.get(f'gen:{name}')
+            if value is None:
+                value = self.backend.incr(f'gen:{name}')
+            return int(value)
+        except Exception as e:
+            logger.warning(f"Cache generation lookup failed for {name}: {e}")
+            return None
+
+    def clear_local(self):
+        """Drop everything cached in this process
+
+        Only the in-process LRU holds anything to drop, Redis already sees
+        the invalidations of every process.
+        """
+        if isinstance(self.backend, LRUCache):
+            self.backend.clear()
+
+    def invalidate(self, name):
+        """Invalidate every key built from the group's generation"""
+        try:
+            self.backend.incr(f'gen:{name}')
+        except Exception as e:
+            logger.warning(f"Cache invalidation failed for {name}: {e}")
@@ -7,9 +7,12 @@ from typing import Tuple
 from concurrent.futures import ThreadPoolExecutor
 from crawlers import ImageDownloader, ImageExtractor
 from crawlers.manager import CrawlerManager
+from crawlers.scheduler import FetchScheduler
+from crawlers.metrics import CRAWLS_TOTAL, stage, track_crawl
 from DocumentStorage import DocumentStorage
 from pydantic import BaseModel, Field
 import logging
+import asyncio
 import json
 
 from crawlers.result import CrawlResult
@@ -17,18 +20,22 @@ from crawlers.result import CrawlResult
 logger = logging.getLogger(__name__)
 
 image_extractor = ImageExtractor()
-image_downloader = ImageDownloader()
 
 class CrawlRequest(BaseModel):
     url: str = Field(..., description="URL to crawl")
     category_id: int = Field(..., description="Category ID")
     store: bool = Field(default=True, description="Whether to store the document")
+    refresh: bool = Field(default=False, description="Re-crawl a stored document with conditional requests")
 
 class Crawler:
     def __init__(self, doc_storage:DocumentStorage):
         """Initialize the crawler with document storage"""
         self.doc_storage = doc_storage
-        self.manager = CrawlerManager()
+        # Pages and images share one politeness scheduler
+        self.scheduler = FetchScheduler(**doc_storage.config.get('politeness', {}))
+        self.manager = CrawlerManager(scheduler=self.scheduler)
+        self.image_downloader = ImageDownloader(image_store=doc_storage.image_store, scheduler=self.scheduler,
+                                                **doc_storage.config.get('images', {}))
         self.html_converter = html2text.HTML2Text()
         # Configure html2text for better conversion
         self.html_converter.ignore_links = False
@@ -39,15 +46,169 @@ class Crawler:
         self.html_converter.mark_code = True
         self.session = requests.Session()
         self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': self.scheduler.user_agent
         })
 
     def _save_image_mapping(self, image_mapping, doc_path):
         """Save image mapping to JSON file"""
+        os.makedirs(doc_path, exist_ok=True)
         with open(os.path.join(doc_path, 'image_mapping.json'), 'w') as f:
             # save image mapping to text file with key - value format
             json.dump(image_mapping, f, indent=4)
 
+    def _prune_images(self, images_path, local_images):
+        """Remove images left over from a previous version of the document"""
+        if not os.path.isdir(images_path):
+            return
+        keep = {os.path.basename(path) for path in local_images.values()}
+        for name in os.listdir(images_path):
+            if name not in keep:
+                os.remove(os.path.join(images_path, name))
+
+    def _locate(self, req: CrawlRequest):
+        """Find the stored copy a refresh revalidates and the document folder, returns (existing, doc_path)
+
+        doc_path is None when the URL is already stored and this is not a refresh.
+        """
+        # A refresh revalidates the stored copy instead of failing with "already exists"
+        existing = self.doc_storage.get_document_validators(req.url) if req.refresh else None
+        if not req.refresh and self.doc_storage.get_document_by_url(req.url):
+            # Crawling would write into the stored document's folder
+            return None, None
+        if existing:
+            doc_path = os.path.dirname(existing['markdown_path'])
+        else:
+            doc_path = self.doc_storage.get_document_path(req.url)
+        return existing, doc_path
+
+    def _finish_early(self, result: CrawlResult, existing):
+        """Return the final result of a failed or unchanged crawl, or None when the page must be stored"""
+        if not result.success:
+            logger.info(result.json())
+            return CrawlResult(success=False, message=result.message)
+
+        if existing and result.not_modified:
+            self.doc_storage.touch_document(existing['id'], result.etag, result.last_modified)
+            result.doc_id = existing['id']
+            result.message = "Document not modified"
+            return result
+        return None
+
+    def _check_duplicate(self, req: CrawlRequest, existing, result: CrawlResult):
+        """Fingerprint the page and apply the configured action to a near duplicate
+
+        Returns the final result when the page is skipped or linked instead of
+        stored, None when it must be stored. Runs before images are downloaded.
+        """
+        duplicates = self.doc_storage.duplicates
+        with stage('dedup'):
+            fingerprint = duplicates.fingerprint(result.markdown)
+            # A refreshed document keeps its place, only new documents are checked
+            duplicate = None if existing else duplicates.find(fingerprint)
+        if fingerprint is not None:
+            result.simhash = f"{fingerprint:016x}"
+        if not duplicate:
+            return None
+
+        canonical_id, distance = duplicate
+        result.duplicate_of = canonical_id
+        if duplicates.action == 'skip':
+            return CrawlResult(success=False, simhash=result.simhash, duplicate_of=canonical_id,
+                               message=f"Near duplicate of document {canonical_id}, not stored")
+        if duplicates.action == 'link':
+            duplicates.link(req.url, canonical_id, distance)
+            result.doc_id = canonical_id
+            result.message = f"Linked to near duplicate document {canonical_id}"
+            return result
+        return None
+
+    def _embed(self, doc_id, markdown_content):
+        """Index a stored document for semantic search, a failure leaves it stored without vectors"""
+        try:
+            with stage('embed'):
+                self.doc_storage.vectors.index_document(doc_id, markdown_content)
+        except Exception as e:
+            logger.error(f"Error embedding document {doc_id}: {e}", exc_info=True)
+
+    def _store(self, req: CrawlRequest, existing, result: CrawlResult, image_report, doc_path) -> CrawlResult:
+        """Store a crawled page with its downloaded images"""
+        url = req.url
+        images_path = os.path.join(doc_path, 'images')
+        local_images = image_report.images
+        result.images_downloaded = image_report.succeeded
+        result.images_failed = image_report.failed
+        self._save_image_mapping(local_images, doc_path)
+
+        # Replace image URLs in markdown
+        with stage('replace_images'):
+            markdown_content = image_extractor.replace_markdown_images(result.markdown, local_images, url)
+        fingerprint = int(result.simhash, 16) if result.simhash else None
+        
+        if existing:
+            self._prune_images(images_path, local_images)
+            with stage('store'):
+                updated = self.doc_storage.update_document(
+                    existing['id'],
+                    title=result.title,
+                    raw_content=result.html,
+                    markdown=markdown_content,
+                    etag=result.etag,
+                    last_modified=result.last_modified,
+                    content_hash=result.content_hash,
+                    fingerprint=fingerprint
+                )
+            if not updated:
+                return CrawlResult(success=False, message="Failed to update document")
+            self.doc_storage.image_store.set_document_images(existing['id'], image_report.blobs)
+            self._embed(existing['id'], markdown_content)
+            result.doc_id = existing['id']
+            result.message = "Document updated"
+            return result
+
+        # Store the document with category
+        with stage('store'):
+            doc_id = self.doc_storage.add_document(
+                url=url,
+                title=result.title,
+                raw_content=result.html,
+                markdown=markdown_content,
+                category_id=req.category_id,
+                etag=result.etag,
+                last_modified=result.last_modified,
+                content_hash=result.content_hash,
+                fingerprint=fingerprint,
+                canonical_id=result.duplicate_of if result.duplicate_of > 0 else None
+            )
+        
+        if doc_id<0:
+            return CrawlResult(success=False, message="Failed to add document")
+        elif doc_id==0:
+            return CrawlResult(success=False, message="Document already exists")
+        else:
+            self.doc_storage.image_store.set_document_images(doc_id, image_report.blobs)
+            result.doc_id = doc_id
+            if result.duplicate_of > 0:
+                result.message = f"Stored and flagged as near duplicate of document {result.duplicate_of}"
+            else:
+                self._embed(doc_id, markdown_content)
+            return result
+
+    def _outcome(self, result: CrawlResult) -> str:
+        if not result.success:
+            # Skipped near duplicates are reported as failures that carry duplicate_of
+            return 'duplicate_skip' if result.duplicate_of > 0 else 'failed'
+        if result.not_modified:
+            return 'not_modified'
+        if result.duplicate_of > 0:
+            return f"duplicate_{self.doc_storage.duplicates.action}"
+        return 'updated' if result.message == "Document updated" else 'stored'
+
+    def _record(self, result: CrawlResult, timings) -> CrawlResult:
+        """Attach the stage timings to the result and count its outcome"""
+        result.timings = timings.stages
+        CRAWLS_TOTAL.inc(domain=timings.domain, outcome=self._outcome(result))
+        return result
+
     def crawl(self, req: CrawlRequest) -> CrawlResult:
         """Crawl a URL and store the content
         
@@ -56,48 +217,73 @@ class Crawler:
             category_id: Category ID to store the document under
             
         Returns:
-            CrawlResult: (success, error_message, document_id)
+            CrawlResult: (success, error_message, document_id) with the stage timings
+        """
+        with track_crawl(req.url) as timings:
+            result = self._crawl(req)
+        return self._record(result, timings)
+
+    async def acrawl(self, req: CrawlRequest) -> CrawlResult:
+        """Async variant of crawl
+        
+        Page and image fetches wait on the event loop instead of holding a
+        thread, database and file work runs in worker threads.
         """
+        with track_crawl(req.url) as timings:
+            result = await self._acrawl(req)
+        return self._record(result, timings)
+
+    def _crawl(self, req: CrawlRequest) -> CrawlResult:
         try:
             # Get crawler for this URL
             url = req.url
-            category_id = req.category_id
             crawler = self.manager.get_crawler(url)
             if not crawler:
                 return CrawlResult(success=False, message="No crawler available for this URL")
             
-            doc_path = self.doc_storage.get_document_path(url, category_id)
-            images_path = os.path.join(doc_path, 'images')
+            existing, doc_path = self._locate(req)
+            if doc_path is None:
+                return CrawlResult(success=False, message="Document already exists")
             
             # Crawl the URL
-            result = crawler.crawl(url, doc_path)
-            if not result.success:
-                logger.info(result.json())
-                return CrawlResult(success=False, message=result.message)
+            result = crawler.crawl(url, doc_path, validators=existing)
+            finished = self._finish_early(result, existing) or self._check_duplicate(req, existing, result)
+            if finished:
+                return finished
 
             # Download images
-            local_images = image_downloader.download_images(url, result.image_urls, images_path)
-            self._save_image_mapping(local_images, doc_path)
+            images_path = os.path.join(doc_path, 'images')
+            with stage('images'):
+                image_report = self.image_downloader.download_images_report(
+                    url, result.image_urls, images_path, refresh=req.refresh)
+            return self._store(req, existing, result, image_report, doc_path)
+        except Exception as e:
+            logger.error(f"Error during crawl: {e}", exc_info=True)
+            return CrawlResult(success=False, message=str(e))
 
-            # Replace image URLs in markdown
-            markdown_content = image_extractor.replace_markdown_images(result.markdown, local_images, url)
-            
-            # Store the document with category
-            doc_id = self.doc_storage.add_document(
-                url=url,
-                title=result.title,
-                raw_content=result.html,
-                markdown=markdown_content,
-                category_id=category_id
-            )
+    async def _acrawl(self, req: CrawlRequest) -> CrawlResult:
+        try:
+            url = req.url
+            crawler = self.manager.get_crawler(url)
+            if not crawler:
+                return CrawlResult(success=False, message="No crawler available for this URL")
             
-            if doc_id<0:
-                return CrawlResult(success=False, message="Failed to add document")
-            elif doc_id==0:
+            existing, doc_path = await asyncio.to_thread(self._locate, req)
+            if doc_path is None:
                 return CrawlResult(success=False, message="Document already exists")
-            else:
-                result.doc_id = doc_id
-                return result
+            
+            result = await crawler.acrawl(url, doc_path, validators=existing)
+            finished = await asyncio.to_thread(self._finish_early, result, existing)
+            if not finished:
+                finished = await asyncio.to_thread(self._check_duplicate, req, existing, result)
+            if finished:
+                return finished
+
+            images_path = os.path.join(doc_path, 'images')
+            with stage('images'):
+                image_report = await self.image_downloader.adownload_images_report(
+                    url, result.image_urls, images_path, refresh=req.refresh)
+            return await asyncio.to_thread(self._store, req, existing, result, image_report, doc_path)
         except Exception as e:
             logger.error(f"Error during crawl: {e}", exc_info=True)
             return CrawlResult(success=False, message=str(e))
\ No newline at end of file
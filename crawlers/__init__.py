@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 from .result import CrawlResult
 from .image_extractor import ImageExtractor
@@ -10,9 +11,22 @@ class BaseCrawler(ABC):
         pass
 
     @abstractmethod
-    def crawl(self, url: str, doc_path: str = None) -> CrawlResult:
-        """Crawl the given URL and return (success, obj)"""
+    def crawl(self, url: str, doc_path: str = None, validators: dict = None) -> CrawlResult:
+        """Crawl the given URL and return (success, obj)
+        
+        validators holds the etag, last_modified and content_hash stored for a
+        previous crawl. Crawlers that support conditional requests return a
+        result with not_modified set when the page has not changed.
+        """
         pass
+
+    async def acrawl(self, url: str, doc_path: str = None, validators: dict = None) -> CrawlResult:
+        """Async variant of crawl
+        
+        Runs the blocking crawl in a worker thread so every crawler can be used
+        from async code. Crawlers with a native async fetch path override it.
+        """
+        return await asyncio.to_thread(self.crawl, url, doc_path, validators=validators)
         
     @property
     @abstractmethod
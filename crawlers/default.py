@@ -1,17 +1,72 @@
 from . import BaseCrawler
 import requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, FeatureNotFound
 import html2text
 import os
-from urllib.parse import urlparse, urljoin
+from urllib.parse import urlparse, urljoin, urldefrag
 from .result import CrawlResult
+from .scheduler import FetchScheduler, RobotsDisallowed
+from .metrics import stage
+import hashlib
+import logging
+import asyncio
+import codecs
+import time
 import re
 
+try:
+    from charset_normalizer import from_bytes as detect_charset
+except ImportError:
+    detect_charset = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+# BeautifulSoup tree builders that can be selected per domain in config.yaml
+PARSERS = ('html.parser', 'lxml', 'html5lib')
+
+# Media types converted to markdown, anything else is rejected before the body is read
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+
+BOMS = (
+    (codecs.BOM_UTF32_LE, 'utf-32-le'),
+    (codecs.BOM_UTF32_BE, 'utf-32-be'),
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+META_CHARSET = re.compile(rb'''<meta[^>]+charset\s*=\s*["']?\s*([a-zA-Z0-9_:.-]+)''', re.IGNORECASE)
+# Only the start of the document is searched for <meta charset> and given to the detector
+SNIFF_BYTES = 4096
+DETECT_BYTES = 65536
+
+class PageRejected(Exception):
+    """Raised when a response is not fetched in full because it breaks a fetch limit"""
+
 class DefaultCrawler(BaseCrawler):
     """Default crawler implementation"""
     
-    def __init__(self):
+    def __init__(self, parser: str = 'html.parser', scheduler: FetchScheduler = None,
+                 max_bytes: int = 10 * 1024 * 1024, timeout: float = 15, max_time: float = 60):
+        """
+        Args:
+            parser: BeautifulSoup tree builder, one of PARSERS
+            scheduler: Shared FetchScheduler enforcing per-host politeness
+            max_bytes: Largest decoded page body that is read
+            timeout: Connect and per-read socket timeout in seconds
+            max_time: Time limit in seconds for downloading one page body
+        """
         super().__init__()
+        self.parser = self._resolve_parser(parser)
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self.max_time = max_time
+        # Page fetches share per-host limits with every other fetch using the scheduler
+        self.scheduler = scheduler or FetchScheduler()
         self.html_converter = html2text.HTML2Text()
         # Configure html2text for better conversion
         self.html_converter.ignore_links = False
@@ -22,13 +77,28 @@ class DefaultCrawler(BaseCrawler):
         self.html_converter.mark_code = True
         self.session = requests.Session()
         self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+            'User-Agent': self.scheduler.user_agent
         })
+        # Async fetches use an httpx client with the same headers, bound to the loop that created it
+        self._aclient = None
+        self._async_loop = None
     
     @property
     def name(self) -> str:
         return "default"
 
+    def _resolve_parser(self, parser: str) -> str:
+        """Return the configured parser, or html.parser if it is unknown or not installed"""
+        if parser not in PARSERS:
+            logger.warning(f"Unknown HTML parser {parser}, using html.parser")
+            return 'html.parser'
+        try:
+            BeautifulSoup('', parser)
+        except FeatureNotFound:
+            logger.warning(f"HTML parser {parser} is not installed, using html.parser")
+            return 'html.parser'
+        return parser
+
     def _extract_image_urls(self, soup) -> list[str]:
         # Find all images
         image_urls = []
@@ -40,51 +110,210 @@ class DefaultCrawler(BaseCrawler):
         
         return image_urls
         
-    def crawl(self, url: str, doc_path: str = None) -> CrawlResult:
+    def _extract_link_urls(self, soup) -> list[str]:
+        """Collect the absolute http(s) links of the page, without fragments and in page order"""
+        link_urls = []
+        seen = set()
+        for a in soup.find_all('a', href=True):
+            href, _ = urldefrag(a['href'])
+            if not href.startswith(('http://', 'https://')) or href in seen:
+                continue
+            seen.add(href)
+            link_urls.append(href)
+        return link_urls
+        
+    def _conditional_headers(self, validators: dict) -> dict:
+        headers = {}
+        if validators:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('last_modified'):
+                headers['If-Modified-Since'] = validators['last_modified']
+        return headers
+        
+    def _check_content_type(self, response):
+        """Reject responses that are declared as something other than HTML or too large"""
+        content_type = response.headers.get('Content-Type', '')
+        media_type = content_type.split(';', 1)[0].strip().lower()
+        if media_type and media_type not in HTML_CONTENT_TYPES:
+            raise PageRejected(f"Unsupported content type: {media_type}")
+        length = response.headers.get('Content-Length', '')
+        if length.isdigit() and int(length) > self.max_bytes:
+            raise PageRejected(f"Page too large: {length} bytes")
+
+    def _read_body(self, response) -> bytes:
+        """Stream the body within the byte and time limits"""
+        deadline = time.monotonic() + self.max_time
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise PageRejected(f"Page larger than {self.max_bytes} bytes")
+            if time.monotonic() > deadline:
+                raise PageRejected(f"Page download took longer than {self.max_time}s")
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    async def _aread_body(self, response) -> bytes:
+        """Async variant of _read_body for a streamed httpx response"""
+        deadline = time.monotonic() + self.max_time
+        chunks = []
+        size = 0
+        async for chunk in response.aiter_bytes(65536):
+            size += len(chunk)
+            if size > self.max_bytes:
+                raise PageRejected(f"Page larger than {self.max_bytes} bytes")
+            if time.monotonic() > deadline:
+                raise PageRejected(f"Page download took longer than {self.max_time}s")
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def _detect_encoding(self, body: bytes, content_type: str) -> str:
+        """Pick the body's encoding from its BOM, the charset header or <meta charset>, then by heuristics"""
+        for bom, encoding in BOMS:
+            if body.startswith(bom):
+                return encoding
+
+        declared = []
+        match = re.search(r'charset\s*=\s*["\']?([^"\';\s]+)', content_type, re.IGNORECASE)
+        if match:
+            declared.append(match.group(1))
+        match = META_CHARSET.search(body[:SNIFF_BYTES])
+        if match:
+            declared.append(match.group(1).decode('ascii'))
+        for encoding in declared:
+            try:
+                return codecs.lookup(encoding).name
+            except LookupError:
+                continue
+
+        # Most undeclared pages are UTF-8, a strict decode confirms it without a detector
+        try:
+            body.decode('utf-8')
+            return 'utf-8'
+        except UnicodeDecodeError:
+            pass
+        if detect_charset is not None:
+            best = detect_charset(body[:DETECT_BYTES]).best()
+            if best is not None:
+                return best.encoding
+        return 'windows-1252'
+
+    def crawl(self, url: str, doc_path: str = None, validators: dict = None) -> CrawlResult:
         """Crawl a webpage and store its content"""
         try:
             # Download and parse HTML
             print("Fetching page", url)
-            response = requests.get(url)
-            if response.status_code != 200:
-                return False, f"Failed to download page: {response.status_code}"
-            
-            ## FIXME: This does not work for dynamically loaded content
-            raw_content = response.text
-            # replace <mip-img to <img in raw_content
-            raw_content = raw_content.replace('<mip-img ', '<img ')
-            soup = BeautifulSoup(raw_content, 'html.parser')
+            with stage('fetch'), \
+                    self.scheduler.fetch(self.session, url, headers=self._conditional_headers(validators),
+                                         timeout=self.timeout, stream=True) as response:
+                etag = response.headers.get('ETag', '')
+                last_modified = response.headers.get('Last-Modified', '')
+                if response.status_code == 304:
+                    return CrawlResult(success=True, url=url, etag=etag, last_modified=last_modified, not_modified=True)
+                if response.status_code != 200:
+                    return CrawlResult(url=url, message=f"Failed to download page: {response.status_code}")
+                self._check_content_type(response)
+                body = self._read_body(response)
+                content_type = response.headers.get('Content-Type', '')
             
-            # Get title
-            title = soup.title.string if soup.title else "Untitled"
-            
-            # Download images first
-            image_urls = self._extract_image_urls(soup)
-            
-            # Process HTML content
-            html_content = str(soup)
-            html_content = self._fix_relative_urls(html_content, url)
-            
-            # Convert to markdown and process images
-            markdown_content = html2text.html2text(html_content)
-            markdown_content = self._post_process_markdown(markdown_content)
+            return self._process(url, body, content_type, etag, last_modified, validators)
+        except (RobotsDisallowed, PageRejected) as e:
+            return CrawlResult(url=url, message=str(e))
+        except Exception as e:
+            return CrawlResult(url=url,message=f"Error crawling page: {e}")
+
+    async def acrawl(self, url: str, doc_path: str = None, validators: dict = None) -> CrawlResult:
+        """Crawl a webpage on the event loop, only parsing and conversion run in a worker thread"""
+        if httpx is None:
+            return await super().acrawl(url, doc_path, validators=validators)
+        try:
+            print("Fetching page", url)
+            with stage('fetch'):
+                async with self.scheduler.afetch(self._async_client(), url, headers=self._conditional_headers(validators),
+                                                 timeout=self.timeout) as response:
+                    etag = response.headers.get('ETag', '')
+                    last_modified = response.headers.get('Last-Modified', '')
+                    if response.status_code == 304:
+                        return CrawlResult(success=True, url=url, etag=etag, last_modified=last_modified, not_modified=True)
+                    if response.status_code != 200:
+                        return CrawlResult(url=url, message=f"Failed to download page: {response.status_code}")
+                    self._check_content_type(response)
+                    body = await self._aread_body(response)
+                    content_type = response.headers.get('Content-Type', '')
             
-            return CrawlResult(
-                success=True,
-                url=url, 
-                title=title, 
-                raw_content=raw_content,
-                html=html_content,
-                markdown=markdown_content,
-                image_urls=image_urls,
-            )
+            return await asyncio.to_thread(self._process, url, body, content_type, etag, last_modified, validators)
+        except (RobotsDisallowed, PageRejected) as e:
+            return CrawlResult(url=url, message=str(e))
         except Exception as e:
             return CrawlResult(url=url,message=f"Error crawling page: {e}")
 
-    def _fix_relative_urls(self, html_content, base_url):
-        """Fix relative URLs in HTML content"""
-        soup = BeautifulSoup(html_content, 'html.parser')
+    def _async_client(self):
+        """HTTP client of the running event loop, created on its first use"""
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._aclient = httpx.AsyncClient(headers=dict(self.session.headers), follow_redirects=True)
+            self._async_loop = loop
+        return self._aclient
+
+    def convert(self, raw_html: str, url: str) -> CrawlResult:
+        """Convert stored page HTML the way a crawl would, without fetching anything
+
+        Used to regenerate the markdown of stored documents after the
+        conversion changed. Image URLs are returned but not downloaded.
+        """
+        return self._process(url, raw_html.encode('utf-8'), 'text/html; charset=utf-8', '', '', None)
+
+    def _process(self, url, body: bytes, content_type, etag, last_modified, validators) -> CrawlResult:
+        """Turn a downloaded page body into a crawl result with markdown, image and link URLs"""
+        # Servers without validators still let us skip unchanged pages by content hash
+        content_hash = hashlib.sha256(body).hexdigest()
+        if validators and validators.get('content_hash') == content_hash:
+            return CrawlResult(success=True, url=url, etag=etag, last_modified=last_modified,
+                               content_hash=content_hash, not_modified=True)
+        
+        ## FIXME: This does not work for dynamically loaded content
+        with stage('parse'):
+            raw_content = body.decode(self._detect_encoding(body, content_type), errors='replace')
+            # replace <mip-img to <img in raw_content
+            raw_content = raw_content.replace('<mip-img ', '<img ')
+            # Parse once, every later stage works on this tree
+            soup = BeautifulSoup(raw_content, self.parser)
+        
+        # Get title
+        title = soup.title.string if soup.title else "Untitled"
+        
+        # Download images first
+        image_urls = self._extract_image_urls(soup)
         
+        # Process HTML content
+        with stage('fix_urls'):
+            self._fix_relative_urls(soup, url)
+        link_urls = self._extract_link_urls(soup)
+        html_content = str(soup)
+        
+        # Convert to markdown and process images
+        with stage('html2text'):
+            markdown_content = html2text.html2text(html_content)
+            markdown_content = self._post_process_markdown(markdown_content)
+        
+        return CrawlResult(
+            success=True,
+            url=url, 
+            title=title, 
+            raw_content=raw_content,
+            html=html_content,
+            markdown=markdown_content,
+            image_urls=image_urls,
+            link_urls=link_urls,
+            etag=etag,
+            last_modified=last_modified,
+            content_hash=content_hash,
+        )
+
+    def _fix_relative_urls(self, soup, base_url):
+        """Fix relative URLs in place on the parsed HTML tree"""
         # Fix links
         for a in soup.find_all('a', href=True):
             a['href'] = urljoin(base_url, a['href'])
@@ -93,7 +322,7 @@ class DefaultCrawler(BaseCrawler):
         for img in soup.find_all('img', src=True):
             img['src'] = urljoin(base_url, img['src'])
         
-        return str(soup)
+        return soup
     
     def _post_process_markdown(self, content):
         """Clean up and format markdown content"""
@@ -5,6 +5,7 @@ import logging
 from crawlers.image_extractor import ImageExtractor
 from . import BaseCrawler
 from .result import CrawlResult
+from .metrics import stage
 from firecrawl import FirecrawlApp
 from pydantic import BaseModel, Field
 
@@ -32,13 +33,15 @@ class FireCrawler(BaseCrawler):
     def name(self) -> str:
         return "fire"
 
-    def crawl(self, url: str, doc_path: str = None) -> CrawlResult:
+    def crawl(self, url: str, doc_path: str = None, validators: dict = None) -> CrawlResult:
         """Crawl a webpage and store its content"""
         try:
             app = FirecrawlApp(api_key=FIRECRAWLER_API_KEY)
-            response = app.scrape_url(url=url, params={
-                'formats': [ 'markdown', 'links' ],
-            })
+            # Firecrawl fetches and converts in one remote call
+            with stage('fetch'):
+                response = app.scrape_url(url=url, params={
+                    'formats': [ 'markdown', 'links' ],
+                })
             scrape_result = ScrapeResult.parse_obj(response)
             markdown = scrape_result.markdown
             image_urls = ImageExtractor().extract_from_markdown(markdown)
@@ -1,48 +1,251 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
+import time
+import asyncio
 import hashlib
 import mimetypes
+from concurrent.futures import ThreadPoolExecutor, wait
 from urllib.parse import urlparse, urljoin
+from pydantic import BaseModel, Field
+from .scheduler import FetchScheduler
+from .metrics import IMAGES_TOTAL, IMAGE_DOWNLOADS_IN_FLIGHT
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+class ImageDownloadReport(BaseModel):
+    images: dict[str, str] = Field(default_factory=dict)
+    blobs: dict[str, str] = Field(default_factory=dict)
+    succeeded: int = Field(default=0)
+    failed: int = Field(default=0)
+    elapsed: float = Field(default=0.0)
 
 class ImageDownloader:
-    def __init__(self):
-        pass
+    def __init__(self, workers: int = 8, per_host: int = 4, timeout: float = 10, budget: float = 120,
+                 image_store=None, scheduler: FetchScheduler = None):
+        """
+        Args:
+            workers: Maximum concurrent downloads per document, 1 downloads sequentially
+            per_host: Maximum concurrent connections to a single host, without a shared scheduler
+            timeout: Time limit in seconds for a single image
+            budget: Total time limit in seconds for all images of a document
+            image_store: Optional ImageStore that deduplicates images across documents
+            scheduler: Shared FetchScheduler enforcing per-host politeness across all fetches
+        """
+        self.image_store = image_store
+        self.workers = max(1, int(workers))
+        self.per_host = max(1, int(per_host))
+        self.timeout = timeout
+        self.budget = budget
+
+        # One pooled session keeps connections alive across images and documents
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        self.scheduler = scheduler or FetchScheduler(per_host=self.per_host, min_delay=0, robots=False)
+        self.session.headers['User-Agent'] = self.scheduler.user_agent
+        # Async downloads use an httpx client bound to the event loop that created it
+        self._aclient = None
+        self._async_loop = None
 
     def download_images(self, doc_url:str, image_urls:list[str], images_path:str) -> dict[str, str]:
         """Download all images from the page and return a mapping of URLs to local paths"""
-        local_images = {}
-        
-        # Find all images
-        for image_url in image_urls:
-            # Download and save image
-            local_path = self._download_image(doc_url, image_url, images_path)
+        return self.download_images_report(doc_url, image_urls, images_path).images
+
+    def download_images_report(self, doc_url:str, image_urls:list[str], images_path:str,
+                               refresh: bool = False) -> ImageDownloadReport:
+        """Download all images from the page and report the URL mapping with success and failure counts
+
+        A refresh downloads every image again, so an image that changed behind
+        the same URL replaces the stored one.
+        """
+        start = time.monotonic()
+        deadline = start + self.budget
+
+        # Each distinct URL is only fetched once
+        unique_urls = list(dict.fromkeys(url for url in image_urls if url))
+
+        if self.workers == 1 or len(unique_urls) <= 1:
+            results = [(url, self._download_image(doc_url, url, images_path, deadline, refresh)) for url in unique_urls]
+        else:
+            with ThreadPoolExecutor(max_workers=min(self.workers, len(unique_urls))) as executor:
+                futures = {
+                    executor.submit(self._download_image, doc_url, url, images_path, deadline, refresh): url
+                    for url in unique_urls
+                }
+                done, not_done = wait(futures, timeout=max(0, deadline - time.monotonic()))
+                for future in not_done:
+                    future.cancel()
+                results = [(futures[f], f.result() if f in done else None) for f in futures]
+
+        return self._report(results, images_path, start)
+
+    async def adownload_images_report(self, doc_url:str, image_urls:list[str], images_path:str,
+                                      refresh: bool = False) -> ImageDownloadReport:
+        """Async variant of download_images_report, all images of the page are fetched concurrently on the event loop"""
+        if httpx is None:
+            return await asyncio.to_thread(self.download_images_report, doc_url, image_urls, images_path, refresh)
+
+        start = time.monotonic()
+        deadline = start + self.budget
+        unique_urls = list(dict.fromkeys(url for url in image_urls if url))
+        client = self._async_client()
+        limit = asyncio.Semaphore(self.workers)
+
+        async def download(image_url):
+            async with limit:
+                return await self._adownload_image(client, doc_url, image_url, images_path, deadline, refresh)
+
+        tasks = {asyncio.ensure_future(download(url)): url for url in unique_urls}
+        done = set()
+        if tasks:
+            done, not_done = await asyncio.wait(tasks, timeout=max(0, deadline - time.monotonic()))
+            for task in not_done:
+                task.cancel()
+        results = [(url, task.result() if task in done else None) for task, url in tasks.items()]
+        return self._report(results, images_path, start)
+
+    def _async_client(self):
+        """HTTP client of the running event loop, created on its first use"""
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            self._aclient = httpx.AsyncClient(headers=dict(self.session.headers), follow_redirects=True,
+                                              limits=httpx.Limits(max_connections=max(100, self.workers)))
+            self._async_loop = loop
+        return self._aclient
+
+    def _report(self, results, images_path, start) -> ImageDownloadReport:
+        """Build the report from (image_url, (local_path, blob_hash) or None) pairs"""
+        report = ImageDownloadReport()
+        for image_url, saved in results:
+            local_path, digest = saved or (None, None)
             if local_path:
-                local_images[image_url] = local_path
+                report.images[image_url] = local_path
+                if digest:
+                    report.blobs[digest] = os.path.join(os.path.dirname(images_path), local_path)
+                report.succeeded += 1
                 print("Downloaded image", image_url, "to", local_path)
-                
-        return local_images
-        
-    def _download_image(self, doc_url, image_url:str, image_path):
-        """Download an image and save it locally"""
+            else:
+                report.failed += 1
+
+        report.elapsed = time.monotonic() - start
+        IMAGES_TOTAL.inc(report.succeeded, outcome='succeeded')
+        IMAGES_TOTAL.inc(report.failed, outcome='failed')
+        return report
+
+    def _absolute_url(self, doc_url, image_url:str) -> str:
+        # Handle relative URLs
+        if image_url.startswith('//'):
+            return 'https:' + image_url
+        if not image_url.startswith(('http://', 'https://')):
+            base_url = '/'.join(doc_url.split('/')[:-1])
+            return urljoin(base_url, image_url)
+        return image_url
+
+    def _download_image(self, doc_url, image_url:str, image_path, deadline=None, refresh=False):
+        """Download an image and save it locally, returning (local_path, blob_hash)"""
         try:
-            # Handle relative URLs
-            if image_url.startswith('//'):
-                image_url = 'https:' + image_url
-            elif not image_url.startswith(('http://', 'https://')):
-                base_url = '/'.join(doc_url.split('/')[:-1])
-                image_url = urljoin(base_url, image_url)
-            
-            # Download image
-            response = requests.get(image_url, timeout=10)
-            response.raise_for_status()
-            
-            # Save the image and get its local path
-            return self._save_image(image_url, response.content, image_path)
+            image_url = self._absolute_url(doc_url, image_url)
+
+            # Images already in the shared store are linked without touching the network,
+            # a refresh fetches them again since the image behind a URL may have changed
+            if self.image_store and not refresh:
+                stored = self.image_store.lookup_url(image_url)
+                if stored:
+                    return self._link_blob(stored[0], stored[1], image_path)
+
+            if deadline is not None and time.monotonic() >= deadline:
+                print(f"Skipped image {image_url}: document time budget exhausted")
+                return None
+
+            # Download image, the body is read while the host slot is held
+            with IMAGE_DOWNLOADS_IN_FLIGHT.track(), \
+                    self.scheduler.fetch(self.session, image_url, timeout=self.timeout, stream=True) as response:
+                started = time.monotonic()
+                image_deadline = started + self.timeout
+                if deadline is not None:
+                    if started >= deadline:
+                        print(f"Skipped image {image_url}: document time budget exhausted")
+                        return None
+                    image_deadline = min(image_deadline, deadline)
+
+                response.raise_for_status()
+                chunks = []
+                for chunk in response.iter_content(chunk_size=65536):
+                    if time.monotonic() > image_deadline:
+                        raise TimeoutError("image download timed out")
+                    chunks.append(chunk)
+                content = b''.join(chunks)
+
+            return self._store_image(image_url, content, image_path)
         except Exception as e:
-            print(f"Error downloading image {url}: {str(e)}")
+            print(f"Error downloading image {image_url}: {str(e)}")
             return None
+
+    async def _adownload_image(self, client, doc_url, image_url:str, image_path, deadline=None, refresh=False):
+        """Async variant of _download_image, storage work runs in a worker thread"""
+        try:
+            image_url = self._absolute_url(doc_url, image_url)
+
+            if self.image_store and not refresh:
+                stored = await asyncio.to_thread(self.image_store.lookup_url, image_url)
+                if stored:
+                    return await asyncio.to_thread(self._link_blob, stored[0], stored[1], image_path)
+
+            if deadline is not None and time.monotonic() >= deadline:
+                print(f"Skipped image {image_url}: document time budget exhausted")
+                return None
+
+            with IMAGE_DOWNLOADS_IN_FLIGHT.track():
+                async with self.scheduler.afetch(client, image_url, timeout=self.timeout) as response:
+                    image_deadline = time.monotonic() + self.timeout
+                    if deadline is not None:
+                        image_deadline = min(image_deadline, deadline)
+
+                    response.raise_for_status()
+                    chunks = []
+                    async for chunk in response.aiter_bytes(65536):
+                        if time.monotonic() > image_deadline:
+                            raise TimeoutError("image download timed out")
+                        chunks.append(chunk)
+                    content = b''.join(chunks)
+
+            return await asyncio.to_thread(self._store_image, image_url, content, image_path)
+        except Exception as e:
+            print(f"Error downloading image {image_url}: {str(e)}")
+            return None
+
+    def _store_image(self, image_url, content, image_path):
+        """Save downloaded image bytes, returning (local_path, blob_hash)"""
+        if self.image_store:
+            digest, blob_path = self.image_store.put(image_url, content, self._image_extension(image_url))
+            return self._link_blob(digest, blob_path, image_path)
+
+        # Save the image and get its local path
+        return self._save_image(image_url, content, image_path), None
     
 
+    def _link_blob(self, digest, blob_path, image_path):
+        """Link a stored blob into the document's images folder and return (local_path, blob_hash)"""
+        ext = os.path.splitext(blob_path)[1]
+        dest_path = os.path.join(image_path, f"{digest[:16]}{ext}")
+        self.image_store.link(blob_path, dest_path)
+        return os.path.relpath(dest_path, os.path.dirname(image_path)), digest
+
+    def _image_extension(self, image_url):
+        """Get an image file extension from the URL, defaulting to .jpg"""
+        ext = os.path.splitext(urlparse(image_url).path)[1].lower()
+        if not ext or ext not in ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg']:
+            # Try to guess from content type
+            content_type = mimetypes.guess_type(image_url)[0]
+            ext = mimetypes.guess_extension(content_type) if content_type else None
+        return ext or '.jpg'
+
     def _save_image(self, image_url, image_data, image_path):
         """Save an image and return its local path relative to the document"""
         try:
@@ -3,6 +3,44 @@ from urllib.parse import urljoin
 from typing import List, Set
 import os
 
+def _literal_pattern(literals) -> str:
+    """Build a regex matching any of the literals, preferring the longest at each position
+
+    The literals are folded into a radix tree so the regex engine walks shared
+    prefixes once instead of trying every alternative in turn.
+    """
+    def build(items):
+        first, last = items[0], items[-1]
+        n = 0
+        while n < len(first) and n < len(last) and first[n] == last[n]:
+            n += 1
+        prefix = re.escape(first[:n])
+        items = [item[n:] for item in items]
+        # Sorted input puts a literal that ends here first; make the rest optional so longer ones win
+        optional = items[0] == ''
+        if optional:
+            items = items[1:]
+        if not items:
+            return prefix
+
+        branches = []
+        start = 0
+        for i in range(1, len(items) + 1):
+            if i == len(items) or items[i][0] != items[start][0]:
+                branches.append(build(items[start:i]))
+                start = i
+        body = '(?:' + '|'.join(branches) + ')'
+        return prefix + body + ('?' if optional else '')
+
+    return build(sorted(set(literals)))
+
+def _replace_literals(content: str, replacements: dict) -> str:
+    """Replace every occurrence of each key with its value in a single pass over content"""
+    if not replacements:
+        return content
+    pattern = re.compile(_literal_pattern(replacements))
+    return pattern.sub(lambda match: replacements[match.group(0)], content)
+
 class ImageExtractor:
     """Extract image URLs from different content types"""
     
@@ -97,22 +135,25 @@ class ImageExtractor:
         Returns:
             str: Markdown content with image URLs replaced by local paths
         """
-        def _get_local_image_path(url) -> str:
-            if url:
-                for src in local_images:
-                    if url == src or self._get_full_url(url, base_url) == self._get_full_url(src, base_url):
-                        return local_images[src]
-            return None
-                        
+        if not local_images:
+            return markdown_content
+
+        # Normalize once, the first source wins like the original linear lookup did
+        local_paths = {}
+        for src, local_path in local_images.items():
+            if src:
+                local_paths.setdefault(self._get_full_url(src, base_url), local_path)
+
+        replacements = {}
         for pattern in self.md_image_patterns:
-            matches = re.finditer(pattern, markdown_content, re.MULTILINE|re.DOTALL)
-            for match in matches:
+            for match in re.finditer(pattern, markdown_content, re.MULTILINE|re.DOTALL):
                 url = match.group(1).strip()
-                local_image_path = _get_local_image_path(url)
-                if local_image_path:
-                    markdown_content = markdown_content.replace(f'{url}', f'{local_image_path}')
+                if url and url not in replacements:
+                    local_image_path = local_paths.get(self._get_full_url(url, base_url))
+                    if local_image_path:
+                        replacements[url] = local_image_path
 
-        return markdown_content
+        return _replace_literals(markdown_content, replacements)
 
     def restore_markdown_images(self, markdown: str, base_path: str) -> str:
         """Restore image URLs by replacing local paths with full URLs
@@ -131,12 +172,10 @@ class ImageExtractor:
         if not base_path:
             return markdown
 
+        replacements = {}
         for pattern in self.md_image_patterns:
-            matches = re.finditer(pattern, markdown, re.MULTILINE|re.DOTALL)
-            for match in matches:
+            for match in re.finditer(pattern, markdown, re.MULTILINE|re.DOTALL):
                 image_path = match.group(1).strip()
-                view_path = f'/view_image/{base_path}/{image_path}'
-                if view_path:
-                    markdown = markdown.replace(f'({image_path})', f'({view_path})')
+                replacements[f'({image_path})'] = f'(/view_image/{base_path}/{image_path})'
 
-        return markdown
\ No newline at end of file
+        return _replace_literals(markdown, replacements)
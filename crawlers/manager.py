@@ -2,69 +2,187 @@ import yaml
 from typing import Dict, Type
 from . import BaseCrawler
 from .default import DefaultCrawler
+from .scheduler import FetchScheduler
 import importlib
 import traceback
+import threading
+import time
+import json
+import os
 import re
+from urllib.parse import urlparse
+
+class DomainRouter:
+    """Resolves a URL's host to the first matching crawler rule
+
+    Plain domains such as `example.com` match the host and all of its
+    subdomains, `*.example.com` matches subdomains only. Both kinds are kept
+    in dictionaries keyed by domain, so a lookup costs one probe per label of
+    the host no matter how many rules there are. Any other wildcard form is
+    checked with a regex.
+    """
+
+    def __init__(self):
+        self.rules = []
+        self.domains = {}
+        self.subdomains = {}
+        self.patterns = []
+
+    def add(self, domain: str, rule):
+        index = len(self.rules)
+        self.rules.append(rule)
+        domain = domain.strip().lower()
+        if domain.startswith('*.') and '*' not in domain[2:]:
+            self.subdomains.setdefault(domain[2:], index)
+        elif '*' not in domain:
+            self.domains.setdefault(domain, index)
+        else:
+            pattern = domain.replace('.', r'\.').replace('*', r'.*')
+            self.patterns.append((index, re.compile(pattern)))
+
+    def resolve(self, url: str):
+        """Return the first rule matching the URL's host, or None"""
+        host = (urlparse(url).hostname or '').lower()
+        if not host:
+            return None
+
+        best = None
+        labels = host.split('.')
+        for i in range(len(labels)):
+            suffix = '.'.join(labels[i:])
+            index = self.domains.get(suffix)
+            if index is not None and (best is None or index < best):
+                best = index
+            if i > 0:
+                index = self.subdomains.get(suffix)
+                if index is not None and (best is None or index < best):
+                    best = index
+
+        for index, pattern in self.patterns:
+            if best is not None and index > best:
+                break
+            if pattern.search(host):
+                best = index
+                break
+        return self.rules[best] if best is not None else None
 
 class CrawlerManager:
     """Manages crawler plugins and their configuration"""
-    
-    def __init__(self, config_path='config.yaml'):
+
+    def __init__(self, config_path='config.yaml', reload_interval: float = 2.0, scheduler: FetchScheduler = None):
         self.crawlers = []
+        # Shared by every default crawler instance so per-host limits hold across domain rules
+        self.scheduler = scheduler or FetchScheduler()
+        self.fetch_options = {}
         self.config_path = config_path
+        self.reload_interval = reload_interval
+        self.router = DomainRouter()
+        self.instances = {}
+        self.lock = threading.RLock()
+        self._config_mtime = None
+        self._checked_at = 0.0
         self._load_config()
-        
+
     def _load_config(self):
         """Load crawler configurations from YAML file"""
         try:
+            self._config_mtime = os.path.getmtime(self.config_path)
             with open(self.config_path, 'r') as f:
                 config = yaml.safe_load(f)
-            
-            # Clear existing crawlers
-            self.crawlers = []
-            
+
+            crawlers = []
+            router = DomainRouter()
+            # Page size and time limits of default crawlers, domain rules may override them
+            fetch_options = config.get('fetch') or {}
+
             # Load crawler configurations
             for crawler_config in config.get('crawlers', []):
                 domain = crawler_config.get('domain')
                 crawler_type = crawler_config.get('type', 'default')
-                
+                # Remaining keys are passed to the crawler constructor, e.g. parser
+                options = {k: v for k, v in crawler_config.items() if k not in ('domain', 'type')}
+
                 if not domain:
                     continue
-                    
-                # Convert domain to regex pattern
-                pattern = domain.replace('.', r'\.').replace('*', r'.*')
-                self.crawlers.append({
-                    'pattern': re.compile(pattern),
-                    'type': crawler_type
-                })
-                
+
+                rule = {
+                    'domain': domain,
+                    'type': crawler_type,
+                    'options': options
+                }
+                router.add(domain, rule)
+                crawlers.append(rule)
+
+            # Swap in the new rules at once so concurrent lookups never see a partial table
+            with self.lock:
+                if fetch_options != self.fetch_options:
+                    self.instances = {}
+                self.fetch_options = fetch_options
+                self.crawlers = crawlers
+                self.router = router
+                keys = {self._instance_key(c['type'], c['options']) for c in crawlers}
+                keys.add(self._instance_key('default', {}))
+                self.instances = {k: v for k, v in self.instances.items() if k in keys}
         except Exception as e:
             print(f"Error loading crawler config: {e}")
             # Use default crawler as fallback
-            self.crawlers = []
+            with self.lock:
+                self.crawlers = []
+                self.router = DomainRouter()
+
+    def _maybe_reload(self):
+        """Reload the configuration if the file changed since it was last read"""
+        now = time.monotonic()
+        if now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            return
+        if mtime != self._config_mtime:
+            print(f"Reloading crawler config {self.config_path}")
+            self._load_config()
 
-    def get_crawler_by_type(self, crawler_type: str) -> BaseCrawler:
+    def _instance_key(self, crawler_type: str, options: dict) -> str:
+        return f"{crawler_type}:{json.dumps(options, sort_keys=True)}"
+
+    def _create_crawler(self, crawler_type: str, options: dict) -> BaseCrawler:
         if crawler_type != 'default':
             try:
                 # Try to import custom crawler
                 module = importlib.import_module(f'.{crawler_type}', 'crawlers')
                 crawler_class = getattr(module, f"{crawler_type.capitalize()}Crawler")
-                return crawler_class()
+                return crawler_class(**options)
             except Exception as e:
                 print(f"Error loading custom crawler {crawler_type}: {e}")
                 traceback.print_exc()
                 # Fall back to default crawler
-                return DefaultCrawler()
+                return DefaultCrawler(scheduler=self.scheduler, **self.fetch_options)
         else:
-            return DefaultCrawler()
-            
+            return DefaultCrawler(scheduler=self.scheduler, **{**self.fetch_options, **options})
+
+    def get_crawler_by_type(self, crawler_type: str, options: dict = None) -> BaseCrawler:
+        """Get the shared crawler instance for a type and its options, creating it once"""
+        options = options or {}
+        key = self._instance_key(crawler_type, options)
+        crawler = self.instances.get(key)
+        if crawler is None:
+            with self.lock:
+                crawler = self.instances.get(key)
+                if crawler is None:
+                    crawler = self._create_crawler(crawler_type, options)
+                    self.instances[key] = crawler
+        return crawler
+
     def get_crawler(self, url: str) -> BaseCrawler:
         """Get appropriate crawler for the given URL"""
+        self._maybe_reload()
+
         # Find matching crawler configuration
-        for crawler in self.crawlers:
-            if crawler['pattern'].search(url):
-                crawler_type = crawler['type']
-                return self.get_crawler_by_type(crawler_type)
-                    
+        crawler = self.router.resolve(url)
+        if crawler is not None:
+            return self.get_crawler_by_type(crawler['type'], crawler['options'])
+
         # Use default crawler if no match found
-        return DefaultCrawler()
+        return self.get_crawler_by_type('default')
@@ -0,0 +1,202 @@
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Metric:
+    """Base of the metric types, one series per combination of label values"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, '') for name in self.labels)
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, value in sorted(self.series.items()):
+                lines.append(f'{self.name}{_format_labels(self.labels, key)} {_format_value(value)}')
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels=()):
+        super().__init__(name, help, labels)
+        # A gauge without labels is exported as 0 before its first change
+        if not self.labels:
+            self.series[()] = 0
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    @contextmanager
+    def track(self, **labels):
+        """Count the block as in flight while it runs"""
+        self.inc(**labels)
+        try:
+            yield
+        finally:
+            self.dec(**labels)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                # Per-bucket counts, the sum and the total count
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    labels = _format_labels(self.labels, key, [('le', _format_value(float(bound)))])
+                    lines.append(f'{self.name}_bucket{labels} {cumulative}')
+                labels = _format_labels(self.labels, key, [('le', '+Inf')])
+                lines.append(f'{self.name}_bucket{labels} {count}')
+                lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}')
+                lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+class MetricsRegistry:
+    """Holds the process's metrics and renders them in the Prometheus text format"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, labels=()) -> Gauge:
+        return self.register(Gauge(name, help, labels))
+
+    def histogram(self, name, help, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+registry = MetricsRegistry()
+
+CRAWL_STAGE_SECONDS = registry.histogram(
+    'doc_crawl_stage_seconds', 'Time spent in each crawl stage', ('stage', 'domain'))
+CRAWL_SECONDS = registry.histogram(
+    'doc_crawl_crawl_seconds', 'Total time of a crawl request', ('domain',))
+CRAWLS_TOTAL = registry.counter(
+    'doc_crawl_crawls_total', 'Finished crawl requests by outcome', ('domain', 'outcome'))
+CRAWL_ERRORS_TOTAL = registry.counter(
+    'doc_crawl_errors_total', 'Crawl stages that raised an error', ('stage', 'domain'))
+CRAWLS_IN_FLIGHT = registry.gauge(
+    'doc_crawl_crawls_in_flight', 'Crawl requests currently running')
+IMAGES_TOTAL = registry.counter(
+    'doc_crawl_images_total', 'Image downloads by outcome', ('outcome',))
+IMAGE_DOWNLOADS_IN_FLIGHT = registry.gauge(
+    'doc_crawl_image_downloads_in_flight', 'Image downloads currently waiting on the network')
+
+class CrawlTimings:
+    """Stage durations of one crawl, in seconds"""
+
+    def __init__(self, url: str):
+        self.domain = urlparse(url).hostname or ''
+        self.stages = {}
+
+    def add(self, stage: str, seconds: float):
+        # A stage that runs more than once in a crawl accumulates
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+# Timings of the crawl running in the current thread or task, asyncio.to_thread carries it into worker threads
+_current_timings = ContextVar('crawl_timings', default=None)
+
+@contextmanager
+def track_crawl(url: str):
+    """Time a whole crawl request and collect its stage timings, yields the CrawlTimings"""
+    timings = CrawlTimings(url)
+    token = _current_timings.set(timings)
+    CRAWLS_IN_FLIGHT.inc()
+    start = time.perf_counter()
+    try:
+        yield timings
+    finally:
+        elapsed = time.perf_counter() - start
+        timings.stages['total'] = elapsed
+        CRAWL_SECONDS.observe(elapsed, domain=timings.domain)
+        CRAWLS_IN_FLIGHT.dec()
+        _current_timings.reset(token)
+
+@contextmanager
+def stage(name: str):
+    """Time a stage of the current crawl, errors raised inside are counted"""
+    timings = _current_timings.get()
+    domain = timings.domain if timings else ''
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        CRAWL_ERRORS_TOTAL.inc(stage=name, domain=domain)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        if timings:
+            timings.add(name, elapsed)
+        CRAWL_STAGE_SECONDS.observe(elapsed, stage=name, domain=domain)
@@ -9,4 +9,16 @@ class CrawlResult(BaseModel):
     markdown: str = Field(default="")
     image_urls: list[str] = Field(default_factory=list)
     link_urls: list[str] = Field(default_factory=list)
-    doc_id: int = Field(default=-1)
\ No newline at end of file
+    images_downloaded: int = Field(default=0)
+    images_failed: int = Field(default=0)
+    etag: str = Field(default="")
+    last_modified: str = Field(default="")
+    content_hash: str = Field(default="")
+    not_modified: bool = Field(default=False)
+    doc_id: int = Field(default=-1)
+    # Hex SimHash of the markdown, empty when the page is too short to fingerprint
+    simhash: str = Field(default="")
+    # Stored document this page is a near duplicate of
+    duplicate_of: int = Field(default=-1)
+    # Seconds spent in each crawl stage, plus the total
+    timings: dict[str, float] = Field(default_factory=dict)
\ No newline at end of file
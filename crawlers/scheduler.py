@@ -0,0 +1,268 @@
+import time
+import asyncio
+import threading
+import logging
+import requests
+from contextlib import contextmanager, asynccontextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+logger = logging.getLogger(__name__)
+
+# Responses that mean the host wants us to slow down
+THROTTLE_STATUSES = (429, 503)
+
+# Sent with every page, image and robots.txt fetch
+DEFAULT_USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+class RobotsDisallowed(Exception):
+    """Raised when robots.txt does not allow fetching a URL"""
+
+class HostState:
+    """Politeness state of a single host"""
+
+    def __init__(self, per_host: int, delay: float):
+        self.per_host = per_host
+        self.slots = threading.Semaphore(per_host)
+        # asyncio primitives belong to one event loop, they are created on first async use
+        self.async_slots = None
+        self.async_loop = None
+        self.base_delay = delay
+        self.delay = delay
+        self.next_at = 0.0
+        self.robots = None
+        self.robots_expires = 0.0
+        self.robots_lock = threading.Lock()
+
+class FetchScheduler:
+    """Shared per-host politeness for page and image fetches
+
+    Every host gets its own concurrency limit and minimum delay between
+    requests, raised to the crawl-delay of its robots.txt, so requests to
+    different hosts never wait on each other. robots.txt is fetched once per
+    host and cached, sending the User-Agent that pages and images are fetched
+    with. 429 and 503 responses push the host back by their Retry-After (or an
+    exponentially growing delay) and are retried; the delay decays back to the
+    base rate as requests succeed again.
+
+    fetch serves threads, afetch serves asyncio tasks. Both share each
+    host's delay, backoff and robots.txt; the concurrency limit applies to
+    threads and to the tasks of an event loop separately.
+    """
+
+    def __init__(self, per_host: int = 4, min_delay: float = 0.1, robots: bool = True,
+                 robots_ttl: float = 3600, user_agent: str = DEFAULT_USER_AGENT, max_retries: int = 3,
+                 max_backoff: float = 300, timeout: float = 10):
+        """
+        Args:
+            per_host: Maximum concurrent requests to a single host
+            min_delay: Minimum seconds between the starts of two requests to a host
+            robots: Whether robots.txt rules and crawl-delay are honoured
+            robots_ttl: Seconds a fetched robots.txt is cached
+            user_agent: User-Agent header of every fetch, robots.txt groups are matched against it
+            max_retries: Retries of a throttled request before its response is returned
+            max_backoff: Upper limit in seconds for a host's delay and a single Retry-After wait
+            timeout: Time limit in seconds for fetching robots.txt
+        """
+        self.per_host = max(1, int(per_host))
+        self.min_delay = max(0.0, float(min_delay))
+        self.robots = robots
+        self.robots_ttl = robots_ttl
+        self.user_agent = user_agent
+        self.max_retries = max(0, int(max_retries))
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+        # robots.txt is requested as the same client the rules are matched for
+        self.session = requests.Session()
+        self.session.headers['User-Agent'] = user_agent
+
+    def _host(self, url) -> HostState:
+        parsed = urlparse(url)
+        key = f"{parsed.scheme}://{parsed.netloc}"
+        with self.lock:
+            state = self.hosts.get(key)
+            if state is None:
+                state = HostState(self.per_host, self.min_delay)
+                self.hosts[key] = state
+            return state
+
+    def _robots(self, url, state: HostState):
+        """Get the cached robots.txt parser of the URL's host, fetching it when missing or expired"""
+        with state.robots_lock:
+            if state.robots is not None and state.robots_expires > time.monotonic():
+                return state.robots
+
+            parsed = urlparse(url)
+            robots = RobotFileParser()
+            try:
+                response = self.session.get(f"{parsed.scheme}://{parsed.netloc}/robots.txt", timeout=self.timeout)
+                if response.status_code in (401, 403):
+                    robots.disallow_all = True
+                elif response.status_code >= 400:
+                    robots.allow_all = True
+                else:
+                    robots.parse(response.text.splitlines())
+            except Exception as e:
+                logger.warning(f"Could not fetch robots.txt for {parsed.netloc}: {e}")
+                robots.allow_all = True
+
+            crawl_delay = robots.crawl_delay(self.user_agent) if not (robots.allow_all or robots.disallow_all) else None
+            with self.lock:
+                state.base_delay = max(self.min_delay, min(float(crawl_delay or 0), self.max_backoff))
+                state.delay = max(state.delay, state.base_delay)
+            state.robots = robots
+            state.robots_expires = time.monotonic() + self.robots_ttl
+            return robots
+
+    def allowed(self, url) -> bool:
+        """Whether robots.txt allows fetching the URL"""
+        if not self.robots:
+            return True
+        return self._robots(url, self._host(url)).can_fetch(self.user_agent, url)
+
+    async def _arobots(self, url, state: HostState):
+        if state.robots is not None and state.robots_expires > time.monotonic():
+            return state.robots
+        return await asyncio.to_thread(self._robots, url, state)
+
+    async def aallowed(self, url) -> bool:
+        """Async variant of allowed, robots.txt is fetched in a worker thread on a cache miss"""
+        if not self.robots:
+            return True
+        robots = await self._arobots(url, self._host(url))
+        return robots.can_fetch(self.user_agent, url)
+
+    def _reserve(self, state: HostState) -> float:
+        """Reserve the host's next start time and return the seconds to wait for it
+
+        Reserving keeps concurrent requests to the host spaced by its delay.
+        """
+        with self.lock:
+            now = time.monotonic()
+            start_at = max(now, state.next_at)
+            state.next_at = start_at + state.delay
+        return start_at - now
+
+    def _async_slots(self, state: HostState) -> asyncio.Semaphore:
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if state.async_loop is not loop:
+                state.async_slots = asyncio.Semaphore(state.per_host)
+                state.async_loop = loop
+            return state.async_slots
+
+    @contextmanager
+    def slot(self, url):
+        """Hold one of the host's request slots, waiting for its next allowed start time"""
+        state = self._host(url)
+        if self.robots:
+            self._robots(url, state)
+        with state.slots:
+            wait = self._reserve(state)
+            if wait > 0:
+                time.sleep(wait)
+            yield
+
+    @asynccontextmanager
+    async def aslot(self, url):
+        """Async variant of slot"""
+        state = self._host(url)
+        if self.robots:
+            await self._arobots(url, state)
+        async with self._async_slots(state):
+            wait = self._reserve(state)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            yield
+
+    def _retry_after(self, value) -> float:
+        """Seconds to wait from a Retry-After header, None if it is missing or malformed"""
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def _throttled(self, url, retry_after) -> float:
+        """Slow the host down after a throttling response and return the seconds until its next request"""
+        state = self._host(url)
+        with self.lock:
+            state.delay = min(self.max_backoff, max(state.delay * 2, state.base_delay, 1.0))
+            wait = retry_after if retry_after is not None else state.delay
+            state.next_at = max(state.next_at, time.monotonic() + wait)
+            return wait
+
+    def _succeeded(self, url):
+        state = self._host(url)
+        with self.lock:
+            if state.delay > state.base_delay:
+                state.delay = max(state.base_delay, state.delay * 0.75)
+
+    @contextmanager
+    def fetch(self, session, url, **kwargs):
+        """GET a URL politely and yield the response while holding the host's slot
+
+        Reading the body inside the with block counts towards the host's
+        concurrency. Throttled responses are retried up to max_retries times;
+        the last one is yielded if the host keeps throttling or asks to wait
+        longer than max_backoff.
+
+        Raises:
+            RobotsDisallowed: If robots.txt does not allow the URL
+        """
+        if not self.allowed(url):
+            raise RobotsDisallowed(f"Blocked by robots.txt: {url}")
+
+        for attempt in range(self.max_retries + 1):
+            with self.slot(url):
+                response = session.get(url, **kwargs)
+                if response.status_code in THROTTLE_STATUSES:
+                    wait = self._throttled(url, self._retry_after(response.headers.get('Retry-After')))
+                    if attempt < self.max_retries and wait <= self.max_backoff:
+                        logger.info(f"Throttled by {urlparse(url).netloc} ({response.status_code}), retrying in {wait:.1f}s")
+                        response.close()
+                        continue
+                else:
+                    self._succeeded(url)
+
+                try:
+                    yield response
+                finally:
+                    response.close()
+                return
+
+    @asynccontextmanager
+    async def afetch(self, client, url, **kwargs):
+        """Async variant of fetch for an httpx.AsyncClient, the response is streamed
+
+        Raises:
+            RobotsDisallowed: If robots.txt does not allow the URL
+        """
+        if not await self.aallowed(url):
+            raise RobotsDisallowed(f"Blocked by robots.txt: {url}")
+
+        for attempt in range(self.max_retries + 1):
+            async with self.aslot(url):
+                response = await client.send(client.build_request('GET', url, **kwargs), stream=True)
+                if response.status_code in THROTTLE_STATUSES:
+                    wait = self._throttled(url, self._retry_after(response.headers.get('Retry-After')))
+                    if attempt < self.max_retries and wait <= self.max_backoff:
+                        logger.info(f"Throttled by {urlparse(url).netloc} ({response.status_code}), retrying in {wait:.1f}s")
+                        await response.aclose()
+                        continue
+                else:
+                    self._succeeded(url)
+
+                try:
+                    yield response
+                finally:
+                    await response.aclose()
+                return
@@ -0,0 +1,357 @@
+import os
+import sqlite3
+import threading
+import hashlib
+import posixpath
+import uuid
+import logging
+import json
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, urlunsplit, urljoin, parse_qsl, urlencode
+from bs4 import BeautifulSoup
+
+from crawler import Crawler, CrawlRequest
+from schema import migrate
+
+logger = logging.getLogger(__name__)
+
+# Links to files that are never documents are not queued
+SKIP_EXTENSIONS = (
+    '.png', '.jpg', '.jpeg', '.gif', '.webp', '.svg', '.ico', '.bmp',
+    '.css', '.js', '.json', '.xml', '.pdf', '.zip', '.gz', '.tgz', '.tar', '.rar', '.7z',
+    '.mp3', '.mp4', '.avi', '.mov', '.webm', '.woff', '.woff2', '.ttf', '.eot', '.exe', '.dmg'
+)
+
+# Query parameters that only track the visitor and never change the page
+TRACKING_PARAMS = ('utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content', 'gclid', 'fbclid')
+
+def normalize_url(url: str) -> str:
+    """Canonical form of a URL used for deduplication, or '' if it cannot be crawled
+
+    Lowercases scheme and host, drops default ports, fragments and tracking
+    parameters, resolves dot segments and sorts the query string.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        port = parts.port
+    except ValueError:
+        return ''
+    scheme = parts.scheme.lower()
+    if scheme not in ('http', 'https') or not parts.hostname:
+        return ''
+
+    netloc = parts.hostname.lower()
+    if port and not (scheme == 'http' and port == 80 or scheme == 'https' and port == 443):
+        netloc = f'{netloc}:{port}'
+
+    path = parts.path or '/'
+    if '.' in path:
+        trailing = path.endswith('/')
+        path = posixpath.normpath(path)
+        if trailing and path != '/':
+            path += '/'
+
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                             if key not in TRACKING_PARAMS))
+    return urlunsplit((scheme, netloc, path, query, ''))
+
+def url_hash(url: str) -> int:
+    """64-bit key of a normalized URL, the seen-set stores these instead of URL strings"""
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big', signed=True)
+
+class SiteScope:
+    """Decides which links of a site crawl are followed"""
+
+    def __init__(self, domains: list[str], paths: list[str]):
+        self.domains = [domain.lower() for domain in domains]
+        self.paths = paths or ['/']
+
+    @classmethod
+    def for_seed(cls, seed: str, domains: list[str] = None, paths: list[str] = None):
+        """Scope of a crawl, defaulting to the seed's host and the directory of its path"""
+        parts = urlsplit(seed)
+        if not domains:
+            domains = [parts.hostname]
+        if not paths:
+            paths = [parts.path[:parts.path.rfind('/') + 1] or '/']
+        return cls(domains, paths)
+
+    def allows(self, url: str) -> bool:
+        parts = urlsplit(url)
+        host = parts.hostname or ''
+        # A leading dot also admits every subdomain
+        if not any(host == domain or domain.startswith('.') and host.endswith(domain) for domain in self.domains):
+            return False
+        if parts.path.lower().endswith(SKIP_EXTENSIONS):
+            return False
+        return any(parts.path.startswith(path) for path in self.paths)
+
+    def to_dict(self) -> dict:
+        return {'domains': self.domains, 'paths': self.paths}
+
+class SiteCrawler:
+    """Recursive site crawls over a persistent, deduplicated URL frontier
+
+    A crawl starts from a seed URL and follows links within its scope,
+    breadth first, up to max_depth link hops and max_pages admitted URLs.
+    The frontier lives in SQLite next to the documents database and doubles
+    as the seen-set: every URL is keyed by a 64-bit hash of its normalized
+    form, so each URL is queued at most once per crawl and interrupted
+    crawls resume after a restart. Running URLs hold a lease like crawl job
+    items, so processes sharing the frontier never requeue each other's work.
+    """
+
+    def __init__(self, crawler: Crawler, db_path: str, workers: int = 2, poll_interval: float = 1.0,
+                 max_depth: int = 3, max_pages: int = 500, lease_timeout: float = 300):
+        self.crawler = crawler
+        self.db_path = db_path
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.max_depth = max_depth
+        self.max_pages = max_pages
+        self.lease_timeout = lease_timeout
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition()
+        self.threads = []
+        self.stopped = threading.Event()
+        # URLs the workers of this process are crawling, their leases are renewed
+        self.active = set()
+
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._init_db()
+
+    def _init_db(self):
+        """Bring the shared database's schema up to date, it may be opened before DocumentStorage"""
+        with self.lock:
+            migrate(self.conn)
+
+    def start(self):
+        """Requeue URLs of processes that died and start the worker threads"""
+        self._requeue_expired()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'site-crawl-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name='site-crawl-heartbeat', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _requeue_expired(self):
+        """Queue running URLs again whose lease was not renewed within the lease timeout"""
+        cutoff = (datetime.now() - timedelta(seconds=self.lease_timeout)).isoformat()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE site_crawl_urls SET status = 'pending', heartbeat_at = NULL
+                WHERE status = 'running' AND COALESCE(heartbeat_at, '') < ?
+            ''', (cutoff,))
+            self.conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Requeued {cursor.rowcount} site crawl URLs with an expired lease")
+            with self.wakeup:
+                self.wakeup.notify_all()
+
+    def _renew_leases(self):
+        with self.lock:
+            active = list(self.active)
+            if not active:
+                return
+            self.conn.execute(f'''
+                UPDATE site_crawl_urls SET heartbeat_at = ?
+                WHERE status = 'running' AND id IN ({','.join('?' * len(active))})
+            ''', (datetime.now().isoformat(), *active))
+            self.conn.commit()
+
+    def _heartbeat(self):
+        """Renew the leases of this process's URLs and requeue the expired ones of others"""
+        while not self.stopped.wait(self.lease_timeout / 3):
+            try:
+                self._renew_leases()
+                self._requeue_expired()
+            except Exception as e:
+                logger.error(f"Error renewing site crawl leases: {e}", exc_info=True)
+
+    def stop(self):
+        """Ask the workers to exit after their current page"""
+        self.stopped.set()
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def submit(self, seed: str, category_id: int, max_depth: int = None, max_pages: int = None,
+               domains: list[str] = None, paths: list[str] = None, refresh: bool = False) -> str:
+        """Start a site crawl from a seed URL and return the crawl ID
+
+        Raises:
+            ValueError: If the seed URL cannot be crawled
+        """
+        seed = normalize_url(seed)
+        if not seed:
+            raise ValueError("Seed must be an http or https URL")
+        scope = SiteScope.for_seed(seed, domains, paths)
+        max_depth = self.max_depth if max_depth is None else max(0, int(max_depth))
+        max_pages = self.max_pages if max_pages is None else max(1, int(max_pages))
+
+        crawl_id = uuid.uuid4().hex
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT INTO site_crawls (id, seed, category_id, scope, max_depth, max_pages, refresh, admitted, created_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, 1, ?)
+            ''', (crawl_id, seed, category_id, json.dumps(scope.to_dict()), max_depth, max_pages,
+                  int(refresh), datetime.now().isoformat()))
+            cursor.execute('INSERT INTO site_crawl_urls (crawl_id, url_hash, url, depth) VALUES (?, ?, ?, 0)',
+                           (crawl_id, url_hash(seed), seed))
+            self.conn.commit()
+
+        with self.wakeup:
+            self.wakeup.notify_all()
+        return crawl_id
+
+    def get_crawl(self, crawl_id: str, limit: int = 100):
+        """Get a crawl's settings, per-status counts and its most recently finished URLs"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT * FROM site_crawls WHERE id = ?', (crawl_id,))
+            crawl = cursor.fetchone()
+            if not crawl:
+                return None
+            cursor.execute('SELECT status, COUNT(*) FROM site_crawl_urls WHERE crawl_id = ? GROUP BY status',
+                           (crawl_id,))
+            counts = {'pending': 0, 'running': 0, 'done': 0, 'skipped': 0, 'failed': 0}
+            counts.update({row[0]: row[1] for row in cursor.fetchall()})
+            cursor.execute('''
+                SELECT url, depth, status, doc_id, message, finished_at
+                FROM site_crawl_urls
+                WHERE crawl_id = ? AND finished_at IS NOT NULL
+                ORDER BY finished_at DESC
+                LIMIT ?
+            ''', (crawl_id, limit))
+            recent = [dict(row) for row in cursor.fetchall()]
+
+        return {
+            'id': crawl['id'],
+            'seed': crawl['seed'],
+            'category_id': crawl['category_id'],
+            'scope': json.loads(crawl['scope']),
+            'max_depth': crawl['max_depth'],
+            'max_pages': crawl['max_pages'],
+            'status': 'running' if counts['pending'] + counts['running'] else 'finished',
+            'admitted': crawl['admitted'],
+            'counts': counts,
+            'created_at': crawl['created_at'],
+            'recent': recent
+        }
+
+    def _claim_next(self):
+        """Atomically mark the shallowest pending URL as running and return it with its crawl"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            while True:
+                cursor.execute('''
+                    SELECT u.id, u.url, u.depth, c.id AS crawl_id, c.category_id, c.scope,
+                           c.max_depth, c.max_pages, c.refresh
+                    FROM site_crawl_urls u
+                    JOIN site_crawls c ON c.id = u.crawl_id
+                    WHERE u.status = 'pending'
+                    ORDER BY u.depth, u.id
+                    LIMIT 1
+                ''')
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                cursor.execute('''
+                    UPDATE site_crawl_urls SET status = 'running', heartbeat_at = ?
+                    WHERE id = ? AND status = 'pending'
+                ''', (datetime.now().isoformat(), row['id']))
+                self.conn.commit()
+                if cursor.rowcount == 1:
+                    self.active.add(row['id'])
+                    return dict(row)
+
+    def _finish(self, item, status, doc_id=None, message='', links=()):
+        """Record a URL's outcome and admit its in-scope links into the frontier"""
+        scope = SiteScope(**json.loads(item['scope']))
+        depth = item['depth'] + 1
+        candidates = []
+        if depth <= item['max_depth']:
+            for link in links:
+                link = normalize_url(link)
+                if link and scope.allows(link):
+                    candidates.append((url_hash(link), link))
+
+        with self.lock:
+            self.active.discard(item['id'])
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE site_crawl_urls SET status = ?, doc_id = ?, message = ?, finished_at = ?
+                WHERE id = ?
+            ''', (status, doc_id, message, datetime.now().isoformat(), item['id']))
+
+            if candidates:
+                cursor.execute('SELECT admitted FROM site_crawls WHERE id = ?', (item['crawl_id'],))
+                admitted = cursor.fetchone()[0]
+                for key, link in candidates:
+                    if admitted >= item['max_pages']:
+                        break
+                    cursor.execute('''
+                        INSERT OR IGNORE INTO site_crawl_urls (crawl_id, url_hash, url, depth)
+                        VALUES (?, ?, ?, ?)
+                    ''', (item['crawl_id'], key, link, depth))
+                    admitted += cursor.rowcount
+                cursor.execute('UPDATE site_crawls SET admitted = ? WHERE id = ?', (admitted, item['crawl_id']))
+            self.conn.commit()
+
+        if candidates:
+            with self.wakeup:
+                self.wakeup.notify_all()
+
+    def _crawl_page(self, item):
+        url = item['url']
+        refresh = bool(item['refresh'])
+        # Pages stored by an earlier crawl are not fetched again unless the crawl refreshes them,
+        # their stored HTML still provides the links to follow
+        existing = self.crawler.doc_storage.get_document_validators(url)
+        if existing and not refresh:
+            links = self._stored_links(url, existing['markdown_path'])
+            self._finish(item, 'skipped', existing['id'], "Document already exists", links)
+            return
+
+        result = self.crawler.crawl(CrawlRequest(url=url, category_id=item['category_id'], refresh=refresh))
+        if not result.success:
+            self._finish(item, 'failed', message=result.message)
+            return
+        links = result.link_urls
+        if result.not_modified and existing:
+            # An unchanged page is not parsed again, its links come from the stored HTML
+            links = self._stored_links(url, existing['markdown_path'])
+        self._finish(item, 'done', result.doc_id, result.message, links)
+
+    def _stored_links(self, url, markdown_path):
+        """Links of a stored document, read from the HTML saved next to its markdown"""
+        raw_path = os.path.join(os.path.dirname(markdown_path), 'content.txt')
+        try:
+            soup = BeautifulSoup(self.crawler.doc_storage.content_store.read(raw_path), 'html.parser')
+        except OSError:
+            return []
+        return [urljoin(url, a['href']) for a in soup.find_all('a', href=True)]
+
+    def _worker(self):
+        while not self.stopped.is_set():
+            try:
+                item = self._claim_next()
+            except Exception as e:
+                logger.error(f"Error claiming site crawl URL: {e}", exc_info=True)
+                item = None
+
+            if not item:
+                with self.wakeup:
+                    self.wakeup.wait(self.poll_interval)
+                continue
+
+            try:
+                self._crawl_page(item)
+            except Exception as e:
+                logger.error(f"Error crawling {item['url']}: {e}", exc_info=True)
+                self._finish(item, 'failed', message=str(e))
@@ -0,0 +1,209 @@
+import sqlite3
+import threading
+import uuid
+import logging
+import json
+from datetime import datetime, timedelta
+
+from crawler import Crawler, CrawlRequest
+from schema import migrate
+
+logger = logging.getLogger(__name__)
+
+class JobQueue:
+    """Persistent crawl job queue drained by a pool of worker threads
+
+    Every batch submitted through `submit` becomes one job with one item per
+    CrawlRequest. Items are stored in SQLite next to the documents database,
+    so pending work survives a server restart. A running item holds a lease
+    that its process renews while it works on it; items whose lease expired
+    belonged to a process that died and are queued again.
+    """
+
+    def __init__(self, crawler: Crawler, db_path: str, workers: int = 4, poll_interval: float = 1.0,
+                 lease_timeout: float = 300):
+        self.crawler = crawler
+        self.db_path = db_path
+        self.workers = max(1, int(workers))
+        self.poll_interval = poll_interval
+        self.lease_timeout = lease_timeout
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition()
+        self.threads = []
+        self.stopped = threading.Event()
+        # Items the workers of this process are crawling, their leases are renewed
+        self.active = set()
+
+        self.conn = sqlite3.connect(self.db_path, timeout=30, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self._init_db()
+
+    def _init_db(self):
+        """Bring the shared database's schema up to date, it may be opened before DocumentStorage"""
+        with self.lock:
+            migrate(self.conn)
+
+    def start(self):
+        """Requeue items of processes that died and start the worker threads"""
+        self._requeue_expired()
+
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f'crawl-worker-{i}', daemon=True)
+            thread.start()
+            self.threads.append(thread)
+        thread = threading.Thread(target=self._heartbeat, name='crawl-heartbeat', daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def _requeue_expired(self):
+        """Queue running items again whose lease was not renewed within the lease timeout"""
+        cutoff = (datetime.now() - timedelta(seconds=self.lease_timeout)).isoformat()
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                UPDATE crawl_job_items SET status = 'pending', started_at = NULL, heartbeat_at = NULL
+                WHERE status = 'running' AND COALESCE(heartbeat_at, started_at, '') < ?
+            ''', (cutoff,))
+            self.conn.commit()
+        if cursor.rowcount:
+            logger.info(f"Requeued {cursor.rowcount} crawl job items with an expired lease")
+            with self.wakeup:
+                self.wakeup.notify_all()
+
+    def _renew_leases(self):
+        with self.lock:
+            active = list(self.active)
+            if not active:
+                return
+            self.conn.execute(f'''
+                UPDATE crawl_job_items SET heartbeat_at = ?
+                WHERE status = 'running' AND id IN ({','.join('?' * len(active))})
+            ''', (datetime.now().isoformat(), *active))
+            self.conn.commit()
+
+    def _heartbeat(self):
+        """Renew the leases of this process's items and requeue the expired ones of others"""
+        while not self.stopped.wait(self.lease_timeout / 3):
+            try:
+                self._renew_leases()
+                self._requeue_expired()
+            except Exception as e:
+                logger.error(f"Error renewing crawl job leases: {e}", exc_info=True)
+
+    def stop(self):
+        """Ask the workers to exit after their current item"""
+        self.stopped.set()
+        with self.wakeup:
+            self.wakeup.notify_all()
+
+    def submit(self, requests: list[CrawlRequest]) -> str:
+        """Queue a batch of crawl requests and return the job ID"""
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('INSERT INTO crawl_jobs (id, total, created_at) VALUES (?, ?, ?)',
+                           (job_id, len(requests), datetime.now().isoformat()))
+            cursor.executemany('INSERT INTO crawl_job_items (job_id, request) VALUES (?, ?)',
+                               [(job_id, req.json()) for req in requests])
+            self.conn.commit()
+
+        with self.wakeup:
+            self.wakeup.notify_all()
+        return job_id
+
+    def get_job(self, job_id: str):
+        """Get a job with its per-item status and results"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            cursor.execute('SELECT id, total, created_at FROM crawl_jobs WHERE id = ?', (job_id,))
+            job = cursor.fetchone()
+            if not job:
+                return None
+            cursor.execute('''
+                SELECT id, request, status, result, started_at, finished_at
+                FROM crawl_job_items
+                WHERE job_id = ?
+                ORDER BY id
+            ''', (job_id,))
+            rows = cursor.fetchall()
+
+        counts = {'pending': 0, 'running': 0, 'done': 0, 'failed': 0}
+        items = []
+        for row in rows:
+            counts[row['status']] = counts.get(row['status'], 0) + 1
+            items.append({
+                'id': row['id'],
+                'url': json.loads(row['request'])['url'],
+                'status': row['status'],
+                'result': json.loads(row['result']) if row['result'] else None,
+                'started_at': row['started_at'],
+                'finished_at': row['finished_at']
+            })
+
+        if counts['pending'] + counts['running'] == 0:
+            status = 'finished'
+        elif counts['pending'] == job['total']:
+            status = 'pending'
+        else:
+            status = 'running'
+
+        return {
+            'id': job['id'],
+            'status': status,
+            'total': job['total'],
+            'counts': counts,
+            'created_at': job['created_at'],
+            'items': items
+        }
+
+    def _claim_next(self):
+        """Atomically mark the oldest pending item as running and return it"""
+        with self.lock:
+            cursor = self.conn.cursor()
+            while True:
+                cursor.execute("SELECT id, request FROM crawl_job_items WHERE status = 'pending' ORDER BY id LIMIT 1")
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                # The status check keeps the claim safe if another process shares the queue
+                now = datetime.now().isoformat()
+                cursor.execute('''
+                    UPDATE crawl_job_items SET status = 'running', started_at = ?, heartbeat_at = ?
+                    WHERE id = ? AND status = 'pending'
+                ''', (now, now, row['id']))
+                self.conn.commit()
+                if cursor.rowcount == 1:
+                    self.active.add(row['id'])
+                    return row['id'], row['request']
+
+    def _finish(self, item_id, status, result):
+        with self.lock:
+            self.active.discard(item_id)
+            self.conn.execute('''
+                UPDATE crawl_job_items SET status = ?, result = ?, finished_at = ?
+                WHERE id = ?
+            ''', (status, result, datetime.now().isoformat(), item_id))
+            self.conn.commit()
+
+    def _worker(self):
+        while not self.stopped.is_set():
+            try:
+                item = self._claim_next()
+            except Exception as e:
+                logger.error(f"Error claiming crawl job: {e}", exc_info=True)
+                item = None
+
+            if not item:
+                with self.wakeup:
+                    self.wakeup.wait(self.poll_interval)
+                continue
+
+            item_id, request_json = item
+            try:
+                req = CrawlRequest.parse_raw(request_json)
+                result = self.crawler.crawl(req)
+                status = 'done' if result.success else 'failed'
+                self._finish(item_id, status, result.json(exclude={'html', 'markdown'}))
+            except Exception as e:
+                logger.error(f"Error running crawl job {item_id}: {e}", exc_info=True)
+                self._finish(item_id, 'failed', json.dumps({'success': False, 'message': str(e)}))
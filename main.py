@@ -1,7 +1,17 @@
-from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask import Flask, request, jsonify, render_template, send_from_directory, Response, stream_with_context
 import os
-from DocumentStorage import DocumentStorage
+import sys
+import subprocess
+import threading
+from DocumentStorage import DocumentStorage, MAX_PAGE_SIZE
+from CorpusArchive import CorpusArchive, FORMATS as ARCHIVE_FORMATS, MIMETYPES as ARCHIVE_MIMETYPES
+from Reprocessor import Reprocessor
 from crawler import CrawlRequest, Crawler, ImageExtractor, CrawlResult
+from jobs import JobQueue
+from frontier import SiteCrawler
+from renderer import MarkdownRenderer
+from crawlers.metrics import registry as metrics_registry
+from pydantic import ValidationError
 import logging
 
 # Configure logging
@@ -15,6 +25,29 @@ app.config['SECRET_KEY'] = 'secret_key_here'
 doc_storage = DocumentStorage()
 crawler = Crawler(doc_storage)
 image_extractor = ImageExtractor()
+markdown_renderer = MarkdownRenderer(
+    lambda body: render_template('markdown.html', content=body),
+    max_entries=doc_storage.config.get('cache', {}).get('rendered_views', 1000),
+    content_store=doc_storage.content_store
+)
+
+jobs_config = doc_storage.config.get('jobs', {})
+job_queue = JobQueue(crawler, doc_storage.db_path, workers=jobs_config.get('workers', 4),
+                     lease_timeout=jobs_config.get('lease_timeout', 300))
+job_queue.start()
+
+site_config = doc_storage.config.get('site_crawl', {})
+site_crawler = SiteCrawler(
+    crawler,
+    doc_storage.db_path,
+    workers=site_config.get('workers', 2),
+    max_depth=site_config.get('max_depth', 3),
+    max_pages=site_config.get('max_pages', 500),
+    lease_timeout=jobs_config.get('lease_timeout', 300)
+)
+site_crawler.start()
+
+reprocessor = Reprocessor(doc_storage, manager=crawler.manager)
 
 @app.route('/')
 def index():
@@ -54,10 +87,18 @@ def add_category():
 
 @app.route('/api/documents', methods=['GET'])
 def get_documents():
-    """Get all documents, optionally filtered by category and search query"""
+    """Get documents, optionally filtered by category and search query
+    
+    Passing limit or cursor returns one page: {items, next_cursor, total}.
+    fields selects the returned columns (comma separated) and total=0 skips
+    counting. Without them every document is returned as a plain list.
+    Searches leave out near duplicates unless duplicates=1 is passed.
+    """
     try:
         query = request.args.get('q', '')
         category_id = request.args.get('category')
+        limit = request.args.get('limit')
+        cursor = request.args.get('cursor')
         
         if category_id:
             try:
@@ -65,8 +106,28 @@ def get_documents():
             except ValueError:
                 return jsonify({"error": "Invalid category ID"}), 400
         
+        if limit:
+            try:
+                limit = int(limit)
+            except ValueError:
+                return jsonify({"error": "Invalid limit"}), 400
+        
         if query:
-            docs = doc_storage.search_documents(query, category_id)
+            docs = doc_storage.search_documents(query, category_id, limit=min(limit or 100, MAX_PAGE_SIZE),
+                                                include_duplicates=request.args.get('duplicates', '0') in ('1', 'true'))
+        elif limit or cursor:
+            fields = request.args.get('fields')
+            try:
+                page = doc_storage.get_documents_page(
+                    category_id,
+                    cursor=cursor,
+                    limit=limit or 50,
+                    fields=fields.split(',') if fields else None,
+                    include_total=request.args.get('total', '1') not in ('0', 'false')
+                )
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            return jsonify(page)
         else:
             docs = doc_storage.get_documents(category_id)
         
@@ -75,6 +136,25 @@ def get_documents():
         logger.error(f"Error getting documents: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/api/search/semantic', methods=['GET'])
+def semantic_search():
+    """Search document chunks by meaning, q is the query, k the number of chunks and category an optional filter"""
+    try:
+        query = request.args.get('q', '')
+        if not query.strip():
+            return jsonify({"error": "Query is required"}), 400
+        if not doc_storage.vectors.enabled:
+            return jsonify({"error": "Semantic search is disabled"}), 503
+        try:
+            k = max(1, min(int(request.args.get('k', 10)), MAX_PAGE_SIZE))
+            category_id = int(request.args['category']) if request.args.get('category') else None
+        except ValueError:
+            return jsonify({"error": "Invalid k or category ID"}), 400
+        return jsonify(doc_storage.vectors.search(query, k=k, category_id=category_id))
+    except Exception as e:
+        logger.error(f"Error in semantic search: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route('/api/documents/<path:url>/category', methods=['PUT'])
 def update_document_category(url):
     """Update a document's category"""
@@ -91,6 +171,84 @@ def update_document_category(url):
         logger.error(f"Error updating document category: {e}")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/api/documents/<int:document_id>/duplicates', methods=['GET'])
+def get_document_duplicates(document_id):
+    """Get the documents flagged and the URLs linked as near duplicates of a document"""
+    try:
+        if not doc_storage.get_document_by_id(document_id):
+            return jsonify({"error": "Document not found"}), 404
+        return jsonify(doc_storage.duplicates.get_duplicates(document_id))
+    except Exception as e:
+        logger.error(f"Error getting document duplicates: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/export', methods=['GET'])
+def export_corpus():
+    """Stream the corpus as an archive, format is tar, tar.gz, jsonl or jsonl.gz, category an optional filter and raw=0 leaves out raw content"""
+    try:
+        fmt = request.args.get('format', 'tar.gz')
+        if fmt not in ARCHIVE_FORMATS:
+            return jsonify({"error": f"Format must be one of {', '.join(ARCHIVE_FORMATS)}"}), 400
+        try:
+            category_id = int(request.args['category']) if request.args.get('category') else None
+        except ValueError:
+            return jsonify({"error": "Invalid category ID"}), 400
+        include_raw = request.args.get('raw', '1') != '0'
+        chunks = CorpusArchive(doc_storage).export(fmt, category_id=category_id, include_raw=include_raw)
+        filename = f"corpus-{category_id}.{fmt}" if category_id else f"corpus.{fmt}"
+        return Response(stream_with_context(chunks), mimetype=ARCHIVE_MIMETYPES[fmt],
+                        headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+    except Exception as e:
+        logger.error(f"Error exporting corpus: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+def _wait_reprocess(process, run_id):
+    """Reap a reprocess child, then drop what this process cached from before the run"""
+    returncode = process.wait()
+    # A child killed before it recorded the outcome would block new runs
+    reprocessor.abandon_run(run_id, f"Reprocess exited with status {returncode}")
+    doc_storage.cache.clear_local()
+
+@app.route('/api/reprocess', methods=['POST'])
+def start_reprocess():
+    """Regenerate markdown from stored HTML, body: {category_id?}, all documents without a category
+    
+    The run is processed by `manage.py reprocess` in its own process, so the
+    conversion uses every CPU core without blocking the server. Only one run
+    goes at a time. The child's cache invalidations reach this server through
+    Redis; without Redis, titles and listings cached here may be stale until
+    the run exits or the cache TTL passes.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        try:
+            category_id = int(data['category_id']) if data.get('category_id') is not None else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "Invalid category ID"}), 400
+        run_id = reprocessor.create_run(category_id=category_id, exclusive=True)
+        if not run_id:
+            return jsonify({"error": "A reprocess run is already in progress",
+                            "run_id": reprocessor.latest_unfinished_run()}), 409
+        process = subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'manage.py'),
+                                    'reprocess', '--resume', run_id], start_new_session=True)
+        threading.Thread(target=_wait_reprocess, args=(process, run_id), daemon=True).start()
+        return jsonify({"run_id": run_id}), 202
+    except Exception as e:
+        logger.error(f"Error starting reprocess run: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/api/reprocess/<run_id>', methods=['GET'])
+def get_reprocess_run(run_id):
+    """Get the status and counts of a reprocess run"""
+    try:
+        run = reprocessor.get_run(run_id)
+        if not run:
+            return jsonify({"error": "Reprocess run not found"}), 404
+        return jsonify(run)
+    except Exception as e:
+        logger.error(f"Error getting reprocess run: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route('/api/documents/<int:document_id>', methods=['DELETE'])
 def delete_document(document_id):
     """Delete a document"""
@@ -122,6 +280,84 @@ def crawl():
         logger.error(f"Error crawling URL: {e}", exc_info=True)
         return CrawlResult(success=False, message=str(e)).json(), 500
 
+@app.route('/crawl/batch', methods=['POST'])
+def crawl_batch():
+    """Queue many URLs for crawling by the background workers"""
+    try:
+        data = request.get_json()
+        items = data.get('requests') if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "A non-empty list of requests is required"}), 400
+
+        max_batch = jobs_config.get('max_batch', 10000)
+        if len(items) > max_batch:
+            return jsonify({"error": f"At most {max_batch} requests per batch"}), 400
+
+        try:
+            reqs = [CrawlRequest.parse_obj(item) for item in items]
+        except ValidationError as e:
+            return jsonify({"error": str(e)}), 400
+
+        job_id = job_queue.submit(reqs)
+        return jsonify({"job_id": job_id, "total": len(reqs)}), 202
+    except Exception as e:
+        logger.error(f"Error queueing batch crawl: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/crawl/jobs/<job_id>', methods=['GET'])
+def get_crawl_job(job_id):
+    """Get the status and results of a batch crawl job"""
+    try:
+        job = job_queue.get_job(job_id)
+        if not job:
+            return jsonify({"error": "Job not found"}), 404
+        return jsonify(job)
+    except Exception as e:
+        logger.error(f"Error getting crawl job: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/crawl/site', methods=['POST'])
+def crawl_site():
+    """Crawl a site recursively from a seed URL into a category
+    
+    Body: {url, category_id, max_depth?, max_pages?, domains?, paths?, refresh?}.
+    Links are followed on the seed's host below the seed's directory unless
+    domains (a leading dot admits subdomains) or path prefixes are given.
+    """
+    try:
+        data = request.get_json()
+        if not isinstance(data, dict) or not data.get('url') or data.get('category_id') is None:
+            return jsonify({"error": "url and category_id are required"}), 400
+
+        try:
+            crawl_id = site_crawler.submit(
+                data['url'],
+                int(data['category_id']),
+                max_depth=data.get('max_depth'),
+                max_pages=data.get('max_pages'),
+                domains=data.get('domains'),
+                paths=data.get('paths'),
+                refresh=bool(data.get('refresh', False))
+            )
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"crawl_id": crawl_id}), 202
+    except Exception as e:
+        logger.error(f"Error starting site crawl: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route('/crawl/site/<crawl_id>', methods=['GET'])
+def get_site_crawl(crawl_id):
+    """Get the progress of a site crawl"""
+    try:
+        crawl = site_crawler.get_crawl(crawl_id)
+        if not crawl:
+            return jsonify({"error": "Site crawl not found"}), 404
+        return jsonify(crawl)
+    except Exception as e:
+        logger.error(f"Error getting site crawl: {e}", exc_info=True)
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route('/view/<int:document_id>')
 def view_document(document_id):
     """View a document's markdown content"""
@@ -133,19 +369,32 @@ def view_document(document_id):
             
         # Get markdown content
         markdown_path = doc['markdown_path']
-        if os.path.exists(markdown_path):
-            with open(markdown_path, 'r', encoding='utf-8') as f:
-                content = f.read()
-                
-            # Get the document directory for serving images
-            doc_dir = os.path.relpath(markdown_path, doc_storage.doc_path)
-            doc_dir = os.path.dirname(doc_dir)
-            # Replace image path in markdown to the local path
-            content = image_extractor.restore_markdown_images(content, base_path=doc_dir)
-                
-            return render_template('markdown.html', content=content)
-        else:
+        
+        # Get the document directory for serving images
+        doc_dir = os.path.relpath(markdown_path, doc_storage.doc_path)
+        doc_dir = os.path.dirname(doc_dir)
+        
+        # Rendered HTML is cached per file version, images point at /view_image
+        view = markdown_renderer.render(
+            document_id,
+            markdown_path,
+            prepare=lambda content: image_extractor.restore_markdown_images(content, base_path=doc_dir)
+        )
+        if view is None:
             return "Document content not found", 404
+        
+        headers = {
+            'ETag': f'"{view.etag}"',
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'no-cache'
+        }
+        if view.etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+        
+        body, encoding = view.select(request.accept_encodings)
+        if encoding:
+            headers['Content-Encoding'] = encoding
+        return Response(body, mimetype='text/html', headers=headers)
             
     except Exception as e:
         logger.error(f"Error viewing document: {e}", exc_info=True)
@@ -184,9 +433,8 @@ def get_content(document_id):
             return jsonify({"error": "Document not found"}), 404
             
         markdown_path = doc['markdown_path']
-        if os.path.exists(markdown_path):
-            with open(markdown_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+        if doc_storage.content_store.exists(markdown_path):
+            content = doc_storage.content_store.read(markdown_path)
             return jsonify({"content": content})
         else:
             return jsonify({"error": "Document content not found"}), 404
@@ -195,5 +443,10 @@ def get_content(document_id):
         logger.error(f"Error getting document content: {e}", exc_info=True)
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route('/metrics')
+def metrics():
+    """Crawl stage timings, outcomes and in-flight counts in the Prometheus text format"""
+    return Response(metrics_registry.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(debug=True, port=8000)
\ No newline at end of file
@@ -0,0 +1,198 @@
+import argparse
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from DocumentStorage import DocumentStorage
+from ContentStore import ContentStore
+from CorpusArchive import CorpusArchive, FORMATS as ARCHIVE_FORMATS, format_for_path
+from Reprocessor import Reprocessor
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+def reindex(args):
+    """Rebuild the full-text search index from the stored documents"""
+    doc_storage = DocumentStorage()
+    start = time.time()
+    count = doc_storage.rebuild_search_index(batch_size=args.batch_size)
+    print(f"Indexed {count} documents in {time.time() - start:.1f}s")
+
+def compress(args):
+    """Convert stored content files to the configured codec in place
+
+    Run it while no crawls are in progress, a document rewritten by a crawl
+    during its conversion could be overwritten with the previous content.
+    """
+    doc_storage = DocumentStorage()
+    store = doc_storage.content_store
+    if args.codec:
+        store = ContentStore(codec=args.codec, level=args.level or store.level, markdown=store.markdown)
+
+    paths = []
+    for markdown_path in doc_storage.get_markdown_paths():
+        paths.append(markdown_path)
+        paths.append(os.path.join(os.path.dirname(markdown_path), 'content.txt'))
+
+    start = time.time()
+    files = converted = before = after = 0
+    # zlib and zstd release the GIL, so threads compress in parallel
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        for sizes in executor.map(store.recompress, paths):
+            if sizes is None:
+                continue
+            files += 1
+            converted += sizes[0] != sizes[1]
+            before += sizes[0]
+            after += sizes[1]
+
+    saved = before - after
+    ratio = after / before if before else 1
+    print(f"Converted {converted} of {files} files to {store.codec} in {time.time() - start:.1f}s")
+    print(f"{before / 1048576:.1f} MB -> {after / 1048576:.1f} MB, saved {saved / 1048576:.1f} MB ({ratio:.0%} of original)")
+
+def fingerprint(args):
+    """Fingerprint stored documents for near-duplicate detection"""
+    doc_storage = DocumentStorage()
+    start = time.time()
+    count = doc_storage.duplicates.backfill(batch_size=args.batch_size)
+    print(f"Fingerprinted {count} documents in {time.time() - start:.1f}s")
+
+def embed(args):
+    """Embed stored documents for semantic search and optionally train the IVF index"""
+    doc_storage = DocumentStorage()
+    vectors = doc_storage.vectors
+    if not vectors.enabled:
+        print("Semantic search is disabled")
+        return
+
+    indexed = set() if args.all else vectors.indexed_documents()
+    start = time.time()
+    documents = chunks = 0
+    for document_id, markdown_path in doc_storage.get_embeddable_documents():
+        if document_id in indexed or not doc_storage.content_store.exists(markdown_path):
+            continue
+        chunks += vectors.index_document(document_id, doc_storage.content_store.read(markdown_path))
+        documents += 1
+    print(f"Embedded {chunks} chunks of {documents} documents in {time.time() - start:.1f}s")
+
+    if args.train:
+        start = time.time()
+        lists = vectors.train(lists=args.lists)
+        print(f"Trained {lists} IVF lists in {time.time() - start:.1f}s")
+
+def export(args):
+    """Write the corpus, or one category, to an archive file or stdout"""
+    fmt = args.format or format_for_path(args.path) or 'tar.gz'
+    doc_storage = DocumentStorage()
+    start = time.time()
+    size = 0
+    out = sys.stdout.buffer if args.path == '-' else open(args.path, 'wb')
+    try:
+        for chunk in CorpusArchive(doc_storage).export(fmt, category_id=args.category, include_raw=not args.no_raw):
+            out.write(chunk)
+            size += len(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    print(f"Exported {size / 1048576:.1f} MB as {fmt} in {time.time() - start:.1f}s", file=sys.stderr)
+
+def import_archive(args):
+    """Import documents from an archive written by export"""
+    fmt = args.format or format_for_path(args.path)
+    if not fmt:
+        sys.exit(f"Cannot tell the format of {args.path}, pass --format")
+    doc_storage = DocumentStorage()
+    start = time.time()
+    with open(args.path, 'rb') as f:
+        stats = CorpusArchive(doc_storage).import_archive(f, fmt, batch_size=args.batch_size, workers=args.workers)
+    print(f"Imported {stats['imported']} documents, skipped {stats['skipped']} already stored, "
+          f"in {time.time() - start:.1f}s")
+    if stats['imported'] and doc_storage.vectors.enabled:
+        print("Run `python manage.py embed` to add them to semantic search")
+
+def migrate_layout(args):
+    """Move documents from the category/domain folders to the sharded layout, can be resumed"""
+    doc_storage = DocumentStorage()
+    start = time.time()
+    moved = doc_storage.migrate_layout(batch_size=args.batch_size,
+                                       progress=lambda count: print(f"Moved {count} documents", end='\r'))
+    print(f"Moved {moved} documents in {time.time() - start:.1f}s")
+
+def reprocess(args):
+    """Regenerate markdown from the stored HTML of a category or all documents, can be resumed"""
+    doc_storage = DocumentStorage()
+    reprocessor = Reprocessor(doc_storage, workers=args.workers, batch_size=args.batch_size)
+    if args.resume:
+        run_id = reprocessor.latest_unfinished_run() if args.resume == 'latest' else args.resume
+        if not run_id or not reprocessor.get_run(run_id):
+            sys.exit("No reprocess run to resume")
+    else:
+        run_id = reprocessor.create_run(category_id=args.category)
+    print(f"Reprocess run {run_id}, resume it with: python manage.py reprocess --resume {run_id}")
+
+    start = time.time()
+    run = reprocessor.run(run_id, progress=lambda run: print(
+        f"Processed {run['processed']} of {run['total']} documents, {run['changed']} changed", end='\r'))
+    print(f"Run {run['status']} in {time.time() - start:.1f}s: {run['changed']} changed, {run['unchanged']} unchanged, "
+          f"{run['skipped']} skipped, {run['failed']} failed")
+    if run['status'] != 'finished':
+        sys.exit(run['message'])
+
+def main():
+    parser = argparse.ArgumentParser(description="Document storage maintenance commands")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    reindex_parser = subparsers.add_parser('reindex', help=reindex.__doc__)
+    reindex_parser.add_argument('--batch-size', type=int, default=500)
+    reindex_parser.set_defaults(func=reindex)
+
+    compress_parser = subparsers.add_parser('compress', help=compress.__doc__.splitlines()[0])
+    compress_parser.add_argument('--codec', choices=['zstd', 'gzip', 'none'],
+                                 help="Codec to convert to, storage.compression.codec by default")
+    compress_parser.add_argument('--level', type=int)
+    compress_parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    compress_parser.set_defaults(func=compress)
+
+    fingerprint_parser = subparsers.add_parser('fingerprint', help=fingerprint.__doc__)
+    fingerprint_parser.add_argument('--batch-size', type=int, default=200)
+    fingerprint_parser.set_defaults(func=fingerprint)
+
+    embed_parser = subparsers.add_parser('embed', help=embed.__doc__)
+    embed_parser.add_argument('--all', action='store_true', help="Re-index documents that already have vectors")
+    embed_parser.add_argument('--train', action='store_true', help="Train the IVF index afterwards")
+    embed_parser.add_argument('--lists', type=int, help="IVF lists, vectors.ivf_lists by default")
+    embed_parser.set_defaults(func=embed)
+
+    migrate_parser = subparsers.add_parser('migrate-layout', help=migrate_layout.__doc__)
+    migrate_parser.add_argument('--batch-size', type=int, default=200)
+    migrate_parser.set_defaults(func=migrate_layout)
+
+    export_parser = subparsers.add_parser('export', help=export.__doc__)
+    export_parser.add_argument('path', help="Archive file, - for stdout")
+    export_parser.add_argument('--format', choices=ARCHIVE_FORMATS, help="Taken from the file extension by default")
+    export_parser.add_argument('--category', type=int, help="Only export this category ID")
+    export_parser.add_argument('--no-raw', action='store_true', help="Leave out the raw page content")
+    export_parser.set_defaults(func=export)
+
+    import_parser = subparsers.add_parser('import', help=import_archive.__doc__)
+    import_parser.add_argument('path')
+    import_parser.add_argument('--format', choices=ARCHIVE_FORMATS, help="Taken from the file extension by default")
+    import_parser.add_argument('--batch-size', type=int, default=1000, help="Documents inserted per transaction")
+    import_parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    import_parser.set_defaults(func=import_archive)
+
+    reprocess_parser = subparsers.add_parser('reprocess', help=reprocess.__doc__)
+    reprocess_parser.add_argument('--category', type=int, help="Only reprocess this category ID")
+    reprocess_parser.add_argument('--resume', nargs='?', const='latest', metavar='RUN_ID',
+                                  help="Continue a run, the latest unfinished one without an ID")
+    reprocess_parser.add_argument('--workers', type=int, default=os.cpu_count() or 4)
+    reprocess_parser.add_argument('--batch-size', type=int, default=200, help="Documents per checkpoint")
+    reprocess_parser.set_defaults(func=reprocess)
+
+    args = parser.parse_args()
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
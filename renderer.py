@@ -0,0 +1,97 @@
+import os
+import gzip
+import hashlib
+import threading
+import logging
+import markdown
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+class RenderedView:
+    """A rendered page with its precompressed bodies and strong ETag"""
+
+    def __init__(self, html: str):
+        self.body = html.encode('utf-8')
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        self.encodings = {
+            'gzip': gzip.compress(self.body, compresslevel=6)
+        }
+        if brotli is not None:
+            self.encodings['br'] = brotli.compress(self.body, quality=9)
+
+    def select(self, accept_encodings):
+        """Pick the smallest body the client accepts, returns (body, content_encoding)"""
+        best = (self.body, None)
+        for encoding, body in self.encodings.items():
+            if accept_encodings[encoding] and len(body) < len(best[0]):
+                best = (body, encoding)
+        return best
+
+class MarkdownRenderer:
+    """Renders document markdown to HTML on the server and caches the result
+
+    Entries are keyed by document ID plus the markdown file's mtime and size,
+    so an updated file is re-rendered on its next view without any explicit
+    invalidation.
+    """
+
+    def __init__(self, page_renderer, max_entries: int = 1000, content_store=None):
+        """
+        Args:
+            page_renderer: Callable wrapping the rendered HTML body into a full page
+            max_entries: Number of rendered documents kept in memory
+            content_store: ContentStore reading compressed markdown, plain files without one
+        """
+        self.page_renderer = page_renderer
+        self.content_store = content_store
+        self.cache = LRUCache(max_entries)
+        self.local = threading.local()
+
+    def _markdown(self) -> markdown.Markdown:
+        # Markdown instances keep state between calls, so each thread gets its own
+        md = getattr(self.local, 'md', None)
+        if md is None:
+            md = markdown.Markdown(extensions=['fenced_code', 'tables', 'sane_lists'])
+            self.local.md = md
+        return md
+
+    def render(self, document_id, markdown_path, prepare=None):
+        """Get the rendered view of a document, or None if its markdown file is missing
+
+        Args:
+            document_id: Document ID, part of the cache key
+            markdown_path: Path of the document's markdown file
+            prepare: Optional callable applied to the markdown before rendering
+        """
+        try:
+            if self.content_store:
+                stat = self.content_store.stat(markdown_path)
+            else:
+                stat = os.stat(markdown_path)
+        except OSError:
+            return None
+
+        key = f'{document_id}:{stat.st_mtime_ns}:{stat.st_size}'
+        view = self.cache.get(key)
+        if view is not None:
+            return view
+
+        if self.content_store:
+            content = self.content_store.read(markdown_path)
+        else:
+            with open(markdown_path, 'r', encoding='utf-8') as f:
+                content = f.read()
+        if prepare:
+            content = prepare(content)
+
+        md = self._markdown()
+        body = md.reset().convert(content)
+        view = RenderedView(self.page_renderer(body))
+        self.cache.set(key, view)
+        return view
@@ -0,0 +1,252 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _add_columns(cursor, table, columns):
+    """Add columns that are missing, databases created before versioning may already have some"""
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, column_type in columns.items():
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+def _create_tables(cursor):
+    """Create the categories and documents tables"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT UNIQUE NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS documents (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            url TEXT UNIQUE NOT NULL,
+            title TEXT,
+            markdown_path TEXT,
+            category_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (category_id) REFERENCES categories(id)
+        )
+    ''')
+
+def _add_validators(cursor):
+    """Add the HTTP validators used for conditional re-crawls"""
+    _add_columns(cursor, 'documents', {
+        'etag': 'TEXT',
+        'last_modified': 'TEXT',
+        'content_hash': 'TEXT',
+        'updated_at': 'TIMESTAMP'
+    })
+
+def _add_fingerprints(cursor):
+    """Add the near-duplicate fingerprint and the original a flagged document points at"""
+    _add_columns(cursor, 'documents', {
+        'simhash': 'INTEGER',
+        'canonical_id': 'INTEGER'
+    })
+
+def _add_listing_indexes(cursor):
+    """Index the newest-first listings, the category filter and near-duplicate lookups"""
+    # Listings are ordered by (created_at, id), the keyset cursor of a page resumes inside the index
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_created ON documents(created_at, id)')
+    # Filtered listings read one category's range already in order, and counting it never touches the table
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_documents_category_created ON documents(category_id, created_at, id)')
+    # Only flagged documents have a canonical_id
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_documents_canonical ON documents(canonical_id)
+        WHERE canonical_id IS NOT NULL
+    ''')
+
+def _create_image_tables(cursor):
+    """Create the image blob store and its references"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_blobs (
+            hash TEXT PRIMARY KEY,
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            refcount INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_urls (
+            url TEXT PRIMARY KEY,
+            hash TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS document_images (
+            document_id INTEGER NOT NULL,
+            hash TEXT NOT NULL,
+            PRIMARY KEY (document_id, hash)
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_urls_hash ON image_urls(hash)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_image_blobs_refcount ON image_blobs(refcount)')
+
+def _create_duplicate_tables(cursor):
+    """Create the SimHash band index and the table of linked duplicate URLs"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS simhash_bands (
+            band INTEGER NOT NULL,
+            value INTEGER NOT NULL,
+            document_id INTEGER NOT NULL,
+            PRIMARY KEY (band, value, document_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_simhash_bands_document ON simhash_bands(document_id)')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS duplicate_urls (
+            url TEXT PRIMARY KEY,
+            canonical_id INTEGER NOT NULL,
+            distance INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # Linked URLs are listed per original in the order they were linked
+    cursor.execute('DROP INDEX IF EXISTS idx_duplicate_urls_canonical')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_duplicate_urls_canonical_created ON duplicate_urls(canonical_id, created_at)
+    ''')
+
+def _create_vector_tables(cursor):
+    """Create the chunk rows of the vector index, its free list and metadata"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS vector_chunks (
+            row INTEGER PRIMARY KEY,
+            document_id INTEGER NOT NULL,
+            chunk_index INTEGER NOT NULL,
+            start_offset INTEGER NOT NULL,
+            end_offset INTEGER NOT NULL,
+            content_hash TEXT NOT NULL,
+            list_id INTEGER
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_vector_chunks_document ON vector_chunks(document_id)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS vector_free_rows (row INTEGER PRIMARY KEY)')
+    cursor.execute('CREATE TABLE IF NOT EXISTS vector_meta (key TEXT PRIMARY KEY, value TEXT)')
+
+def _create_job_tables(cursor):
+    """Create the crawl job queue, running items hold a lease renewed by heartbeat_at"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_jobs (
+            id TEXT PRIMARY KEY,
+            total INTEGER NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS crawl_job_items (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_id TEXT NOT NULL,
+            request TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            result TEXT,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            FOREIGN KEY (job_id) REFERENCES crawl_jobs(id)
+        )
+    ''')
+    _add_columns(cursor, 'crawl_job_items', {'heartbeat_at': 'TIMESTAMP'})
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_crawl_job_items_status ON crawl_job_items(status, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_crawl_job_items_job ON crawl_job_items(job_id, id)')
+
+def _create_site_crawl_tables(cursor):
+    """Create the site crawls and their URL frontier, running URLs hold a lease renewed by heartbeat_at"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS site_crawls (
+            id TEXT PRIMARY KEY,
+            seed TEXT NOT NULL,
+            category_id INTEGER NOT NULL,
+            scope TEXT NOT NULL,
+            max_depth INTEGER NOT NULL,
+            max_pages INTEGER NOT NULL,
+            refresh INTEGER NOT NULL DEFAULT 0,
+            admitted INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS site_crawl_urls (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            crawl_id TEXT NOT NULL,
+            url_hash INTEGER NOT NULL,
+            url TEXT NOT NULL,
+            depth INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            doc_id INTEGER,
+            message TEXT,
+            finished_at TIMESTAMP,
+            heartbeat_at TIMESTAMP,
+            UNIQUE (crawl_id, url_hash),
+            FOREIGN KEY (crawl_id) REFERENCES site_crawls(id)
+        )
+    ''')
+    _add_columns(cursor, 'site_crawl_urls', {'heartbeat_at': 'TIMESTAMP'})
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_site_crawl_urls_status ON site_crawl_urls(status, depth, id)')
+
+def _create_reprocess_runs(cursor):
+    """Create the table of reprocessing runs and their checkpoints"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS reprocess_runs (
+            id TEXT PRIMARY KEY,
+            category_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'pending',
+            total INTEGER NOT NULL,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            processed INTEGER NOT NULL DEFAULT 0,
+            changed INTEGER NOT NULL DEFAULT 0,
+            unchanged INTEGER NOT NULL DEFAULT 0,
+            skipped INTEGER NOT NULL DEFAULT 0,
+            failed INTEGER NOT NULL DEFAULT 0,
+            message TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP
+        )
+    ''')
+
+# Applied in order, a database at user_version N has run the first N.
+# Tables created before they were versioned already exist, so every step is idempotent.
+MIGRATIONS = [
+    _create_tables,
+    _add_validators,
+    _add_fingerprints,
+    _add_listing_indexes,
+    _create_image_tables,
+    _create_duplicate_tables,
+    _create_vector_tables,
+    _create_job_tables,
+    _create_site_crawl_tables,
+    _create_reprocess_runs,
+]
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(conn) -> int:
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+def migrate(conn) -> int:
+    """Apply the migrations a database has not run yet, returns the version it was at
+
+    The version is kept in SQLite's user_version. Migrations run in one
+    transaction that holds the write lock, so processes starting together
+    apply each of them once.
+    """
+    cursor = conn.cursor()
+    cursor.execute('BEGIN IMMEDIATE')
+    try:
+        version = schema_version(conn)
+        if version > SCHEMA_VERSION:
+            logger.warning(f"Storage schema version {version} is newer than this code's {SCHEMA_VERSION}")
+        for number, step in enumerate(MIGRATIONS[version:], start=version + 1):
+            logger.info(f"Migrating storage schema to version {number}: {step.__doc__}")
+            step(cursor)
+        if version < SCHEMA_VERSION:
+            cursor.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return version
@@ -1,6 +1,11 @@
 #!/bin/bash
+# Usage: ./server.sh [asgi]
+#   asgi  serve with uvicorn, crawls run on the event loop (see asgi.py)
 cd "$(dirname "$0")"
 export PYTHONPATH="$PWD:$PYTHONPATH"
+if [ "$1" = "asgi" ]; then
+    exec python -m uvicorn asgi:app --host 0.0.0.0 --port 8000
+fi
 export FLASK_APP=main.py
 export FLASK_ENV=development
-python -m flask run --host=0.0.0.0 --port=8000
\ No newline at end of file
+python -m flask run --host=0.0.0.0 --port=8000
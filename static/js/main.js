@@ -1,5 +1,9 @@
-let currentPage = 1;
-const perPage = 10;
+const perPage = 50;
+
+// Pagination state of the document list, reset whenever the filters change
+let nextCursor = null;
+let loadingPage = false;
+let listVersion = 0;
 
 // Load documents when page loads
 document.addEventListener('DOMContentLoaded', function() {
@@ -15,6 +19,16 @@ document.addEventListener('DOMContentLoaded', function() {
     // Initial document load
     loadDocuments();
     
+    // Load the next page when the end of the list scrolls into view
+    const sentinel = document.getElementById('resultsSentinel');
+    if (sentinel && 'IntersectionObserver' in window) {
+        new IntersectionObserver(entries => {
+            if (entries.some(entry => entry.isIntersecting)) {
+                loadMoreDocuments();
+            }
+        }, { rootMargin: '200px' }).observe(sentinel);
+    }
+    
     // Handle search form submission
     if (searchForm) {
         searchForm.addEventListener('submit', (e) => {
@@ -200,30 +214,81 @@ function loadCategories(selectCategoryId = null) {
 }
 
 function loadDocuments() {
+    // Start over from the first page
+    listVersion++;
+    nextCursor = null;
+    loadingPage = false;
+    document.getElementById('resultsBody').innerHTML = '';
+    fetchDocuments(true);
+}
+
+function loadMoreDocuments() {
+    if (nextCursor && !loadingPage) {
+        fetchDocuments(false);
+    }
+}
+
+function fetchDocuments(firstPage) {
     const query = document.getElementById('searchInput').value;
     const categoryId = document.getElementById('categoryFilter').value;
+    const version = listVersion;
     
-    let url = '/api/documents';
     const params = new URLSearchParams();
     if (query) params.append('q', query);
     if (categoryId && categoryId !== 'new') params.append('category', categoryId);
-    if (params.toString()) url += '?' + params.toString();
+    params.append('limit', perPage);
+    if (!query) {
+        params.append('fields', 'id,url,title,category_name,created_at');
+        // Only the first page needs the total
+        if (firstPage) {
+            params.append('total', '1');
+        } else {
+            params.append('total', '0');
+            params.append('cursor', nextCursor);
+        }
+    }
     
-    fetch(url)
+    loadingPage = true;
+    fetch('/api/documents?' + params.toString())
         .then(response => response.json())
-        .then(documents => {
-            displayResults(documents);
+        .then(data => {
+            // Ignore responses for filters that have changed since the request
+            if (version !== listVersion) return;
+            loadingPage = false;
+            
+            // Search results are a plain ranked list, listings are pages
+            const documents = Array.isArray(data) ? data : data.items;
+            nextCursor = Array.isArray(data) ? null : data.next_cursor;
+            if (firstPage && !Array.isArray(data)) {
+                updateTotal(data.total);
+            } else if (firstPage) {
+                updateTotal(null);
+            }
+            displayResults(documents, firstPage);
+            
+            // Keep loading while the list is too short to scroll
+            const sentinel = document.getElementById('resultsSentinel');
+            if (nextCursor && sentinel && sentinel.getBoundingClientRect().top < window.innerHeight + 200) {
+                loadMoreDocuments();
+            }
         })
         .catch(error => {
+            if (version === listVersion) loadingPage = false;
             console.error('Error loading documents:', error);
         });
 }
 
-function displayResults(documents) {
+function updateTotal(total) {
+    const totalLabel = document.getElementById('resultsTotal');
+    if (totalLabel) {
+        totalLabel.textContent = total === null || total === undefined ? '' : `${total} documents`;
+    }
+}
+
+function displayResults(documents, firstPage = true) {
     const tbody = document.getElementById('resultsBody');
-    tbody.innerHTML = '';
     
-    if (documents.length === 0) {
+    if (firstPage && documents.length === 0) {
         tbody.innerHTML = '<tr><td colspan="4" class="text-center">No documents found</td></tr>';
         return;
     }
@@ -235,6 +300,7 @@ function displayResults(documents) {
         row.innerHTML = `
             <td>
                 <a href="${doc.url}" target="_blank" title="${doc.url}">${doc.title || 'Untitled'}</a>
+                ${doc.snippet ? `<div class="small text-muted">${formatSnippet(doc.snippet)}</div>` : ''}
             </td>
             <td>${doc.category_name || '-'}</td>
             <td>${createdAt}</td>
@@ -250,6 +316,15 @@ function displayResults(documents) {
     });
 }
 
+// Escape search snippets, keeping only the <mark> highlights added by the server
+function formatSnippet(snippet) {
+    const div = document.createElement('div');
+    div.textContent = snippet;
+    return div.innerHTML
+        .replace(/&lt;mark&gt;/g, '<mark>')
+        .replace(/&lt;\/mark&gt;/g, '</mark>');
+}
+
 async function deleteDocument(docId) {
     if (!confirm('Are you sure you want to delete this document?')) {
         return;
@@ -0,0 +1,32 @@
+import sqlite3
+import functools
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+def is_busy(error):
+    """Whether an exception is SQLite reporting a busy or locked database"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+def retry_on_busy(func):
+    """Retry a storage write when SQLite reports the database as busy or locked
+
+    The decorated method's object must provide `conn` and `busy_retries`.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        for attempt in range(self.busy_retries + 1):
+            try:
+                return func(self, *args, **kwargs)
+            except sqlite3.OperationalError as e:
+                if not is_busy(e) or attempt == self.busy_retries:
+                    raise
+                self.conn.rollback()
+                delay = min(0.05 * (2 ** attempt), 1.0)
+                logger.warning(f"Database busy in {func.__name__}, retrying in {delay:.2f}s")
+                time.sleep(delay)
+    return wrapper